@@ -6,7 +6,7 @@ from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.utils import timezone
-from .models import PurchaseOrder, PurchaseOrderItem, Sale, SaleItem
+from .models import PurchaseOrder, PurchaseOrderItem, Sale, SaleItem, SalesFact
 from .utils import render_to_pdf
 from core.models import Product, Supplier
 from .forms import SaleItemFormSet, PurchaseOrderForm
@@ -129,6 +129,11 @@ class PurchaseOrderAdmin(admin.ModelAdmin):
 
 # --- Sale Admin ---
 
+def _cube_fields(item):
+    """Was an einer Position in die Würfel-Zelle und ihre Beträge eingeht."""
+    return item.product_id, item.quantity, item.unit_price_gross, item.vat_rate
+
+
 @admin.register(Sale)
 class SaleAdmin(admin.ModelAdmin):
     actions = ['action_generate_receipt', 'action_refund_sale']
@@ -161,13 +166,31 @@ class SaleAdmin(admin.ModelAdmin):
     )
     
     def save_related(self, request, form, formsets, change):
+        # Geänderte Positionen im Würfel umbuchen. Neue bucht SaleItem.save,
+        # gelöschte nimmt das pre_delete-Signal heraus.
+        sale = form.instance
+        before = {item.pk: item for item in sale.items.all()}
         super().save_related(request, form, formsets, change)
-        form.instance.calculate_totals()
+        after = SaleItem.objects.in_bulk(list(before))
+        changed = [pk for pk, item in after.items() if _cube_fields(item) != _cube_fields(before[pk])]
+        SalesFact.objects.book_sales([(sale, before[pk]) for pk in changed], sign=-1)
+        SalesFact.objects.book_sales([(sale, after[pk]) for pk in changed])
+        sale.calculate_totals()
 
     def save_model(self, request, obj, form, change):
         if not obj.pk:
             obj.created_by = request.user
+        # Datum oder Zahlungsart korrigiert: bestehende Positionen vom alten
+        # auf den neuen Stand umbuchen (wie SaleQuerySet.set_payment_method)
+        lines = []
+        if change:
+            old = Sale.objects.get(pk=obj.pk)
+            if (old.date, old.payment_method) != (obj.date, obj.payment_method):
+                items = list(old.items.all())
+                SalesFact.objects.book_sales([(old, item) for item in items], sign=-1)
+                lines = [(obj, item) for item in items]
         super().save_model(request, obj, form, change)
+        SalesFact.objects.book_sales(lines)
         
     @admin.action(description='Quittung als PDF exportieren')
     def action_generate_receipt(self, request, queryset):
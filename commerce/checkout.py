@@ -0,0 +1,269 @@
+"""
+Buchungslogik für POS-Checkouts, geteilt von api_checkout und api_checkout_batch.
+
+book_checkout() erwartet, dass der Aufrufer eine Transaktion pro Verkauf
+öffnet, und liefert (payload, http_status) statt einer Response — so kann der
+Batch-Endpoint mehrere offline gepufferte Verkäufe nacheinander buchen und pro
+Verkauf ein Ergebnis zurückgeben.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from jobs.queue import dispatch_on_commit, enqueue
+
+from .models import Product, Sale, SaleItem
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(ValueError):
+    pass
+
+
+def existing_sale_result(sale):
+    return {
+        'success': True,
+        'sale_id': sale.id,
+        'pdf_url': f"/commerce/sale/{sale.id}/pdf/",
+        'duplicate_prevented': True,
+    }, 200
+
+
+def parse_offline_created_at(value):
+    """
+    Zeitpunkt, an dem die Kasse einen Verkauf offline erfasst hat
+    (ms seit Epoch oder ISO-8601). Liegt er in der Zukunft oder weiter als
+    POS_OFFLINE_MAX_AGE_HOURS zurück, wird die Buchung abgelehnt.
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        created = datetime.fromtimestamp(value / 1000, tz=timezone.get_current_timezone())
+    else:
+        created = parse_datetime(str(value))
+        if created is None:
+            raise CheckoutError(f"Ungültiger Offline-Zeitstempel: {value}")
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
+    now = timezone.now()
+    max_age = timedelta(hours=getattr(settings, 'POS_OFFLINE_MAX_AGE_HOURS', 72))
+    # Etwas Spielraum für Uhren-Drift zwischen Kasse und Server
+    if created > now + timedelta(minutes=5) or created < now - max_age:
+        raise CheckoutError(f"Offline-Zeitstempel ausserhalb des erlaubten Bereichs: {value}")
+    return min(created, now)
+
+
+def book_checkout(user, data, offline=False):
+    """
+    Bucht einen Checkout aus dem POS-Payload. Fehler (unbekannter Artikel,
+    ungültiger Zeitstempel) werden geworfen, der Aufrufer rollt zurück.
+    offline_created_at zählt nur mit offline=True (Nachbuchen aus dem
+    Service Worker); online gebuchte Verkäufe tragen immer die Serverzeit.
+    """
+    items = data.get('items', [])
+    payment_method = data.get('payment_method', 'CASH')
+    customer_data = data.get('customer', None)
+    transaction_code = data.get('transaction_code', '')
+    idempotency_key = (data.get('idempotency_key') or '').strip() or None
+    confirm_duplicate = bool(data.get('confirm_duplicate'))
+
+    if not items:
+        return {'success': False, 'error': 'Warenkorb leer'}, 200
+
+    logger.info(
+        "checkout.request user=%s method=%s items=%d tx_code=%s idem=%s confirm_dup=%s",
+        user.id, payment_method, len(items),
+        transaction_code or '-', idempotency_key or '-', confirm_duplicate,
+    )
+
+    # --- Doppelter Boden, Schicht 1: exakter Idempotency-Key match ---
+    if idempotency_key:
+        existing = Sale.objects.filter(idempotency_key=idempotency_key).first()
+        if existing:
+            logger.info("checkout.duplicate_prevented layer=idempotency sale=%s", existing.id)
+            return existing_sale_result(existing)
+
+    # --- Doppelter Boden, Schicht 2: gleicher SumUp transaction_code ---
+    # Gleiches Pattern wie Shopify-Webhook (views.py: shopify_webhook).
+    if transaction_code:
+        existing = Sale.objects.filter(transaction_id=transaction_code).first()
+        if existing:
+            logger.info("checkout.duplicate_prevented layer=tx_code sale=%s tx=%s",
+                        existing.id, transaction_code)
+            return existing_sale_result(existing)
+
+    # Offline erfasste Verkäufe tragen den Zeitpunkt an der Kasse mit, damit
+    # Tagesabschluss und Kassenbuch stimmen. Geprüft erst nach Schicht 1/2:
+    # ein bereits gebuchter Replay darf nicht an einem alten Zeitstempel scheitern.
+    sale_date = (parse_offline_created_at(data.get('offline_created_at')) if offline else None) or timezone.now()
+
+    # --- Doppelter Boden, Schicht 3: naher Duplikat-Verdacht ---
+    # Gleicher Operator + Betrag + Zahlungsmethode innert 60s → Rückfrage.
+    # NUR für Zahlungen ohne externe Transaktion-ID. Bei SumUp haben zwei
+    # legitime Zahlungen unterschiedliche transaction_codes — Schicht 2
+    # blockiert echte Doppelbuchungen bereits sauber. Ein 409 hier wäre
+    # brandgefährlich: die Karte wurde bereits belastet, "Abbrechen" würde
+    # zu "Geld kassiert, kein Sale gebucht" führen.
+    cart_total = Decimal('0.00')
+    for it in items:
+        try:
+            qty_i = int(it.get('qty', 0))
+            price_raw = it.get('custom_price') if it.get('custom_price') is not None else it.get('price', 0)
+            cart_total += Decimal(str(price_raw)) * qty_i
+        except (ValueError, TypeError, ArithmeticError):
+            continue
+
+    if not confirm_duplicate and cart_total > 0 and not transaction_code:
+        recent_cutoff = timezone.now() - timedelta(seconds=60)
+        near_dup = Sale.objects.filter(
+            created_by=user,
+            payment_method=payment_method,
+            total_amount_gross=cart_total,
+            status=Sale.Status.COMPLETED,
+            date__gte=recent_cutoff,
+        ).exists()
+        if near_dup:
+            logger.warning("checkout.near_duplicate user=%s amount=%s method=%s",
+                           user.id, cart_total, payment_method)
+            return {
+                'success': False,
+                'needs_confirmation': True,
+                'warning': 'Vor weniger als 60 Sekunden wurde bereits ein Verkauf mit identischem Betrag und Zahlungsmethode gebucht. Wirklich nochmal buchen?',
+            }, 409
+
+    # Phasen-Timings (ms) für checkout.timing — zeigt, wo die Latenz an der Kasse entsteht.
+    timings = {}
+    t_phase = time.perf_counter()
+
+    def _lap(name):
+        nonlocal t_phase
+        now = time.perf_counter()
+        timings[name] = (now - t_phase) * 1000
+        t_phase = now
+
+    # 1. Alle Artikel samt MWST in einer Query laden
+    products = Product.objects.select_related('vat').in_bulk(
+        {int(item['id']) for item in items}
+    )
+    _lap('load')
+
+    # 2. Positionen und Totals im Speicher berechnen — noch nichts geschrieben,
+    #    ein unbekannter Artikel hinterlässt also keinen halben Sale.
+    lines = []
+    total_gross = Decimal('0.00')
+    total_net = Decimal('0.00')
+    for item in items:
+        product = products.get(int(item['id']))
+        if product is None:
+            raise Product.DoesNotExist(f"Artikel {item['id']} nicht gefunden")
+        qty = int(item['qty'])
+
+        # Preis ermitteln:
+        # Standard: Preis aus DB
+        # Ausnahme: 'custom_price' im Request UND Produkt SKU ist 'DIVERSES'
+        custom_price_raw = item.get('custom_price')
+        unit_price = product.sales_price
+        if product.sku == 'DIVERSES' and custom_price_raw is not None:
+            try:
+                unit_price = Decimal(str(custom_price_raw))
+            except:
+                pass # Fallback auf Produktpreis (0.00) bei Fehler
+
+        # WICHTIG: Die VAT Rate muss explizit ermittelt und übergeben werden.
+        # Wenn unit_price gesetzt ist, greift die automatische Ermittlung im Model.save() oft nicht.
+        vat_rate = product.vat.rate if product.vat else Decimal('0.00')
+
+        line = SaleItem(product=product, quantity=qty, unit_price_gross=unit_price, vat_rate=vat_rate)
+        lines.append(line)
+        total_gross += line.total_price_gross
+        # Netto = Brutto / (1 + Steuersatz)
+        total_net += line.total_price_gross / (Decimal('1.00') + (vat_rate / Decimal('100.00')))
+
+    customer_fields = {}
+    if payment_method == 'INVOICE' and customer_data:
+        # CLEANING: Leerzeichen entfernen
+        customer_data['email'] = (customer_data.get('email') or '').strip()
+        customer_fields = {
+            'customer_first_name': (customer_data.get('first_name') or '').strip(),
+            'customer_last_name': (customer_data.get('last_name') or '').strip(),
+            'customer_address': (customer_data.get('address') or '').strip(),
+            'customer_zip_code': (customer_data.get('zip_code') or '').strip(),
+            'customer_city': (customer_data.get('city') or '').strip(),
+            'customer_email': customer_data['email'],
+        }
+    _lap('compute')
+
+    # 3. Sale einmal mit fertigen Totals und Kundendaten anlegen
+    try:
+        with transaction.atomic():
+            sale = Sale.objects.create(
+                date=sale_date,
+                payment_method=payment_method,
+                status=Sale.Status.COMPLETED,
+                created_by=user,
+                channel=Sale.SalesChannel.POS,
+                transaction_id=transaction_code or None,
+                idempotency_key=idempotency_key,
+                total_amount_gross=total_gross,
+                total_amount_net=round(total_net, 2),
+                invoice_status=Sale.InvoiceStatus.PENDING if customer_fields else Sale.InvoiceStatus.NOT_APPLICABLE,
+                **customer_fields,
+            )
+    except IntegrityError:
+        # Letzter Schutzwall: Race zwischen zwei parallelen Requests.
+        # Der andere Request war schneller — existierenden Sale zurückgeben.
+        existing = None
+        if idempotency_key:
+            existing = Sale.objects.filter(idempotency_key=idempotency_key).first()
+        if not existing and transaction_code:
+            existing = Sale.objects.filter(transaction_id=transaction_code).first()
+        if existing:
+            return existing_sale_result(existing)
+        raise
+    _lap('sale')
+
+    # 4. Positionen in einem INSERT, Lagerabgang in einem Ledger-Write
+    sale.add_items(lines)
+    _lap('items')
+
+    # PDF URL Logic (Standard: Thermo-Bon)
+    pdf_url = f"/commerce/sale/{sale.id}/pdf/"
+
+    # 5. Spezifische Logik für RECHNUNG: Outbox statt SMTP in der Transaktion.
+    #    PDF-Rendering und Versand laufen nach dem Commit im Hintergrund,
+    #    die Kasse bekommt ihren Beleg sofort; invoice_status wird nachgeführt.
+    invoice_job = None
+    if payment_method == 'INVOICE' and customer_data:
+        invoice_job = enqueue('commerce.send_invoice', sale_id=sale.id)
+        dispatch_on_commit(invoice_job)
+        _lap('invoice')
+
+    logger.info(
+        "checkout.timing sale=%s items=%d %s total=%.1fms",
+        sale.id, len(lines),
+        ' '.join(f"{name}={ms:.1f}ms" for name, ms in timings.items()),
+        sum(timings.values()),
+    )
+    logger.info("checkout.success sale=%s user=%s method=%s tx=%s gross=%s",
+                sale.id, user.id, payment_method, transaction_code or '-', total_gross)
+
+    response_data = {
+        'success': True,
+        'sale_id': sale.id,
+        'pdf_url': pdf_url,
+        'admin_url': reverse('admin:commerce_sale_change', args=[sale.id]),
+        'resend_invoice_url': reverse('sale_resend_invoice', args=[sale.id]),
+    }
+    if invoice_job is not None:
+        response_data['invoice_status'] = sale.invoice_status
+        response_data['invoice_status_url'] = reverse('api_invoice_status', args=[sale.id])
+    return response_data, 200
+
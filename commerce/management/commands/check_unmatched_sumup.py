@@ -25,7 +25,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from commerce.models import Sale
-from reconciliation.sumup_client import SumUpClient, SumUpAPIError
+from reconciliation.sumup_client import SumUpAPIError
+from reconciliation.sync import day_bounds, ensure_synced, transactions_between
 
 logger = logging.getLogger(__name__)
 
@@ -86,19 +87,14 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Prüfe SumUp ↔ Stock Keeper für {check_date}…")
 
-        # --- SumUp Seite ---
+        # --- SumUp Seite (lokaler Spiegel, siehe sync_sumup_transactions) ---
         try:
-            client = SumUpClient()
-            data = client._get('/v0.1/me/transactions/history', params={
-                'oldest_time': f'{check_date.isoformat()}T00:00:00Z',
-                'newest_time': f'{check_date.isoformat()}T23:59:59Z',
-                'limit': 100,
-            })
-            txns = data.get('items', [])
+            ensure_synced(day_bounds(check_date, check_date)[1])
         except SumUpAPIError as e:
             logger.error("check_unmatched_sumup: SumUp API Fehler: %s", e)
             self.stderr.write(f"SumUp API Fehler: {e}")
             return
+        txns = list(transactions_between(check_date, check_date).values_list('raw', flat=True))
 
         payments = [
             t for t in txns
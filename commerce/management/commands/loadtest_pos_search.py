@@ -0,0 +1,148 @@
+"""
+Lasttest: Latenz der POS-Suche, während SumUp langsam antwortet.
+
+Startet den SumUp-Stand-in mit künstlicher Antwortzeit (--sumup-delay) und
+schickt --slow gleichzeitige /verify-sumup-Anfragen, die je einen eigenen
+Upstream-Call machen. Parallel fragt ein Client die POS-Suche im Takt ab.
+Gemessen wird die Suchlatenz ohne (Baseline) und mit SumUp-Last:
+
+  --server asgi  stock_keeper.asgi im Prozess über httpx.ASGITransport —
+                 ein Event-Loop, wie ein Uvicorn-Worker
+  --server wsgi  stock_keeper.wsgi hinter einem Pool aus --workers Threads —
+                 bildet die synchronen Gunicorn-Worker nach
+
+    python manage.py loadtest_pos_search --server wsgi --workers 3
+    python manage.py loadtest_pos_search --server asgi
+
+Legt für die Dauer des Laufs einen Staff-User samt Session an und entfernt
+beide danach wieder.
+"""
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.models import Product
+from reconciliation.standin import Dataset, serve
+
+SEARCH_PATH = '/commerce/api/search/'
+VERIFY_PATH = '/commerce/api/verify-sumup/'
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+class Command(BaseCommand):
+    help = "Misst die POS-Suchlatenz unter langsamen SumUp-Calls (ASGI vs. synchrone Worker)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['asgi', 'wsgi'], default='asgi')
+        parser.add_argument('--workers', type=int, default=3, help='Sync-Worker im WSGI-Modus. Default: 3.')
+        parser.add_argument('--slow', type=int, default=3, help='Gleichzeitige SumUp-Verifizierungen. Default: 3.')
+        parser.add_argument('--sumup-delay', type=float, default=3.0, help='Antwortzeit des Stand-ins (s). Default: 3.')
+        parser.add_argument('--duration', type=float, default=4.0, help='Messdauer pro Phase (s). Default: 4.')
+        parser.add_argument('--interval', type=float, default=0.05, help='Takt der Suchanfragen (s). Default: 0.05.')
+        parser.add_argument('--query', default=None, help='Suchbegriff. Default: erstes Wort eines aktiven Artikels.')
+
+    def handle(self, *args, **opts):
+        product = Product.objects.filter(is_active=True).only('name').first()
+        query = opts['query'] or (product.name.split()[0] if product else 'a')
+
+        user = get_user_model().objects.create_user(f"loadtest-{uuid.uuid4().hex[:8]}", is_staff=True)
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        self.cookies = {settings.SESSION_COOKIE_NAME: session.session_key}
+        self.base_url = f"http://{next((h for h in settings.ALLOWED_HOSTS if h and h != '*'), 'localhost')}"
+
+        server = serve(Dataset(per_month=200, months=1), background=True, delay=opts['sumup_delay'])
+        overrides = dict(SUMUP_API_BASE=f"http://127.0.0.1:{server.server_port}", SUMUP_API_KEY='loadtest',
+                         SUMUP_RATE_PER_SECOND=10_000, SUMUP_RATE_BURST=10_000)
+        try:
+            with override_settings(**overrides):
+                run = self._run_asgi if opts['server'] == 'asgi' else self._run_wsgi
+                run(query, opts, slow=0)  # Aufwärmen: Suchindex, Imports
+                phases = [('baseline', run(query, opts, slow=0)),
+                          (f"{opts['slow']}× SumUp", run(query, opts, slow=opts['slow']))]
+        finally:
+            server.shutdown()
+            server.server_close()
+            session.delete()
+            user.delete()
+
+        mode = 'asgi' if opts['server'] == 'asgi' else f"wsgi, {opts['workers']} Worker"
+        self.stdout.write(f"POS-Suche '{query}' ({mode}), SumUp-Antwortzeit {opts['sumup_delay']:.1f} s")
+        for name, (latencies, slow) in phases:
+            ms = [v * 1000 for v in latencies]
+            line = (f"  {name:<12} n={len(ms):>4}  p50 {statistics.median(ms):>7.1f} ms  "
+                    f"p95 {_percentile(ms, 0.95):>7.1f} ms  max {max(ms):>7.1f} ms")
+            if slow:
+                line += f"  | verify {min(slow):.1f}–{max(slow):.1f} s"
+            self.stdout.write(line)
+
+    def _verify_params(self, i):
+        # Zeitpunkt vor dem Lookback-Fenster → eigener Cache-Key, eigener Upstream-Call
+        lookback = getattr(settings, 'SUMUP_RECENT_LOOKBACK_MINUTES', 20)
+        ts = timezone.now() - timedelta(minutes=lookback + 5 + i)
+        return {'amount': '12.90', 'timestamp': int(ts.timestamp() * 1000)}
+
+    def _run_asgi(self, query, opts, slow):
+        async def timed(client, path, params):
+            t0 = time.perf_counter()
+            await client.get(path, params=params)
+            return time.perf_counter() - t0
+
+        async def main():
+            transport = httpx.ASGITransport(app=get_asgi_application())
+            async with httpx.AsyncClient(transport=transport, base_url=self.base_url, cookies=self.cookies,
+                                         timeout=60) as client:
+                slow_tasks = [asyncio.create_task(timed(client, VERIFY_PATH, self._verify_params(i)))
+                              for i in range(slow)]
+                await asyncio.sleep(0.1)  # SumUp-Calls sind unterwegs
+                latencies = []
+                deadline = time.perf_counter() + opts['duration']
+                while time.perf_counter() < deadline:
+                    latencies.append(await timed(client, SEARCH_PATH, {'q': query}))
+                    await asyncio.sleep(opts['interval'])
+                return latencies, await asyncio.gather(*slow_tasks)
+
+        return asyncio.run(main())
+
+    def _run_wsgi(self, query, opts, slow):
+        app = get_wsgi_application()
+
+        def get(path, params):
+            with httpx.Client(transport=httpx.WSGITransport(app=app), base_url=self.base_url,
+                              cookies=self.cookies) as client:
+                t0 = time.perf_counter()
+                client.get(path, params=params)
+                return time.perf_counter() - t0
+
+        with ThreadPoolExecutor(max_workers=opts['workers']) as workers:
+            slow_futures = [workers.submit(get, VERIFY_PATH, self._verify_params(i)) for i in range(slow)]
+            time.sleep(0.1)
+            latencies = []
+            deadline = time.perf_counter() + opts['duration']
+            while time.perf_counter() < deadline:
+                # Latenz inkl. Warten auf einen freien Worker
+                t0 = time.perf_counter()
+                workers.submit(get, SEARCH_PATH, {'q': query}).result()
+                latencies.append(time.perf_counter() - t0)
+                time.sleep(opts['interval'])
+            return latencies, [f.result() for f in slow_futures]
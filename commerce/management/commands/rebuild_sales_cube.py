@@ -0,0 +1,96 @@
+"""
+Baut den Reporting-Würfel (SalesFact) für einen Datumsbereich neu auf.
+
+Die Erstbefüllung macht die Migration 0014 (0015 für die Storno-Zeilen); das
+Command ist für Korrekturen, die nicht über Verkauf/Storno/Zahlungsart-Korrektur
+oder den Sale-Admin laufen (Artikel umkategorisiert, Änderungen direkt in der DB).
+Die Zellen im Bereich werden gelöscht und neu verdichtet: SALE aus allen
+Verkäufen mit Verkaufstag im Bereich, REFUND aus den Stornos mit Storno-Tag im
+Bereich — aggregiert in der Datenbank, Python rechnet nur noch pro Zelle Netto
+und MWST.
+
+    python manage.py rebuild_sales_cube
+    python manage.py rebuild_sales_cube --from 2025-01-01 --to 2025-12-31
+"""
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Min, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from commerce.models import Sale, SaleItem, SalesFact
+
+
+class Command(BaseCommand):
+    help = "Baut den Reporting-Würfel (Tag × Artikel × Kanal × Zahlungsart × MWST × Verkauf/Storno) neu auf."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='Erster Tag YYYY-MM-DD. Default: erster Verkauf.')
+        parser.add_argument('--to', dest='date_to', help='Letzter Tag YYYY-MM-DD. Default: heute.')
+
+    def handle(self, *args, **opts):
+        try:
+            date_from = date.fromisoformat(opts['date_from']) if opts['date_from'] else None
+            date_to = date.fromisoformat(opts['date_to']) if opts['date_to'] else timezone.localdate()
+        except ValueError:
+            raise CommandError("Datum im Format YYYY-MM-DD angeben")
+        if date_from is None:
+            first = Sale.objects.aggregate(first=Min('date'))['first']
+            date_from = timezone.localdate(first) if first else date_to
+        if date_from > date_to:
+            raise CommandError("--from liegt nach --to")
+        started = time.perf_counter()
+
+        gross_expr = ExpressionWrapper(
+            F('quantity') * Coalesce(F('unit_price_gross'), Value(Decimal('0.00'))),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        )
+        # Verkäufe am Verkaufstag (auch später stornierte), Stornos negativ am Storno-Tag
+        sources = [
+            (SalesFact.Kind.SALE, 1, 'sale__date', SaleItem.objects.all()),
+            (SalesFact.Kind.REFUND, -1, 'sale__refunded_at',
+             SaleItem.objects.filter(sale__status=Sale.Status.REFUNDED)),
+        ]
+
+        facts = {}
+        for kind, sign, moment, items in sources:
+            rows = (
+                items
+                .filter(**{f'{moment}__date__gte': date_from, f'{moment}__date__lte': date_to})
+                .values(
+                    'product_id', 'product__category_id', 'sale__channel', 'sale__payment_method',
+                    day=TruncDate(moment),
+                    rate=Coalesce('vat_rate', Value(Decimal('0.00'))),
+                )
+                .annotate(qty=Sum('quantity'), gross=Sum(gross_expr))
+                .order_by()
+            )
+            for row in rows:
+                rate = Decimal(row['rate']).quantize(Decimal('0.01'))
+                key = (row['day'], row['product_id'], row['sale__channel'], row['sale__payment_method'], rate, kind)
+                fact = facts.get(key)
+                if fact is None:
+                    fact = facts[key] = SalesFact(
+                        day=row['day'], kind=kind, product_id=row['product_id'],
+                        category_id=row['product__category_id'], channel=row['sale__channel'],
+                        payment_method=row['sale__payment_method'], vat_rate=rate,
+                        quantity=0, gross=Decimal('0.00'),
+                    )
+                fact.quantity += sign * (row['qty'] or 0)
+                fact.gross += sign * Decimal(row['gross'] or 0)
+        for fact in facts.values():
+            fact.net = (fact.gross / (Decimal('1.00') + fact.vat_rate / Decimal('100.00'))).quantize(Decimal('0.0001'))
+            fact.vat = fact.gross - fact.net
+
+        with transaction.atomic():
+            deleted, _ = SalesFact.objects.filter(day__gte=date_from, day__lte=date_to).delete()
+            SalesFact.objects.bulk_create(facts.values(), batch_size=2000)
+
+        self.stdout.write(
+            f"{date_from} – {date_to}: {len(facts)} Zellen geschrieben, {deleted} ersetzt "
+            f"in {time.perf_counter() - started:.1f} s"
+        )
@@ -36,7 +36,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from commerce.models import Sale
-from reconciliation.sumup_client import SumUpClient, SumUpAPIError
+from reconciliation.sumup_client import SumUpAPIError
+from reconciliation.sync import day_bounds, sync_transactions, transactions_between
 
 logger = logging.getLogger(__name__)
 
@@ -90,13 +91,15 @@ class Command(BaseCommand):
             f"{' [DRY-RUN]' if dry_run else ''}…"
         )
 
+        # Das ganze --days-Fenster neu laden: Refunds ändern refunded_amount
+        # älterer Zahlungen, die ein inkrementeller Lauf nicht mehr anfasst.
         try:
-            client = SumUpClient()
-            txns = client.get_transactions_in_window(start_date, end_date)
+            sync_transactions(since=day_bounds(start_date, end_date)[0])
         except SumUpAPIError as e:
             logger.error("sync_sumup_refunds: SumUp API Fehler: %s", e)
             self.stderr.write(f"SumUp API Fehler: {e}")
             return
+        txns = list(transactions_between(start_date, end_date).values_list('raw', flat=True))
 
         # Refunds aus der Historie sammeln (REFUND-Einträge + PAYMENT.refunded_amount)
         refund_events = defaultdict(list)   # code -> [REFUND-Einträge]
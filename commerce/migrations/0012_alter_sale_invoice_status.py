@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0011_webshop_bot_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sale',
+            name='invoice_status',
+            field=models.CharField(choices=[('NA', 'Nicht anwendbar'), ('PENDING', 'Versand ausstehend'), ('SENT', 'Versendet'), ('FAILED', 'Versand fehlgeschlagen'), ('RESENT', 'Erneut versendet')], default='NA', max_length=10),
+        ),
+    ]
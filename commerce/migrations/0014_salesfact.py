@@ -0,0 +1,71 @@
+# Generated by Django 5.2.9 on 2026-10-17 00:06
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_sales_facts(apps, schema_editor):
+    # Erstbefüllung aus allen abgeschlossenen Verkäufen (wie rebuild_sales_cube)
+    SaleItem = apps.get_model('commerce', 'SaleItem')
+    SalesFact = apps.get_model('commerce', 'SalesFact')
+    gross_expr = ExpressionWrapper(
+        F('quantity') * Coalesce(F('unit_price_gross'), Value(Decimal('0.00'))),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    rows = (
+        SaleItem.objects.filter(sale__status='COMPLETED')
+        .values('product_id', 'product__category_id', 'sale__channel', 'sale__payment_method',
+                day=TruncDate('sale__date'), rate=Coalesce('vat_rate', Value(Decimal('0.00'))))
+        .annotate(qty=Sum('quantity'), gross=Sum(gross_expr))
+        .order_by()
+    )
+    facts = {}
+    for row in rows:
+        rate = Decimal(row['rate']).quantize(Decimal('0.01'))
+        key = (row['day'], row['product_id'], row['sale__channel'], row['sale__payment_method'], rate)
+        fact = facts.setdefault(key, SalesFact(
+            day=row['day'], product_id=row['product_id'], category_id=row['product__category_id'],
+            channel=row['sale__channel'], payment_method=row['sale__payment_method'], vat_rate=rate,
+            quantity=0, gross=Decimal('0.00'),
+        ))
+        fact.quantity += row['qty'] or 0
+        fact.gross += Decimal(row['gross'] or 0)
+    for fact in facts.values():
+        fact.net = (fact.gross / (Decimal('1.00') + fact.vat_rate / Decimal('100.00'))).quantize(Decimal('0.0001'))
+        fact.vat = fact.gross - fact.net
+    SalesFact.objects.bulk_create(facts.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0013_sale_updated_at'),
+        ('core', '0010_seed_stuetzstruempfe_pickup_notice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('channel', models.CharField(choices=[('POS', 'Ladenlokal (Kasse)'), ('WEB', 'Online Shop (Shopify)'), ('MANUAL', 'Manuell / Telefon')], max_length=10)),
+                ('payment_method', models.CharField(choices=[('CASH', 'Barzahlung'), ('SUMUP', 'SumUp (Karte)'), ('SHOPIFY', 'Shopify Payments'), ('TWINT', 'Twint'), ('INVOICE', 'Rechnung'), ('PAYREXX', 'Payrexx (Webshop online)')], max_length=20)),
+                ('vat_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('quantity', models.IntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('net', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('vat', models.DecimalField(decimal_places=4, default=0, max_digits=14)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'channel', 'payment_method', 'vat_rate'), name='unique_sales_fact_cell')],
+            },
+        ),
+        migrations.RunPython(backfill_sales_facts, migrations.RunPython.noop),
+    ]
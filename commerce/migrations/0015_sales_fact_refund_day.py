@@ -0,0 +1,88 @@
+# Generated by Django 5.2.9 on 2026-10-17 00:28
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_refunds(apps, schema_editor):
+    # Storno-Zeitpunkt bestehender Stornos: die Rückbuchung ins Lager (RETURN),
+    # sonst die letzte Änderung des Sales
+    Sale = apps.get_model('commerce', 'Sale')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    StockMovement = apps.get_model('core', 'StockMovement')
+    sale_type = ContentType.objects.filter(app_label='commerce', model='sale').first()
+    returns = StockMovement.objects.filter(
+        content_type=sale_type, object_id=OuterRef('pk'), movement_type='RETURN',
+    ).order_by('created_at').values('created_at')[:1]
+    Sale.objects.filter(status='REFUNDED', refunded_at__isnull=True).update(
+        refunded_at=Coalesce(Subquery(returns), F('updated_at'), F('date')),
+    )
+
+    # Würfel neu: alle Verkäufe am Verkaufstag, Stornos negativ am Storno-Tag
+    # (wie rebuild_sales_cube; 0014 hatte nur abgeschlossene Verkäufe)
+    SaleItem = apps.get_model('commerce', 'SaleItem')
+    SalesFact = apps.get_model('commerce', 'SalesFact')
+    gross_expr = ExpressionWrapper(
+        F('quantity') * Coalesce(F('unit_price_gross'), Value(Decimal('0.00'))),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+    facts = {}
+    for kind, sign, moment, items in [
+        ('SALE', 1, 'sale__date', SaleItem.objects.all()),
+        ('REFUND', -1, 'sale__refunded_at', SaleItem.objects.filter(sale__status='REFUNDED')),
+    ]:
+        rows = (
+            items.values('product_id', 'product__category_id', 'sale__channel', 'sale__payment_method',
+                         day=TruncDate(moment), rate=Coalesce('vat_rate', Value(Decimal('0.00'))))
+            .annotate(qty=Sum('quantity'), gross=Sum(gross_expr))
+            .order_by()
+        )
+        for row in rows:
+            rate = Decimal(row['rate']).quantize(Decimal('0.01'))
+            key = (row['day'], row['product_id'], row['sale__channel'], row['sale__payment_method'], rate, kind)
+            fact = facts.setdefault(key, SalesFact(
+                day=row['day'], kind=kind, product_id=row['product_id'], category_id=row['product__category_id'],
+                channel=row['sale__channel'], payment_method=row['sale__payment_method'], vat_rate=rate,
+                quantity=0, gross=Decimal('0.00'),
+            ))
+            fact.quantity += sign * (row['qty'] or 0)
+            fact.gross += sign * Decimal(row['gross'] or 0)
+    for fact in facts.values():
+        fact.net = (fact.gross / (Decimal('1.00') + fact.vat_rate / Decimal('100.00'))).quantize(Decimal('0.0001'))
+        fact.vat = fact.gross - fact.net
+    SalesFact.objects.all().delete()
+    SalesFact.objects.bulk_create(facts.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0014_salesfact'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0010_seed_stuetzstruempfe_pickup_notice'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='salesfact',
+            name='unique_sales_fact_cell',
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='refunded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='salesfact',
+            name='kind',
+            field=models.CharField(choices=[('SALE', 'Verkauf'), ('REFUND', 'Storno')], default='SALE', max_length=10),
+        ),
+        migrations.AddConstraint(
+            model_name='salesfact',
+            constraint=models.UniqueConstraint(fields=('day', 'product', 'channel', 'payment_method', 'vat_rate', 'kind'), name='unique_sales_fact_cell'),
+        ),
+        migrations.RunPython(backfill_refunds, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.db import transaction
-from core.models import Product, Supplier, StockMovement # Wichtig: StockMovement für Audit
+from core.models import Category, Product, Supplier, StockMovement # Wichtig: StockMovement für Audit
 from decimal import Decimal 
 
 # --- EINKAUF (Purchase) ---
@@ -46,25 +48,26 @@ class PurchaseOrder(models.Model):
 
     def _process_stock_arrival(self):
         """
-        Interne Hilfsmethode: Bucht den Bestand via adjust_stock (Audit Log).
+        Interne Hilfsmethode: Bucht den Bestand via bulk_adjust_stock (Audit Log).
         Aktualisiert VORHER den Durchschnittspreis (Moving Average).
+        Query-Anzahl ist unabhängig von der Anzahl Bestellpositionen.
         """
-        for item in self.items.all():
-            product = item.product
-            
-            # 1. Durchschnittspreis aktualisieren (bevor der Bestand erhöht wird!)
-            # Wir nutzen den Preis aus der Bestellung (unit_price)
-            if item.unit_price and item.unit_price > 0:
-                product.update_moving_average_price(item.quantity, item.unit_price)
-
-            # 2. Bestand erhöhen & Audit Log schreiben
-            product.adjust_stock(
-                quantity=item.quantity,
-                movement_type=StockMovement.Type.PURCHASE,
-                user=self.created_by,
-                reference=self, 
-                notes=f"Wareneingang Bestellung #{self.id}"
-            )
+        items = list(self.items.all())
+
+        # 1. Durchschnittspreis aktualisieren (bevor der Bestand erhöht wird!)
+        # Wir nutzen den Preis aus der Bestellung (unit_price)
+        Product.objects.bulk_update_moving_average_price(
+            (item.product_id, item.quantity, item.unit_price) for item in items
+        )
+
+        # 2. Bestand erhöhen & Audit Log schreiben
+        Product.objects.bulk_adjust_stock(
+            [(item.product_id, item.quantity) for item in items],
+            movement_type=StockMovement.Type.PURCHASE,
+            reference=self,
+            user=self.created_by,
+            notes=f"Wareneingang Bestellung #{self.id}",
+        )
 
     @transaction.atomic
     def mark_as_received(self):
@@ -97,6 +100,65 @@ class PurchaseOrderItem(models.Model):
 
 # --- VERKAUF (Sale) ---
 
+class SaleQuerySet(models.QuerySet):
+
+    @transaction.atomic
+    def bulk_refund(self, user=None):
+        """
+        Storniert alle noch abgeschlossenen Sales des QuerySets wie Sale.refund,
+        aber gesammelt: 1x SELECT ... FOR UPDATE, 1x UPDATE Status, 1x Laden der
+        Positionen, eine Lagerbuchung (StockMovement pro Position, mit eigenem Beleg).
+        Ohne user wird wie bei Sale.refund dem Ersteller des Sales zugeordnet.
+        Gibt die stornierten Sales zurück.
+        """
+        sales = list(
+            self.select_for_update().filter(status=Sale.Status.COMPLETED).order_by('pk')
+        )
+        if not sales:
+            return []
+        by_id = {sale.pk: sale for sale in sales}
+        now = timezone.now()
+        Sale.objects.filter(pk__in=by_id).update(status=Sale.Status.REFUNDED, refunded_at=now, updated_at=now)
+        for sale in sales:
+            sale.status, sale.refunded_at = Sale.Status.REFUNDED, now
+
+        creators = {}
+        if user is None:
+            creators = get_user_model().objects.in_bulk(
+                {sale.created_by_id for sale in sales if sale.created_by_id}
+            )
+        items = list(SaleItem.objects.filter(sale_id__in=by_id).order_by('sale_id', 'pk'))
+        lines = [
+            (item.product_id, item.quantity, by_id[item.sale_id], f"Storno Verkauf #{item.sale_id}",
+             user or creators.get(by_id[item.sale_id].created_by_id))
+            for item in items
+        ]
+        Product.objects.bulk_adjust_stock(lines, movement_type=StockMovement.Type.RETURN)
+        SalesFact.objects.book([(by_id[item.sale_id], item) for item in items], sign=-1, kind=SalesFact.Kind.REFUND)
+        return sales
+
+    @transaction.atomic
+    def set_payment_method(self, payment_method):
+        """
+        Ändert die Zahlungsart (Korrektur aus dem Abgleich) und zieht den
+        Umsatz im Reporting-Würfel von der alten auf die neue Zahlungsart um,
+        bei stornierten Sales auch die Storno-Zeilen.
+        Gibt die Anzahl geänderter Sales zurück.
+        """
+        sales = list(self.select_for_update().exclude(payment_method=payment_method).order_by('pk'))
+        if not sales:
+            return 0
+        by_id = {sale.pk: sale for sale in sales}
+        Sale.objects.filter(pk__in=by_id).update(payment_method=payment_method, updated_at=timezone.now())
+
+        lines = [(by_id[item.sale_id], item) for item in SaleItem.objects.filter(sale_id__in=by_id)]
+        SalesFact.objects.book_sales(lines, sign=-1)
+        for sale in sales:
+            sale.payment_method = payment_method
+        SalesFact.objects.book_sales(lines)
+        return len(sales)
+
+
 class Sale(models.Model):
     date = models.DateTimeField(default=timezone.now)
     total_amount_net = models.DecimalField(max_digits=12, decimal_places=2, default=0)
@@ -132,6 +194,8 @@ class Sale(models.Model):
     )
 
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.COMPLETED)
+    # Zeitpunkt des Stornos — der Reporting-Würfel bucht Stornos auf diesen Tag
+    refunded_at = models.DateTimeField(null=True, blank=True)
 
     # Optional: User für Audit Log
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
@@ -151,6 +215,7 @@ class Sale(models.Model):
 
     class InvoiceStatus(models.TextChoices):
         NOT_APPLICABLE = 'NA', 'Nicht anwendbar'
+        PENDING = 'PENDING', 'Versand ausstehend'  # Job eingereiht, Versand nach Commit
         SENT = 'SENT', 'Versendet'
         FAILED = 'FAILED', 'Versand fehlgeschlagen'
         RESENT = 'RESENT', 'Erneut versendet'
@@ -161,6 +226,12 @@ class Sale(models.Model):
     invoice_sent_at = models.DateTimeField(null=True, blank=True)
     invoice_last_error = models.TextField(blank=True, default='')
 
+    # Letzte Änderung — Reconciliation gleicht damit nur Geändertes neu ab.
+    # QuerySet.update() setzt das Feld nicht automatisch: dort mitgeben.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = SaleQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -193,6 +264,30 @@ class Sale(models.Model):
         self.total_amount_gross = total_gross
         self.save()
 
+    @transaction.atomic
+    def add_items(self, items):
+        """
+        Legt mehrere (ungespeicherte) SaleItems in einem INSERT an und bucht den
+        Lagerabgang in einem Ledger-Write. Für Belege mit vielen Zeilen
+        (Webshop-Bestellungen); SaleItem.save() bleibt der Weg für Einzelzeilen.
+        """
+        for item in items:
+            item.sale = self
+            if not item.unit_price_gross:
+                item.unit_price_gross = item.product.sales_price
+                item.vat_rate = item.product.vat.rate if item.product.vat else Decimal('0.00')
+        items = SaleItem.objects.bulk_create(items)
+        SalesFact.objects.book_sales([(self, item) for item in items])
+
+        Product.objects.bulk_adjust_stock(
+            [(item.product_id, -item.quantity) for item in items],  # Negativ für Abgang
+            movement_type=StockMovement.Type.SALE,
+            reference=self,
+            user=self.created_by,
+            notes=f"Verkauf #{self.id}",
+        )
+        return items
+
     @transaction.atomic
     def refund(self, user=None):
         """
@@ -203,19 +298,21 @@ class Sale(models.Model):
         
         # 1. Status ändern
         self.status = self.Status.REFUNDED
+        self.refunded_at = timezone.now()
         self.save()
         
-        # 2. Ware zurückbuchen
-        for item in self.items.all():
-            # Wir nutzen adjust_stock mit positiver Quantity (Rückbuchung)
-            # und dem Typ RETURN
-            item.product.adjust_stock(
-                quantity=item.quantity, # Positiv = Eingang
-                movement_type=StockMovement.Type.RETURN,
-                user=user or self.created_by,
-                reference=self,
-                notes=f"Storno Verkauf #{self.id}"
-            )
+        # 2. Ware zurückbuchen (positive Quantity = Eingang, Typ RETURN)
+        items = list(self.items.all())
+        Product.objects.bulk_adjust_stock(
+            [(item.product_id, item.quantity) for item in items],
+            movement_type=StockMovement.Type.RETURN,
+            reference=self,
+            user=user or self.created_by,
+            notes=f"Storno Verkauf #{self.id}",
+        )
+
+        # 3. Gegenbuchung im Reporting-Würfel, am Storno-Tag (der Verkaufstag bleibt)
+        SalesFact.objects.book([(self, item) for item in items], sign=-1, kind=SalesFact.Kind.REFUND)
 
 class SaleItem(models.Model):
     sale = models.ForeignKey(Sale, related_name='items', on_delete=models.CASCADE)
@@ -242,10 +339,171 @@ class SaleItem(models.Model):
 
         # Bestand reduzieren bei neuem Verkauf (mit Audit Log)
         if is_new:
-            self.product.adjust_stock(
-                quantity=-self.quantity, # Negativ für Abgang
+            SalesFact.objects.book_sales([(self.sale, self)])
+            Product.objects.bulk_adjust_stock(
+                [(self.product_id, -self.quantity)], # Negativ für Abgang
                 movement_type=StockMovement.Type.SALE,
-                user=self.sale.created_by if hasattr(self.sale, 'created_by') else None,
                 reference=self.sale, # Link zum Sale für das Audit-Log
+                user=self.sale.created_by if hasattr(self.sale, 'created_by') else None,
                 notes=f"Verkauf #{self.sale.id}"
-            )
\ No newline at end of file
+            )
+
+
+# --- REPORTING ---
+
+def _fact_key(sale, item, kind):
+    """
+    Zelle des Würfels: Tag × Artikel × Kanal × Zahlungsart × MWST-Satz × Art.
+    Verkäufe zählen am Verkaufstag, Stornos am Storno-Tag.
+    """
+    vat_rate = (item.vat_rate or Decimal('0.00')).quantize(Decimal('0.01'))
+    moment = sale.refunded_at if kind == SalesFact.Kind.REFUND else sale.date
+    return (timezone.localdate(moment), item.product_id, sale.channel, sale.payment_method, vat_rate, kind)
+
+
+class SalesFactQuerySet(models.QuerySet):
+
+    def book(self, lines, sign=1, kind=None):
+        """
+        Bucht Verkaufspositionen in den Würfel (sign=-1 nimmt sie wieder heraus).
+        Stornos sind eigene Zeilen (kind=REFUND) mit negativen Beträgen.
+
+        lines: Iterable von (sale, item). Die Zelle ergibt sich aus Sale-Datum
+        (bei REFUND: refunded_at), Kanal und Zahlungsart sowie Artikel und
+        MWST-Satz der Position.
+        Unabhängig von der Zeilenzahl: Kategorien lesen, fehlende Zellen mit
+        0 anlegen (INSERT ... IGNORE, race-sicher), Zellen sperren, 1x UPDATE (CASE).
+        Muss in der Transaktion des Belegs laufen.
+        """
+        kind = kind or SalesFact.Kind.SALE
+        deltas = {}
+        for sale, item in lines:
+            quantity = (item.quantity or 0) * sign
+            if not quantity:
+                continue
+            key = _fact_key(sale, item, kind)
+            q, g = deltas.get(key, (0, Decimal('0.00')))
+            deltas[key] = (q + quantity, g + quantity * (item.unit_price_gross or Decimal('0.00')))
+        if not deltas:
+            return 0
+        # Netto pro Zelle: der MWST-Satz ist Teil des Schlüssels
+        for key, (quantity, gross) in deltas.items():
+            net = (gross / (Decimal('1.00') + key[4] / Decimal('100.00'))).quantize(Decimal('0.0001'))
+            deltas[key] = (quantity, gross, net, gross - net)
+
+        categories = dict(
+            Product.objects.filter(pk__in={key[1] for key in deltas}).values_list('pk', 'category_id')
+        )
+        self.model.objects.bulk_create(
+            [
+                self.model(day=day, product_id=product_id, category_id=categories.get(product_id),
+                           channel=channel, payment_method=payment_method, vat_rate=vat_rate, kind=kind)
+                for day, product_id, channel, payment_method, vat_rate, kind in deltas
+            ],
+            ignore_conflicts=True,
+        )
+
+        # Sperren in PK-Reihenfolge, wie beim Lager (parallele Belege am selben Tag)
+        cells = {}
+        for cell in (
+            self.model.objects.select_for_update()
+            .filter(day__in={key[0] for key in deltas}, product_id__in=categories, kind=kind)
+            .order_by('pk')
+            .only('pk', 'day', 'product_id', 'channel', 'payment_method', 'vat_rate', 'kind')
+        ):
+            cells[(cell.day, cell.product_id, cell.channel, cell.payment_method, cell.vat_rate, cell.kind)] = cell.pk
+
+        def _case(field, index, output_field):
+            return Case(
+                *[When(pk=cells[key], then=F(field) + Value(delta[index])) for key, delta in deltas.items()],
+                default=F(field),
+                output_field=output_field,
+            )
+
+        amount = DecimalField(max_digits=14, decimal_places=4)
+        return self.model.objects.filter(pk__in=[cells[key] for key in deltas]).update(
+            quantity=_case('quantity', 0, IntegerField()),
+            gross=_case('gross', 1, amount),
+            net=_case('net', 2, amount),
+            vat=_case('vat', 3, amount),
+        )
+
+    def book_sales(self, lines, sign=1):
+        """
+        Bucht Positionen samt einem allfälligen Storno (sign=-1 nimmt beides
+        heraus): SALE am Verkaufstag, bei stornierten Sales dazu die
+        REFUND-Gegenbuchung am Storno-Tag. Für neue Positionen und Umbuchungen
+        (Zahlungsart-Korrektur); das Storno selbst bucht Sale.refund.
+        """
+        lines = list(lines)
+        self.book(lines, sign=sign)
+        refunded = [(sale, item) for sale, item in lines if sale.status == Sale.Status.REFUNDED]
+        return self.book(refunded, sign=-sign, kind=SalesFact.Kind.REFUND)
+
+
+class SalesFact(models.Model):
+    """
+    Vorverdichteter Umsatz für Reports (Umsatzliste, MWST, Dashboard): eine
+    Zeile pro Tag × Artikel × Kanal × Zahlungsart × MWST-Satz × Art.
+    SALE-Zeilen enthalten jeden Verkauf am Verkaufstag, auch später
+    stornierte; ein Storno bucht eine REFUND-Zeile mit negativen Beträgen am
+    Storno-Tag. Abgeschlossene Perioden bleiben so unverändert: Umsatzliste
+    und MWST lesen SALE, der Umsatz nach Stornos ist die Summe beider Arten.
+    Wird beim Verkauf, Storno und bei der Zahlungsart-Korrektur mitgeführt;
+    Reports lesen damit Tage statt Belege.
+
+    Admin-Korrekturen (Datum, Zahlungsart, Positionen) bucht SaleAdmin um,
+    gelöschte Sales und Positionen nehmen die pre_delete-Signale heraus.
+    Die Kategorie ist der Stand beim Buchen; nach Umkategorisierungen:
+    rebuild_sales_cube --from/--to.
+    """
+    class Kind(models.TextChoices):
+        SALE = 'SALE', 'Verkauf'
+        REFUND = 'REFUND', 'Storno'
+
+    day = models.DateField()
+    kind = models.CharField(max_length=10, choices=Kind.choices, default=Kind.SALE)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    channel = models.CharField(max_length=10, choices=Sale.SalesChannel.choices)
+    payment_method = models.CharField(max_length=20, choices=Sale.PaymentMethod.choices)
+    vat_rate = models.DecimalField(max_digits=5, decimal_places=2)
+
+    quantity = models.IntegerField(default=0)
+    gross = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    net = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+    vat = models.DecimalField(max_digits=14, decimal_places=4, default=0)
+
+    objects = SalesFactQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'product', 'channel', 'payment_method', 'vat_rate', 'kind'],
+                name='unique_sales_fact_cell',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} | {self.kind} | {self.product_id} | {self.payment_method} | {self.gross}"
+
+
+def _unbook_deleted_sale(sender, instance, **kwargs):
+    SalesFact.objects.book_sales([(instance, item) for item in instance.items.all()], sign=-1)
+
+
+def _unbook_deleted_item(sender, instance, origin=None, **kwargs):
+    # Beim Löschen ganzer Sales nimmt _unbook_deleted_sale die Positionen heraus
+    if isinstance(origin, Sale) or getattr(origin, 'model', None) is Sale:
+        return
+    # Stand aus der DB: ein Inline-Formular kann ungespeicherte Werte mitbringen
+    item = SaleItem.objects.select_related('sale').filter(pk=instance.pk).first()
+    if item:
+        SalesFact.objects.book_sales([(item.sale, item)], sign=-1)
+
+
+def connect_signals():
+    from django.db.models.signals import pre_delete
+
+    pre_delete.connect(_unbook_deleted_sale, sender=Sale, dispatch_uid='commerce.sales_fact.sale_deleted')
+    pre_delete.connect(_unbook_deleted_item, sender=SaleItem, dispatch_uid='commerce.sales_fact.item_deleted')
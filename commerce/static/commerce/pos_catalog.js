@@ -0,0 +1,183 @@
+/*
+ * Offline-Katalog der Kasse.
+ *
+ * Hält einen kompakten Artikel-Snapshot (/commerce/api/catalog/) in IndexedDB
+ * und im Speicher und sucht lokal — ohne Server-Roundtrip, auch bei
+ * WLAN-Ausfall oder Gunicorn-Neustart. Abgleich per ?since=<version> (Delta)
+ * und ETag, beim Start, jede Minute und sobald der Browser wieder online ist.
+ *
+ * Wie der Server-Index (core.search) kennt der Snapshot auch inaktive
+ * Artikel: byCode findet sie (Scan), die Textsuche nur aktive.
+ *
+ *   await PosCatalog.init();
+ *   PosCatalog.search('still bh');   // → [{id, ean, sku, name, price, ...}]
+ *   PosCatalog.byCode('7612345678901');
+ */
+const PosCatalog = (() => {
+    const DB_NAME = 'stock_keeper_pos';
+    const DB_VERSION = 1;
+    const SYNC_INTERVAL_MS = 60 * 1000;
+    // Snapshot-Format; ältere lokale Stände (ohne inaktive Artikel) neu laden
+    const FORMAT = 2;
+
+    let db = null;
+    let products = new Map();   // id → Produkt
+    let byEan = new Map();
+    let bySku = new Map();
+    let meta = { version: null, etag: null };
+    let syncing = null;
+
+    const fold = (s) => (s || '').normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase().replace(/ß/g, 'ss');
+    const tokenize = (s) => fold(s).match(/[0-9a-z]+/g) || [];
+
+    function openDb() {
+        return new Promise((resolve, reject) => {
+            const req = indexedDB.open(DB_NAME, DB_VERSION);
+            req.onupgradeneeded = () => {
+                const d = req.result;
+                if (!d.objectStoreNames.contains('products')) d.createObjectStore('products', { keyPath: 'id' });
+                if (!d.objectStoreNames.contains('meta')) d.createObjectStore('meta');
+            };
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    }
+
+    function tx(stores, mode, fn) {
+        return new Promise((resolve, reject) => {
+            const t = db.transaction(stores, mode);
+            const result = fn(t);
+            t.oncomplete = () => resolve(result);
+            t.onerror = () => reject(t.error);
+            t.onabort = () => reject(t.error);
+        });
+    }
+
+    function remember(p) {
+        forget(p.id);
+        p._tokens = p.active ? tokenize(p.name + ' ' + (p.sku || '')) : [];
+        p._haystack = p._tokens.join(' ');
+        p._name = fold(p.name);
+        products.set(p.id, p);
+        if (p.ean) byEan.set(p.ean, p);
+        if (p.sku) bySku.set(fold(p.sku), p);
+    }
+
+    function forget(id) {
+        const old = products.get(id);
+        if (!old) return;
+        products.delete(id);
+        if (old.ean && byEan.get(old.ean) === old) byEan.delete(old.ean);
+        if (old.sku && bySku.get(fold(old.sku)) === old) bySku.delete(fold(old.sku));
+    }
+
+    function toObject(fields, row) {
+        const p = {};
+        fields.forEach((f, i) => { p[f] = row[i]; });
+        return p;
+    }
+
+    async function loadLocal() {
+        await tx(['products', 'meta'], 'readonly', (t) => {
+            t.objectStore('products').getAll().onsuccess = (e) => e.target.result.forEach(remember);
+            t.objectStore('meta').get('sync').onsuccess = (e) => {
+                const stored = e.target.result;
+                if (stored && stored.format === FORMAT) meta = stored;
+            };
+        });
+    }
+
+    async function apply(data, etag) {
+        const rows = data.rows.map((r) => toObject(data.fields, r));
+        const keep = data.full ? null : new Set(data.ids);
+        await tx(['products', 'meta'], 'readwrite', (t) => {
+            const store = t.objectStore('products');
+            if (data.full) {
+                store.clear();
+                products = new Map(); byEan = new Map(); bySku = new Map();
+            }
+            for (const p of rows) {
+                store.put(p);
+                remember({ ...p });
+            }
+            if (keep) {
+                for (const id of [...products.keys()]) {
+                    if (!keep.has(id)) { store.delete(id); forget(id); }
+                }
+            }
+            meta = { version: data.version, etag: etag, format: FORMAT };
+            t.objectStore('meta').put(meta, 'sync');
+        });
+    }
+
+    async function doSync() {
+        const url = '/commerce/api/catalog/' + (meta.version ? '?since=' + encodeURIComponent(meta.version) : '');
+        const headers = { 'Accept': 'application/json' };
+        if (meta.etag) headers['If-None-Match'] = meta.etag;
+        const res = await fetch(url, { headers, credentials: 'same-origin' });
+        if (res.status === 304 || !res.ok) return;
+        await apply(await res.json(), res.headers.get('ETag'));
+    }
+
+    function sync() {
+        // Offline oder Session abgelaufen: lokaler Stand bleibt gültig
+        if (!syncing) syncing = doSync().catch(() => {}).finally(() => { syncing = null; });
+        return syncing;
+    }
+
+    async function init() {
+        if (db || !window.indexedDB) return api.ready;
+        try {
+            db = await openDb();
+            await loadLocal();
+            api.ready = products.size > 0;
+            await sync();
+            api.ready = products.size > 0;
+        } catch (e) {
+            api.ready = false;
+        }
+        setInterval(() => sync().then(() => { api.ready = products.size > 0; }), SYNC_INTERVAL_MS);
+        window.addEventListener('online', () => sync());
+        return api.ready;
+    }
+
+    function byCode(code) {
+        code = (code || '').trim();
+        return byEan.get(code) || bySku.get(fold(code)) || null;
+    }
+
+    function search(query, limit = 10) {
+        const hits = [];
+        const exact = byCode(query);
+        if (exact) hits.push(exact);
+        const terms = tokenize(query);
+        if (!terms.length) return hits;
+        const whole = [], prefix = [];
+        for (const p of products.values()) {
+            if (p === exact || !p.active) continue;
+            let allWhole = true, allPrefix = true;
+            for (const term of terms) {
+                if (p._tokens.includes(term)) continue;
+                allWhole = false;
+                if (!p._tokens.some((t) => t.startsWith(term))) { allPrefix = false; break; }
+            }
+            if (allWhole) whole.push(p); else if (allPrefix) prefix.push(p);
+        }
+        // Gleiche Rangfolge wie der Server-Index: ganze Wörter, dann Wortanfänge,
+        // ohne Treffer zuletzt Teilstring (icontains); kurze Namen zuerst
+        const byRank = (a, b) => (a._name.length - b._name.length) || a._name.localeCompare(b._name);
+        const ranked = hits.concat(whole.sort(byRank), prefix.sort(byRank));
+        const needle = terms.join(' ');
+        if (!ranked.length && needle.length >= 3) {
+            const found = [];
+            for (const p of products.values()) {
+                if (p.active && p._haystack.includes(needle)) found.push(p);
+            }
+            return found.sort(byRank).slice(0, limit);
+        }
+        return ranked.slice(0, limit);
+    }
+
+    const api = { ready: false, init, sync, search, byCode, get version() { return meta.version; } };
+    return api;
+})();
@@ -0,0 +1,48 @@
+"""Hintergrund-Tasks der commerce-App (siehe jobs.queue)."""
+from django.core.management import call_command
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.queue import task
+
+from .models import Sale
+from .utils import send_invoice_email
+
+
+class InvoiceSendError(Exception):
+    pass
+
+
+@task('commerce.send_invoice', priority=Job.Priority.HIGH, max_attempts=3)
+def send_invoice(sale_id, resend=False):
+    """Rendert die QR-Rechnung, versendet sie und hält invoice_status nach."""
+    sale = Sale.objects.get(pk=sale_id)
+    success, info = send_invoice_email(sale, sale.customer_data_dict())
+    if success:
+        sale.invoice_status = Sale.InvoiceStatus.RESENT if resend else Sale.InvoiceStatus.SENT
+        sale.invoice_sent_at = timezone.now()
+        sale.invoice_last_error = ''
+        sale.save(update_fields=['invoice_status', 'invoice_sent_at', 'invoice_last_error'])
+        return
+    sale.invoice_status = Sale.InvoiceStatus.FAILED
+    sale.invoice_last_error = info or 'Unbekannter Fehler'
+    sale.save(update_fields=['invoice_status', 'invoice_last_error'])
+    # Fehler weiterreichen → Queue plant mit Backoff neu ein
+    raise InvoiceSendError(sale.invoice_last_error)
+
+
+# Bisher nur per Host-Cron (docker exec); als Task auch aus der App anstossbar.
+
+@task('commerce.check_invoice_bounces', priority=Job.Priority.LOW, max_attempts=1)
+def check_invoice_bounces():
+    call_command('check_invoice_bounces')
+
+
+@task('commerce.sync_sumup_refunds', priority=Job.Priority.LOW, max_attempts=1)
+def sync_sumup_refunds():
+    call_command('sync_sumup_refunds')
+
+
+@task('commerce.check_unmatched_sumup', priority=Job.Priority.LOW, max_attempts=1)
+def check_unmatched_sumup():
+    call_command('check_unmatched_sumup')
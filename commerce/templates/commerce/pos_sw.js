@@ -0,0 +1,156 @@
+// Service Worker der Kasse (Scope /commerce/, ausgeliefert von views.pos_service_worker).
+//
+// Ist api/checkout/ nicht erreichbar, werden Bar-Verkäufe samt Idempotency-Key
+// in IndexedDB gepuffert und die Kasse bekommt sofort eine Quittung "offline
+// gespeichert". Sobald der Server wieder antwortet, gehen alle gepufferten
+// Verkäufe gesammelt an api/checkout/batch/. Der Server dedupliziert über den
+// Key — ein doppelter Replay (z.B. Antwort ging verloren) bucht nichts doppelt.
+const CHECKOUT_PATH = '/commerce/api/checkout/';
+const BATCH_URL = '/commerce/api/checkout/batch/';
+const DB_NAME = 'stock_keeper_pos_outbox';
+const STORE = 'checkouts';
+const SYNC_TAG = 'pos-checkout-outbox';
+const BATCH_SIZE = 50;
+
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', (event) => event.waitUntil(self.clients.claim()));
+
+// --- IndexedDB ---
+
+function openDb() {
+    return new Promise((resolve, reject) => {
+        const req = indexedDB.open(DB_NAME, 1);
+        req.onupgradeneeded = () => req.result.createObjectStore(STORE, { keyPath: 'idempotency_key' });
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => reject(req.error);
+    });
+}
+
+async function withStore(mode, fn) {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(STORE, mode);
+        const result = fn(tx.objectStore(STORE));
+        tx.oncomplete = () => { db.close(); resolve(result && 'result' in result ? result.result : undefined); };
+        tx.onerror = () => { db.close(); reject(tx.error); };
+    });
+}
+
+const putEntry = (entry) => withStore('readwrite', (s) => s.put(entry));
+const deleteEntry = (key) => withStore('readwrite', (s) => s.delete(key));
+const allEntries = () => withStore('readonly', (s) => s.getAll());
+const countEntries = () => withStore('readonly', (s) => s.count());
+
+async function notifyClients(message) {
+    const clients = await self.clients.matchAll({ includeUncontrolled: true, type: 'window' });
+    clients.forEach((c) => c.postMessage(message));
+}
+
+// --- Checkout abfangen ---
+
+self.addEventListener('fetch', (event) => {
+    const req = event.request;
+    if (req.method !== 'POST' || new URL(req.url).pathname !== CHECKOUT_PATH) return;
+    event.respondWith(checkoutOrQueue(req));
+});
+
+async function checkoutOrQueue(request) {
+    const body = await request.clone().text();
+    let response;
+    try {
+        response = await fetch(request);
+    } catch (err) {
+        return queueOrFail(body, request, () => { throw err; });
+    }
+    // 502/503/504: Proxy erreicht, App-Server nicht – wie offline behandeln
+    if (response.status >= 502) {
+        return queueOrFail(body, request, () => response);
+    }
+    // Server erreichbar → liegengebliebene Verkäufe gleich mitschicken
+    flush().catch(() => {});
+    return response;
+}
+
+async function queueOrFail(body, request, fail) {
+    let payload;
+    try { payload = JSON.parse(body); } catch (e) { return fail(); }
+    // Nur Bar: SumUp braucht die Verifizierung, Rechnungen den Versand.
+    if ((payload.payment_method || 'CASH') !== 'CASH' || !payload.idempotency_key) return fail();
+
+    payload.offline_created_at = payload.offline_created_at || Date.now();
+    await putEntry({
+        idempotency_key: payload.idempotency_key,
+        payload: payload,
+        csrf: request.headers.get('X-CSRFToken') || '',
+        queued_at: Date.now(),
+        error: '',
+    });
+    if (self.registration.sync) {
+        self.registration.sync.register(SYNC_TAG).catch(() => {});
+    }
+    const queued = await countEntries();
+    notifyClients({ type: 'outbox', queued: queued, booked: 0, failed: [] });
+    return new Response(JSON.stringify({
+        success: true,
+        queued: true,
+        idempotency_key: payload.idempotency_key,
+        queued_count: queued,
+    }), { status: 202, headers: { 'Content-Type': 'application/json' } });
+}
+
+// --- Nachbuchen ---
+
+let flushing = null;
+
+function flush() {
+    if (!flushing) flushing = doFlush().finally(() => { flushing = null; });
+    return flushing;
+}
+
+async function doFlush() {
+    const entries = await allEntries();
+    if (!entries.length) return;
+    entries.sort((a, b) => a.queued_at - b.queued_at);
+
+    let booked = 0;
+    const failed = [];
+    for (let i = 0; i < entries.length; i += BATCH_SIZE) {
+        const chunk = entries.slice(i, i + BATCH_SIZE);
+        const response = await fetch(BATCH_URL, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': chunk[chunk.length - 1].csrf },
+            body: JSON.stringify({ checkouts: chunk.map((e) => e.payload) }),
+        });
+        if (!response.ok) throw new Error('Batch HTTP ' + response.status);
+        const data = await response.json();
+        const byKey = new Map(chunk.map((e) => [e.idempotency_key, e]));
+        for (const r of data.results) {
+            const entry = byKey.get(r.idempotency_key);
+            if (!entry) continue;
+            if (r.success) {
+                await deleteEntry(entry.idempotency_key);
+                booked += 1;
+            } else {
+                // Bleibt im Puffer, die Kasse zeigt den Fehler an
+                entry.error = r.error || 'Unbekannter Fehler';
+                await putEntry(entry);
+                failed.push({ idempotency_key: entry.idempotency_key, error: entry.error });
+            }
+        }
+    }
+    notifyClients({ type: 'outbox', queued: await countEntries(), booked: booked, failed: failed });
+}
+
+self.addEventListener('sync', (event) => {
+    if (event.tag === SYNC_TAG) event.waitUntil(flush());
+});
+
+self.addEventListener('message', (event) => {
+    const data = event.data || {};
+    if (data.type === 'flush') {
+        event.waitUntil(flush().catch(() => {}));
+    } else if (data.type === 'status') {
+        event.waitUntil(countEntries().then((queued) => notifyClients({ type: 'outbox', queued: queued, booked: 0, failed: [] })));
+    }
+});
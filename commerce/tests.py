@@ -1,3 +1,472 @@
+"""Tests for the commerce document write paths (POS checkout, sales, refunds, goods receipt)."""
+import io
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Category, Product, StockMovement, Supplier, Vat
+from core.search import catalog_index, scan_cache
+from jobs.models import Job
+
+from . import tasks
+from .models import PurchaseOrder, PurchaseOrderItem, Sale, SaleItem, SalesFact
+
+
+
+class DocumentStockTests(TestCase):
+    def setUp(self):
+        self.vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.cat = Category.objects.create(name='Still-BHs')
+        self.supplier = Supplier.objects.create(name='Anita')
+
+    def _products(self, n, stock=10):
+        return [
+            Product.objects.create(
+                name=f'Artikel {i}', category=self.cat, supplier=self.supplier,
+                sales_price=Decimal('10.00'), cost_price=Decimal('4.00'),
+                stock_quantity=stock, vat=self.vat,
+            )
+            for i in range(n)
+        ]
+
+    def _sale(self, products):
+        sale = Sale.objects.create(payment_method=Sale.PaymentMethod.CASH)
+        sale.add_items([SaleItem(product=p, quantity=2) for p in products])
+        return sale
+
+    def _receipt(self, products):
+        po = PurchaseOrder.objects.create(supplier=self.supplier)
+        for p in products:
+            PurchaseOrderItem.objects.create(order=po, product=p, quantity=5, unit_price=Decimal('6.00'))
+        return po
+
+    def _count(self, fn):
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        return len(ctx.captured_queries)
+
+    def test_add_items_deducts_stock_with_audit_trail(self):
+        p1, p2 = self._products(2)
+        sale = self._sale([p1, p2])
+        p1.refresh_from_db()
+        self.assertEqual(p1.stock_quantity, 8)
+        self.assertEqual(sale.items.count(), 2)
+        movement = StockMovement.objects.get(product=p2)
+        self.assertEqual(movement.movement_type, StockMovement.Type.SALE)
+        self.assertEqual(movement.content_object, sale)
+        self.assertEqual(movement.stock_after, 8)
+
+    def test_refund_query_count_is_flat(self):
+        small = self._sale(self._products(1))
+        large = self._sale(self._products(30))
+        self.assertEqual(self._count(small.refund), self._count(large.refund))
+        self.assertEqual(
+            StockMovement.objects.filter(movement_type=StockMovement.Type.RETURN).count(), 31
+        )
+
+    def test_bulk_refund_attributes_movements_like_refund(self):
+        seller = get_user_model().objects.create_user('kasse')
+        (product,) = self._products(1)
+        sale = Sale.objects.create(payment_method=Sale.PaymentMethod.CASH, created_by=seller)
+        sale.add_items([SaleItem(product=product, quantity=1)])
+        Sale.objects.filter(pk=sale.pk).bulk_refund()
+        movement = StockMovement.objects.get(movement_type=StockMovement.Type.RETURN)
+        self.assertEqual(movement.user, seller)
+
+    def test_goods_receipt_query_count_is_flat(self):
+        small = self._receipt(self._products(1))
+        large = self._receipt(self._products(30))
+        ContentType.objects.get_for_model(PurchaseOrder)  # warm the ContentType cache
+        self.assertEqual(self._count(small.mark_as_received), self._count(large.mark_as_received))
+
+    def test_goods_receipt_updates_moving_average_then_stock(self):
+        (product,) = self._products(1)
+        po = self._receipt([product])
+        po.mark_as_received()
+        product.refresh_from_db()
+        # (10 * 4.00 + 5 * 6.00) / 15
+        self.assertEqual(product.cost_price, Decimal('4.67'))
+        self.assertEqual(product.stock_quantity, 15)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.cat = Category.objects.create(name='Still-BHs')
+        self.user = get_user_model().objects.create_user('kasse', password='x', is_staff=True)
+        self.client.force_login(self.user)
+
+    def _products(self, n):
+        return [
+            Product.objects.create(
+                name=f'Artikel {i}', category=self.cat,
+                sales_price=Decimal('54.05'), cost_price=Decimal('20.00'),
+                stock_quantity=10, vat=self.vat,
+            )
+            for i in range(n)
+        ]
+
+    def _checkout(self, products, **extra):
+        payload = {'items': [{'id': p.id, 'qty': 2} for p in products], 'payment_method': 'SUMUP', **extra}
+        return self.client.post(reverse('api_pos_checkout'), json.dumps(payload), content_type='application/json')
+
+    def test_checkout_books_totals_and_stock(self):
+        p1, p2 = self._products(2)
+        data = self._checkout([p1, p2]).json()
+        self.assertTrue(data['success'])
+        sale = Sale.objects.get(pk=data['sale_id'])
+        self.assertEqual(sale.total_amount_gross, Decimal('216.20'))
+        self.assertEqual(sale.total_amount_net, Decimal('200.00'))
+        self.assertEqual(sale.items.count(), 2)
+        p1.refresh_from_db()
+        self.assertEqual(p1.stock_quantity, 8)
+
+    def test_checkout_query_count_is_flat(self):
+        small, large = self._products(1), self._products(25)
+        self._checkout(self._products(1), idempotency_key='warmup')
+        with CaptureQueriesContext(connection) as one:
+            self._checkout(small, idempotency_key='a')
+        with CaptureQueriesContext(connection) as many:
+            self._checkout(large, idempotency_key='b')
+        self.assertEqual(len(one.captured_queries), len(many.captured_queries))
+
+    def test_unknown_product_leaves_no_sale(self):
+        (product,) = self._products(1)
+        payload = {'items': [{'id': product.id, 'qty': 1}, {'id': 999999, 'qty': 1}], 'payment_method': 'CASH'}
+        data = self.client.post(
+            reverse('api_pos_checkout'), json.dumps(payload), content_type='application/json'
+        ).json()
+        self.assertFalse(data['success'])
+        self.assertFalse(Sale.objects.exists())
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 10)
+
+    def test_invoice_checkout_defers_email_until_after_commit(self):
+        (product,) = self._products(1)
+        customer = {'first_name': 'Anna', 'last_name': 'Muster', 'address': 'Weg 1',
+                    'zip_code': '8000', 'city': 'Zürich', 'email': ' anna@example.ch '}
+        with mock.patch('commerce.tasks.send_invoice_email') as send, \
+                self.captureOnCommitCallbacks() as callbacks:
+            data = self._checkout([product], payment_method='INVOICE', customer=customer).json()
+            send.assert_not_called()
+        self.assertEqual(data['invoice_status'], Sale.InvoiceStatus.PENDING)
+        sale = Sale.objects.get(pk=data['sale_id'])
+        self.assertEqual(sale.customer_email, 'anna@example.ch')
+        job = Job.objects.get(name='commerce.send_invoice')
+        self.assertEqual(job.payload, {'sale_id': sale.id})
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertTrue(callbacks)  # dispatched only after commit
+
+        status = self.client.get(data['invoice_status_url']).json()
+        self.assertEqual(status['invoice_status'], Sale.InvoiceStatus.PENDING)
+
+    def _batch(self, checkouts):
+        return self.client.post(
+            reverse('api_pos_checkout_batch'), json.dumps({'checkouts': checkouts}),
+            content_type='application/json',
+        ).json()
+
+    def test_batch_replay_is_idempotent_and_isolates_failures(self):
+        p1, p2 = self._products(2)
+        offline_at = timezone.now() - timedelta(hours=2)
+        queued = [
+            {'idempotency_key': 'offline-1', 'payment_method': 'CASH',
+             'items': [{'id': p1.id, 'qty': 1}], 'offline_created_at': int(offline_at.timestamp() * 1000)},
+            {'idempotency_key': 'offline-2', 'payment_method': 'CASH',
+             'items': [{'id': 999999, 'qty': 1}]},
+            # identischer Warenkorb direkt danach: kein 409, der Key unterscheidet
+            {'idempotency_key': 'offline-3', 'payment_method': 'CASH',
+             'items': [{'id': p1.id, 'qty': 1}]},
+            {'idempotency_key': 'offline-4', 'payment_method': 'SUMUP',
+             'items': [{'id': p2.id, 'qty': 1}]},
+        ]
+        results = self._batch(queued)['results']
+        self.assertEqual([r['success'] for r in results], [True, False, True, False])
+        self.assertEqual(Sale.objects.count(), 2)
+        first = Sale.objects.get(idempotency_key='offline-1')
+        self.assertEqual(first.date.replace(microsecond=0), offline_at.replace(microsecond=0))
+        p1.refresh_from_db()
+        self.assertEqual(p1.stock_quantity, 8)
+
+        # Antwort ging verloren → der Service Worker schickt alles nochmal
+        replay = self._batch(queued[:1] + queued[2:3])['results']
+        self.assertTrue(all(r['duplicate_prevented'] for r in replay))
+        self.assertEqual(replay[0]['sale_id'], first.id)
+        self.assertEqual(Sale.objects.count(), 2)
+        p1.refresh_from_db()
+        self.assertEqual(p1.stock_quantity, 8)
+
+    def test_online_checkout_ignores_offline_timestamp(self):
+        (product,) = self._products(1)
+        backdated = int((timezone.now() - timedelta(hours=5)).timestamp() * 1000)
+        data = self._checkout([product], payment_method='CASH', offline_created_at=backdated).json()
+        self.assertTrue(data['success'])
+        sale = Sale.objects.get(pk=data['sale_id'])
+        self.assertLess(timezone.now() - sale.date, timedelta(minutes=1))
+
+    def test_batch_rejects_stale_offline_sale(self):
+        (product,) = self._products(1)
+        stale = (timezone.now() - timedelta(days=30)).isoformat()
+        (result,) = self._batch([{'idempotency_key': 'old', 'payment_method': 'CASH',
+                                  'items': [{'id': product.id, 'qty': 1}], 'offline_created_at': stale}])['results']
+        self.assertFalse(result['success'])
+        self.assertFalse(Sale.objects.exists())
+
+
+class SalesCubeTests(TestCase):
+    def setUp(self):
+        self.normal = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.reduced = Vat.objects.create(name='Reduziert', rate=Decimal('2.60'))
+        self.cat = Category.objects.create(name='Still-BHs')
+        self.shirt = Product.objects.create(name='Shirt', category=self.cat, sales_price=Decimal('54.05'),
+                                            cost_price=Decimal('20.00'), stock_quantity=50, vat=self.normal)
+        self.tea = Product.objects.create(name='Tee', sales_price=Decimal('10.26'),
+                                          cost_price=Decimal('4.00'), stock_quantity=50, vat=self.reduced)
+        self.client.force_login(get_user_model().objects.create_user('buha', password='x', is_staff=True))
+
+    def _sale(self, lines, method=Sale.PaymentMethod.CASH, **extra):
+        sale = Sale.objects.create(payment_method=method, **extra)
+        sale.add_items([SaleItem(product=p, quantity=q) for p, q in lines])
+        return sale
+
+    def _cells(self):
+        return sorted(SalesFact.objects.values_list(
+            'day', 'kind', 'product_id', 'category_id', 'channel', 'payment_method', 'vat_rate',
+            'quantity', 'gross', 'net', 'vat',
+        ))
+
+    def _revenue(self, **filters):
+        totals = SalesFact.objects.filter(**filters).aggregate(
+            quantity=Sum('quantity'), gross=Sum('gross'), net=Sum('net'), vat=Sum('vat'),
+        )
+        # SQLite sums decimals as floats
+        return {k: v.quantize(Decimal('0.0001')) if isinstance(v, Decimal) else v for k, v in totals.items()}
+
+    def _report(self, name, **data):
+        captured = {}
+
+        def fake_pdf(template, context):
+            captured.update(context)
+            return HttpResponse(b'%PDF')
+
+        with mock.patch('commerce.views.render_to_pdf', fake_pdf):
+            self.client.post(reverse(name), {'start_date': '2026-03-01', 'end_date': '2026-03-31', **data})
+        return captured
+
+    def test_write_paths_keep_cube_equal_to_rebuild(self):
+        self._sale([(self.shirt, 2), (self.tea, 1)])
+        self._sale([(self.shirt, 1)], method=Sale.PaymentMethod.TWINT)
+        single = Sale.objects.create(payment_method=Sale.PaymentMethod.SUMUP)
+        SaleItem.objects.create(sale=single, product=self.tea, quantity=3)
+        self._sale([(self.tea, 5)]).refund()
+        Sale.objects.filter(pk=self._sale([(self.shirt, 4)]).pk).bulk_refund()
+        Sale.objects.filter(pk=single.pk).set_payment_method(Sale.PaymentMethod.CASH)
+
+        # sales plus refunds = revenue of completed sales
+        cash = self._revenue(product=self.shirt, payment_method=Sale.PaymentMethod.CASH)
+        self.assertEqual((cash['quantity'], cash['gross'], cash['net']), (2, Decimal('108.10'), Decimal('100.00')))
+        tea = self._revenue(product=self.tea, payment_method=Sale.PaymentMethod.CASH)
+        self.assertEqual((tea['quantity'], tea['net'], tea['vat']), (4, Decimal('40.0000'), Decimal('1.0400')))
+        self.assertFalse(SalesFact.objects.filter(payment_method=Sale.PaymentMethod.SUMUP).exclude(quantity=0).exists())
+        # the sale rows keep refunded sales
+        sold = self._revenue(product=self.shirt, payment_method=Sale.PaymentMethod.CASH, kind=SalesFact.Kind.SALE)
+        self.assertEqual(sold['quantity'], 6)
+
+        incremental = [cell for cell in self._cells() if cell[7]]
+        call_command('rebuild_sales_cube', stdout=io.StringIO())
+        self.assertEqual(self._cells(), incremental)
+
+    def test_refund_is_booked_on_refund_day(self):
+        day = datetime(2026, 3, 10, 14, tzinfo=dt_timezone.utc)
+        sale = self._sale([(self.shirt, 1), (self.tea, 2)], date=day)
+        before = self._report('mwst_report')
+        Sale.objects.filter(pk=sale.pk).set_payment_method(Sale.PaymentMethod.TWINT)
+        sale.refresh_from_db()
+        sale.refund()
+
+        # the filed period stays as it was, the refund lands on today
+        self.assertEqual(self._report('mwst_report')['ziffer_200'], before['ziffer_200'])
+        refund = self._revenue(kind=SalesFact.Kind.REFUND)
+        self.assertEqual(refund['gross'], Decimal('-74.5700'))
+        self.assertEqual(set(SalesFact.objects.filter(kind=SalesFact.Kind.REFUND).values_list('day', flat=True)),
+                         {timezone.localdate()})
+
+        # correcting the payment method afterwards moves the refund rows too
+        Sale.objects.filter(pk=sale.pk).set_payment_method(Sale.PaymentMethod.CASH)
+        self.assertEqual(self._revenue(payment_method=Sale.PaymentMethod.TWINT)['gross'], Decimal('0.0000'))
+        self.assertEqual(self._revenue(payment_method=Sale.PaymentMethod.CASH)['gross'], Decimal('0.0000'))
+        self.assertEqual(self._revenue(payment_method=Sale.PaymentMethod.CASH, kind=SalesFact.Kind.REFUND)['gross'],
+                         Decimal('-74.5700'))
+        incremental = [cell for cell in self._cells() if cell[7]]
+        call_command('rebuild_sales_cube', stdout=io.StringIO())
+        self.assertEqual(self._cells(), incremental)
+
+    def _assert_cube_matches_rebuild(self):
+        incremental = [cell for cell in self._cells() if cell[7]]
+        call_command('rebuild_sales_cube', stdout=io.StringIO())
+        # emptied cells before the first remaining sale are outside the rebuilt range
+        self.assertEqual([cell for cell in self._cells() if cell[7]], incremental)
+
+    def test_admin_edits_and_deletes_keep_cube_in_sync(self):
+        self.client.force_login(get_user_model().objects.create_superuser('chefin', password='x'))
+        sale = self._sale([(self.shirt, 2), (self.tea, 1)], date=datetime(2026, 3, 10, 14, tzinfo=dt_timezone.utc))
+        shirt, tea = sale.items.order_by('pk')
+        refunded = self._sale([(self.tea, 3)])
+        refunded.refund()
+
+        response = self.client.post(reverse('admin:commerce_sale_change', args=[sale.pk]), {
+            'date_0': '2026-03-12', 'date_1': '09:30:00', 'payment_method': Sale.PaymentMethod.TWINT,
+            'items-TOTAL_FORMS': '3', 'items-INITIAL_FORMS': '2',
+            'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': shirt.pk, 'items-0-sale': sale.pk, 'items-0-product': self.shirt.pk,
+            'items-0-quantity': '3', 'items-0-unit_price_gross': '50.00', 'items-0-vat_rate': '8.10',
+            'items-1-id': tea.pk, 'items-1-sale': sale.pk, 'items-1-product': self.tea.pk,
+            'items-1-quantity': '1', 'items-1-unit_price_gross': '10.26', 'items-1-vat_rate': '2.60',
+            'items-1-DELETE': 'on',
+            'items-2-sale': sale.pk, 'items-2-product': self.tea.pk, 'items-2-quantity': '4',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._revenue(payment_method=Sale.PaymentMethod.CASH, product=self.shirt)['quantity'], 0)
+        twint = self._revenue(payment_method=Sale.PaymentMethod.TWINT)
+        self.assertEqual((twint['quantity'], twint['gross']), (7, Decimal('191.0400')))
+        self._assert_cube_matches_rebuild()
+
+        # deleting sales (duplicate cleanup) takes them out, refund rows included
+        self.client.post(reverse('admin:commerce_sale_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': [sale.pk, refunded.pk],
+        })
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(SalesFact.objects.exclude(quantity=0).exists())
+
+    def test_reports_read_cube_with_flat_query_count(self):
+        day = datetime(2026, 3, 10, 14, tzinfo=dt_timezone.utc)
+        self._sale([(self.shirt, 1), (self.tea, 2)], date=day)
+        self._sale([(self.tea, 1)], date=day).refund()
+        with CaptureQueriesContext(connection) as few:
+            mwst = self._report('mwst_report')
+        for _ in range(20):
+            self._sale([(self.shirt, 1), (self.tea, 2)], date=day + timedelta(days=1))
+        with CaptureQueriesContext(connection) as many:
+            self._report('mwst_report')
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+        # refunded sales stay in the period they were sold in
+        self.assertEqual(mwst['ziffer_200'], Decimal('84.83'))
+        self.assertEqual((mwst['norm_base'], mwst['red_base']), (Decimal('50.0000'), Decimal('30.0000')))
+        accounting = self._report('accounting_report', payment_methods=['CASH'])
+        self.assertEqual(accounting['total_period_gross'], Decimal('1576.23'))
+        self.assertEqual(accounting['total_period_gross'], sum(s.amount_gross for s in accounting['sales_list']))
+        self.assertEqual(accounting['total_period_gross'],
+                         sum(stats['gross'] for stats in accounting['category_stats'].values()))
+        self.assertEqual(accounting['category_stats']['Still-BHs']['net'], Decimal('1050.0000'))
+
+        shirts = self._report('accounting_report', categories=[self.cat.pk])
+        self.assertEqual(len(shirts['sales_list']), 21)
+        self.assertEqual(shirts['total_period_gross'], Decimal('1135.05'))
+        self.assertEqual(shirts['total_period_gross'], shirts['category_stats']['Still-BHs']['gross'])
+
+
+class SendInvoiceTaskTests(TestCase):
+    def setUp(self):
+        self.sale = Sale.objects.create(
+            payment_method=Sale.PaymentMethod.INVOICE, invoice_status=Sale.InvoiceStatus.PENDING,
+            customer_email='anna@example.ch',
+        )
+
+    def test_success_marks_sent(self):
+        with mock.patch('commerce.tasks.send_invoice_email', return_value=(True, 'Gesendet')):
+            tasks.send_invoice(self.sale.id)
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.invoice_status, Sale.InvoiceStatus.SENT)
+        self.assertIsNotNone(self.sale.invoice_sent_at)
+
+    def test_failure_records_error_and_raises_for_retry(self):
+        with mock.patch('commerce.tasks.send_invoice_email', return_value=(False, 'SMTP timeout')):
+            with self.assertRaises(tasks.InvoiceSendError):
+                tasks.send_invoice(self.sale.id)
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.invoice_status, Sale.InvoiceStatus.FAILED)
+        self.assertEqual(self.sale.invoice_last_error, 'SMTP timeout')
+
+    def test_resend_view_updates_customer_and_sends(self):
+        self.client.force_login(get_user_model().objects.create_user('buero', password='x', is_staff=True))
+        url = reverse('sale_resend_invoice', args=[self.sale.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        form = {'first_name': 'Anna', 'last_name': 'Muster', 'address': 'Weg 1', 'zip_code': '8000',
+                'city': 'Zürich', 'email': 'anna.muster@example.ch'}
+        with mock.patch('commerce.views.send_invoice_email', return_value=(True, 'Gesendet')) as send:
+            response = self.client.post(url, form)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(send.call_args.args[1]['email'], 'anna.muster@example.ch')
+        self.sale.refresh_from_db()
+        self.assertEqual((self.sale.customer_city, self.sale.invoice_status), ('Zürich', Sale.InvoiceStatus.RESENT))
+
+
+class ScanEndpointTests(TestCase):
+    def setUp(self):
+        catalog_index.clear()
+        scan_cache.reset()
+        vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.product = Product.objects.create(
+            name='Stilleinlagen', category=Category.objects.create(name='Pflege'), vat=vat,
+            sales_price=Decimal('12.90'), cost_price=Decimal('5.00'), stock_quantity=7,
+        )
+        self.client.force_login(get_user_model().objects.create_user('kasse', password='x', is_staff=True))
+
+    def test_scan_returns_compact_payload_and_counts_hits(self):
+        url = reverse('api_scan_product', args=[self.product.ean])
+        self.assertEqual(self.client.get(url).json()['price'], 12.9)
+        self.client.get(url)
+        self.assertEqual(self.client.get(reverse('api_scan_product', args=['0000000000000'])).status_code, 404)
+        stats = self.client.get(reverse('api_scan_stats')).json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        catalog_index.clear()
+        self.vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.cat = Category.objects.create(name='Pflege')
+        self.a = self._product('Stilleinlagen')
+        self.b = self._product('Brustwarzensalbe')
+        self.client.force_login(get_user_model().objects.create_user('kasse', password='x', is_staff=True))
+
+    def _product(self, name):
+        return Product.objects.create(
+            name=name, category=self.cat, vat=self.vat,
+            sales_price=Decimal('12.90'), cost_price=Decimal('5.00'), stock_quantity=7,
+        )
+
+    def test_full_snapshot_then_delta_and_etag(self):
+        url = reverse('api_catalog')
+        full = self.client.get(url)
+        data = full.json()
+        self.assertTrue(data['full'])
+        rows = [dict(zip(data['fields'], row)) for row in data['rows']]
+        self.assertEqual({r['id'] for r in rows}, {self.a.id, self.b.id})
+        self.assertEqual(rows[0]['vat_rate'], 8.1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=full['ETag']).status_code, 304)
 
-# Create your tests here.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.b.is_active = False
+            self.b.save()
+        delta = self.client.get(url, {'since': data['version']}).json()
+        self.assertFalse(delta['full'])
+        # inactive articles stay in the snapshot (scan lookup), flagged active=False
+        self.assertEqual(delta['ids'], sorted([self.a.id, self.b.id]))
+        self.assertEqual(delta['count'], 1)
+        changed = {row[0]: row[-1] for row in delta['rows']}
+        self.assertIs(changed[self.b.id], False)
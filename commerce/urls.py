@@ -12,9 +12,15 @@ urlpatterns = [
 
     # API Endpoints
     path('api/search/', views.api_search_product, name='api_product_search'),
+    path('api/catalog/', views.api_catalog, name='api_catalog'),
+    path('api/scan/stats/', views.api_scan_stats, name='api_scan_stats'),
+    path('api/scan/<str:ean>', views.api_scan_product, name='api_scan_product'),
     # Hier läuft unsere erweiterte Checkout-Logik drüber:
     path('api/checkout/', views.api_checkout, name='api_pos_checkout'),
+    path('api/checkout/batch/', views.api_checkout_batch, name='api_pos_checkout_batch'),
+    path('pos-sw.js', views.pos_service_worker, name='pos_service_worker'),
     path('api/verify-sumup/', views.api_verify_sumup_payment, name='api_verify_sumup'),
+    path('api/verify-sumup/stream/', views.api_verify_sumup_stream, name='api_verify_sumup_stream'),
     path('api/purchase-checkout/', views.api_purchase_checkout, name='api_purchase_checkout'),
     
     # PDF & Webhooks
@@ -26,6 +32,7 @@ urlpatterns = [
 
     # Rechnung erneut senden (Korrektur falscher Kundendaten)
     path('sale/<int:sale_id>/resend-invoice/', views.sale_resend_invoice_view, name='sale_resend_invoice'),
+    path('api/sale/<int:sale_id>/invoice-status/', views.api_invoice_status, name='api_invoice_status'),
 
     path('mwst-report/', views.mwst_report_view, name='mwst_report'),
     path('webhooks/shopify/orders-paid/', views.shopify_webhook, name='shopify_webhook'),
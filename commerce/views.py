@@ -1,15 +1,18 @@
+import asyncio
 import hmac
 import hashlib
 import base64
 import json
 import logging
+import os
 from io import BytesIO
 from decimal import Decimal
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.contrib import admin
 from django.contrib import messages
 from django.contrib.auth import get_user_model
@@ -20,16 +23,19 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django.contrib.admin.views.decorators import staff_member_required
 from datetime import timedelta
-from django.db import transaction, IntegrityError
-from django.db.models import Q
+from django.db import close_old_connections, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 import barcode 
 from barcode.writer import ImageWriter
 
-from .models import Product, Sale, SaleItem, PurchaseOrder, PurchaseOrderItem
+from .models import Product, Sale, SaleItem, SalesFact, PurchaseOrder, PurchaseOrderItem
 from core.models import Supplier
+from core.search import catalog_index, scan_cache
 from .utils import render_to_pdf, send_invoice_email, generate_invoice_pdf, generate_qr_code_svg
 from .forms import AccountingReportForm, EanLabelForm, MwstReportForm
+from .checkout import book_checkout
 
 # --- POS VIEWS ---
 
@@ -55,331 +61,306 @@ def api_search_product(request):
     query = request.GET.get('q', '').strip()
     if not query:
         return JsonResponse({'results': []})
-    products = Product.objects.filter(
-        Q(ean=query) | Q(sku__iexact=query) | Q(name__icontains=query)
-    ).select_related('vat', 'supplier')[:10]
-    results = []
-    for p in products:
-        display_name = str(p)
-        results.append({
-            'id': p.id,
-            'name': display_name,
-            'ean': p.ean,
-            'sku': p.sku, # SKU hinzufügen für Frontend-Logik (Diverses)
-            'price': float(p.sales_price),
-            'cost': float(p.cost_price),
-            'stock': p.stock_quantity,
-            'track_stock': p.track_stock,
-            'vat_rate': float(p.vat.rate) if p.vat else 0.0,
-            'supplier_id': p.supplier.id if p.supplier else None,
-            'supplier_name': p.supplier.name if p.supplier else "Unbekannt"
-        })
+    # Prozess-lokaler Index statt icontains-Scan auf MySQL (siehe core.search)
+    results = catalog_index.search(query, limit=10)
     return JsonResponse({'results': results})
 
-# --- SUMUP VERIFIZIERUNG ---
+@staff_member_required
+@require_GET
+def api_catalog(request):
+    """
+    Versionierter Katalog-Snapshot für den Offline-Cache der Kasse (IndexedDB).
+    `?since=<version>` liefert nur die Änderungen; If-None-Match → 304.
+    """
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': 'since muss eine Version (ms) sein'}, status=400)
+
+    etag = catalog_index.etag(since)
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(catalog_index.snapshot(since))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@staff_member_required
+@require_GET
+def api_scan_product(request, ean):
+    """Scanner-Fast-Path: exakte EAN → Kompakt-Payload aus dem LRU (core.search.ScanCache)."""
+    body = scan_cache.get(ean.strip())
+    if body is None:
+        return JsonResponse({'error': 'not found', 'ean': ean}, status=404)
+    return HttpResponse(body, content_type='application/json')
+
 
 @staff_member_required
 @require_GET
-def api_verify_sumup_payment(request):
-    """Prüft via SumUp API ob eine Zahlung mit passendem Betrag und Timestamp existiert."""
-    from reconciliation.sumup_client import SumUpClient, SumUpAPIError
-    from datetime import datetime, timedelta
+def api_scan_stats(request):
+    """Trefferquote des Scan-Caches (pro Gunicorn-Worker-Prozess)."""
+    return JsonResponse({'pid': os.getpid(), **scan_cache.stats()})
+
+# --- SUMUP VERIFIZIERUNG ---
+
+# Kommentarzeile im Event-Stream, damit Proxies die Verbindung nicht kappen
+SSE_KEEPALIVE_SECONDS = 15
+
 
+def _verify_sumup_params(request):
+    """(amount, ts_ms) aus dem Query-String oder Fehlermeldung."""
     amount = request.GET.get('amount', '')
     timestamp = request.GET.get('timestamp', '')  # Unix-Timestamp in ms
 
     if not amount or not timestamp:
-        return JsonResponse({'verified': False, 'error': 'amount und timestamp erforderlich'})
-
+        return None, None, 'amount und timestamp erforderlich'
     try:
-        amount = Decimal(amount)
-        ts_ms = int(timestamp)
-        payment_time = datetime.utcfromtimestamp(ts_ms / 1000)
-    except (ValueError, TypeError):
-        return JsonResponse({'verified': False, 'error': 'Ungültige Parameter'})
-
+        return Decimal(amount), int(timestamp), None
+    except (ArithmeticError, ValueError, TypeError):
+        return None, None, 'Ungültige Parameter'
+
+
+def _verify_sumup_lookup(amount, ts_ms, ttl=None, log_miss=True):
+    """Sucht die Zahlung im (frisch nachgeladenen) SumUp-Spiegel; gibt die JSON-Antwort zurück."""
+    from reconciliation.models import SumUpTransaction
+    from reconciliation.sumup_client import SumUpAPIError, SumUpUnavailable
+    from reconciliation.sync import sync_recent
+    from datetime import datetime, timezone as dt_timezone
+
+    payment_time = datetime.fromtimestamp(ts_ms / 1000, tz=dt_timezone.utc)
+    oldest = payment_time - timedelta(minutes=5)
+    newest = payment_time + timedelta(minutes=10)
+
+    # Die Zahlung ist Sekunden alt — das jüngste Fenster live in den Spiegel
+    # nachladen, geteilt mit allen anderen Kassen im selben TTL-Bucket.
+    # Schlägt die API fehl, hat ihn evtl. der Sync-Job schon.
+    api_error = None
     try:
-        client = SumUpClient()
-        oldest = (payment_time - timedelta(minutes=5)).strftime('%Y-%m-%dT%H:%M:%SZ')
-        newest = (payment_time + timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%SZ')
-
-        data = client._get('/v0.1/me/transactions/history', params={
-            'oldest_time': oldest,
-            'newest_time': newest,
-            'limit': 20,
-        })
-        transactions = data.get('items', [])
-
-        # Kandidaten sammeln: SUCCESSFUL + Betrag passt + tx_code vorhanden
-        # + noch keiner Sale zugeordnet. Bevorzugt: Title-Match auf "Kauf-{ts_ms}"
-        # (haben wir beim SumUp-Initial-Call mitgegeben). So unterscheiden wir
-        # zwei legitime Zahlungen mit gleichem Betrag im selben Zeitfenster.
-        expected_title = f"Kauf-{ts_ms}"
-        title_match = None
-        amount_match = None
-        skipped_already_booked = 0
-
-        for txn in transactions:
-            if txn.get('status') != 'SUCCESSFUL':
-                continue
-            txn_amount = Decimal(str(txn.get('amount', 0)))
-            if abs(txn_amount - amount) > Decimal('0.01'):
-                continue
-            tx_code = txn.get('transaction_code') or ''
-            if not tx_code:
-                continue
-            if Sale.objects.filter(transaction_id=tx_code).exists():
-                skipped_already_booked += 1
-                logger.info("verify_sumup.skip_already_booked tx=%s", tx_code)
-                continue
-            description = (txn.get('description') or '')
-            if expected_title and expected_title in description:
-                title_match = txn
-                break  # Title-Hit ist eindeutig, abbrechen
-            if amount_match is None:
-                amount_match = txn
-
-        chosen = title_match or amount_match
-        if chosen:
-            tx_code = chosen.get('transaction_code', '')
-            logger.info(
-                "verify_sumup.hit amount=%s tx=%s ts=%s match_kind=%s",
-                amount, tx_code, chosen.get('timestamp'),
-                'title' if title_match else 'amount',
-            )
-            return JsonResponse({
-                'verified': True,
-                'transaction_code': tx_code,
-                'sumup_tx_id': chosen.get('id', ''),
-                'match_kind': 'title' if title_match else 'amount',
-            })
+        sync_recent(oldest, ttl=ttl)
+    except SumUpAPIError as e:
+        api_error = e
+        logger.warning("verify_sumup.api_error %s", e)
 
+    # Kandidaten sammeln: SUCCESSFUL + Betrag passt + tx_code vorhanden
+    # + noch keiner Sale zugeordnet. Bevorzugt: Title-Match auf "Kauf-{ts_ms}"
+    # (haben wir beim SumUp-Initial-Call mitgegeben). So unterscheiden wir
+    # zwei legitime Zahlungen mit gleichem Betrag im selben Zeitfenster.
+    transactions = list(
+        SumUpTransaction.objects.filter(
+            status='SUCCESSFUL',
+            timestamp__range=(oldest, newest),
+            amount__gte=amount - Decimal('0.01'),
+            amount__lte=amount + Decimal('0.01'),
+        ).exclude(transaction_code='').order_by('timestamp')
+    )
+    booked_codes = set(
+        Sale.objects.filter(transaction_id__in=[t.transaction_code for t in transactions])
+        .values_list('transaction_id', flat=True)
+    )
+    expected_title = f"Kauf-{ts_ms}"
+    title_match = None
+    amount_match = None
+    skipped_already_booked = 0
+
+    for txn in transactions:
+        if txn.transaction_code in booked_codes:
+            skipped_already_booked += 1
+            if log_miss:
+                logger.info("verify_sumup.skip_already_booked tx=%s", txn.transaction_code)
+            continue
+        if expected_title in txn.description:
+            title_match = txn
+            break  # Title-Hit ist eindeutig, abbrechen
+        if amount_match is None:
+            amount_match = txn
+
+    chosen = title_match or amount_match
+    if chosen:
         logger.info(
-            "verify_sumup.miss amount=%s window=%s..%s candidates=%d skipped_booked=%d",
-            amount, oldest, newest, len(transactions), skipped_already_booked,
+            "verify_sumup.hit amount=%s tx=%s ts=%s match_kind=%s",
+            amount, chosen.transaction_code, chosen.timestamp.isoformat(),
+            'title' if title_match else 'amount',
         )
-        if skipped_already_booked:
-            return JsonResponse({
-                'verified': False,
-                'error': 'Alle passenden SumUp-Zahlungen sind bereits einem Verkauf zugeordnet. Falls dies eine neue Zahlung ist, in der SumUp-App die Transaktion prüfen.',
-            })
-        return JsonResponse({'verified': False, 'error': 'Keine passende SumUp-Zahlung gefunden'})
-
-    except SumUpAPIError as e:
-        logger.warning("verify_sumup.api_error %s", e)
-        return JsonResponse({'verified': False, 'error': f'SumUp API: {e}'})
+        return {
+            'verified': True,
+            'transaction_code': chosen.transaction_code,
+            'sumup_tx_id': chosen.sumup_id,
+            'match_kind': 'title' if title_match else 'amount',
+        }
 
+    if log_miss:
+        logger.info(
+            "verify_sumup.miss amount=%s window=%s..%s candidates=%d skipped_booked=%d",
+            amount, oldest.isoformat(), newest.isoformat(), len(transactions), skipped_already_booked,
+        )
+    if skipped_already_booked:
+        return {
+            'verified': False,
+            'error': 'Alle passenden SumUp-Zahlungen sind bereits einem Verkauf zugeordnet. Falls dies eine neue Zahlung ist, in der SumUp-App die Transaktion prüfen.',
+        }
+    if isinstance(api_error, SumUpUnavailable):
+        # Breaker offen: sofort antworten statt auf den Timeout zu warten
+        return {
+            'verified': False,
+            'error': 'SumUp ist gerade gestört — Zahlung in der SumUp-App prüfen und bei Erfolg ohne Verifizierung buchen.',
+            'sumup_unavailable': True,
+        }
+    if api_error:
+        return {'verified': False, 'error': f'SumUp API: {api_error}'}
+    return {'verified': False, 'error': 'Keine passende SumUp-Zahlung gefunden'}
 
-# --- CHECKOUT LOGIK ---
 
-def _existing_sale_response(sale):
-    return JsonResponse({
-        'success': True,
-        'sale_id': sale.id,
-        'pdf_url': f"/commerce/sale/{sale.id}/pdf/",
-        'duplicate_prevented': True,
-    })
+@staff_member_required
+@require_GET
+async def api_verify_sumup_payment(request):
+    """
+    Prüft anhand des SumUp-Spiegels, ob eine Zahlung mit passendem Betrag und Timestamp existiert.
+    Async: Unter ASGI wartet die Anfrage auf SumUp, ohne die übrige Kasse zu blockieren.
+    """
+    amount, ts_ms, error = _verify_sumup_params(request)
+    if error:
+        return JsonResponse({'verified': False, 'error': error})
+    return JsonResponse(await sync_to_async(_verify_sumup_lookup)(amount, ts_ms))
 
 
-@staff_member_required
-@require_POST
-@transaction.atomic
-def api_checkout(request):
+def _verify_sumup_check(amount, ts_ms, ttl):
     try:
-        data = json.loads(request.body)
-        items = data.get('items', [])
-        payment_method = data.get('payment_method', 'CASH')
-        customer_data = data.get('customer', None)
-        transaction_code = data.get('transaction_code', '')
-        idempotency_key = (data.get('idempotency_key') or '').strip() or None
-        confirm_duplicate = bool(data.get('confirm_duplicate'))
+        return _verify_sumup_lookup(amount, ts_ms, ttl=ttl, log_miss=False)
+    finally:
+        # Zwischen den Prüfungen keine DB-Verbindung offen halten (CONN_MAX_AGE)
+        close_old_connections()
 
-        if not items:
-            return JsonResponse({'success': False, 'error': 'Warenkorb leer'})
 
-        logger.info(
-            "checkout.request user=%s method=%s items=%d tx_code=%s idem=%s confirm_dup=%s",
-            request.user.id, payment_method, len(items),
-            transaction_code or '-', idempotency_key or '-', confirm_duplicate,
-        )
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        # --- Doppelter Boden, Schicht 1: exakter Idempotency-Key match ---
-        if idempotency_key:
-            existing = Sale.objects.filter(idempotency_key=idempotency_key).first()
-            if existing:
-                logger.info("checkout.duplicate_prevented layer=idempotency sale=%s", existing.id)
-                return _existing_sale_response(existing)
-
-        # --- Doppelter Boden, Schicht 2: gleicher SumUp transaction_code ---
-        # Gleiches Pattern wie Shopify-Webhook (views.py: shopify_webhook).
-        if transaction_code:
-            existing = Sale.objects.filter(transaction_id=transaction_code).first()
-            if existing:
-                logger.info("checkout.duplicate_prevented layer=tx_code sale=%s tx=%s",
-                            existing.id, transaction_code)
-                return _existing_sale_response(existing)
-
-        # --- Doppelter Boden, Schicht 3: naher Duplikat-Verdacht ---
-        # Gleicher Operator + Betrag + Zahlungsmethode innert 60s → Rückfrage.
-        # NUR für Zahlungen ohne externe Transaktion-ID. Bei SumUp haben zwei
-        # legitime Zahlungen unterschiedliche transaction_codes — Schicht 2
-        # blockiert echte Doppelbuchungen bereits sauber. Ein 409 hier wäre
-        # brandgefährlich: die Karte wurde bereits belastet, "Abbrechen" würde
-        # zu "Geld kassiert, kein Sale gebucht" führen.
-        cart_total = Decimal('0.00')
-        for it in items:
-            try:
-                qty_i = int(it.get('qty', 0))
-                price_raw = it.get('custom_price') if it.get('custom_price') is not None else it.get('price', 0)
-                cart_total += Decimal(str(price_raw)) * qty_i
-            except (ValueError, TypeError, ArithmeticError):
-                continue
 
-        if not confirm_duplicate and cart_total > 0 and not transaction_code:
-            recent_cutoff = timezone.now() - timedelta(seconds=60)
-            near_dup = Sale.objects.filter(
-                created_by=request.user,
-                payment_method=payment_method,
-                total_amount_gross=cart_total,
-                status=Sale.Status.COMPLETED,
-                date__gte=recent_cutoff,
-            ).exists()
-            if near_dup:
-                logger.warning("checkout.near_duplicate user=%s amount=%s method=%s",
-                               request.user.id, cart_total, payment_method)
-                return JsonResponse({
-                    'success': False,
-                    'needs_confirmation': True,
-                    'warning': 'Vor weniger als 60 Sekunden wurde bereits ein Verkauf mit identischem Betrag und Zahlungsmethode gebucht. Wirklich nochmal buchen?',
-                }, status=409)
-
-        # 1. Sale erstellen
-        try:
-            sale = Sale.objects.create(
-                date=timezone.now(),
-                payment_method=payment_method,
-                status=Sale.Status.COMPLETED,
-                created_by=request.user,
-                channel=Sale.SalesChannel.POS,
-                transaction_id=transaction_code or None,
-                idempotency_key=idempotency_key,
-            )
-        except IntegrityError:
-            # Letzter Schutzwall: Race zwischen zwei parallelen Requests.
-            # Der andere Request war schneller — existierenden Sale zurückgeben.
-            existing = None
-            if idempotency_key:
-                existing = Sale.objects.filter(idempotency_key=idempotency_key).first()
-            if not existing and transaction_code:
-                existing = Sale.objects.filter(transaction_id=transaction_code).first()
-            if existing:
-                return _existing_sale_response(existing)
-            raise
-
-        total_gross = Decimal('0.00')
-
-        # 2. Items hinzufügen
-        for item in items:
-            product = Product.objects.get(id=item['id'])
-            qty = int(item['qty'])
-            
-            # Preis ermitteln:
-            # Standard: Preis aus DB
-            # Ausnahme: 'custom_price' im Request UND Produkt SKU ist 'DIVERSES'
-            custom_price_raw = item.get('custom_price')
-            
-            # Wir holen den Preis standardmässig vom Produkt
-            unit_price = product.sales_price
-            
-            # Wenn es DIVERSES ist und ein Custom Price mitkommt:
-            if product.sku == 'DIVERSES' and custom_price_raw is not None:
-                try:
-                    unit_price = Decimal(str(custom_price_raw))
-                except:
-                    pass # Fallback auf Produktpreis (0.00) bei Fehler
+@staff_member_required
+@require_GET
+async def api_verify_sumup_stream(request):
+    """
+    Server-Sent Events statt Polling: prüft im Sekundentakt gegen den Spiegel
+    (Upstream-Fetch via sync_recent, über alle Kassen gebündelt) und schickt
+    `event: payment` mit der verify-Antwort, sobald die Zahlung auftaucht.
+    Nach SUMUP_STREAM_SECONDS `event: timeout`. Läuft unter ASGI
+    (stock_keeper.asgi, Service `events`) — pro Kasse eine ruhende Verbindung,
+    kein blockierter Worker.
+    """
+    amount, ts_ms, error = _verify_sumup_params(request)
+    if error:
+        return JsonResponse({'verified': False, 'error': error}, status=400)
+
+    interval = getattr(settings, 'SUMUP_STREAM_INTERVAL_SECONDS', 1)
+    lifetime = getattr(settings, 'SUMUP_STREAM_SECONDS', 180)
+    check = sync_to_async(_verify_sumup_check)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + lifetime
+        keepalive_at = loop.time() + SSE_KEEPALIVE_SECONDS
+        payload = {'verified': False}
+        yield "retry: 3000\n\n"
+        while loop.time() < deadline:
+            payload = await check(amount, ts_ms, interval)
+            if payload['verified']:
+                yield _sse('payment', payload)
+                return
+            if loop.time() >= keepalive_at:
+                yield ": keepalive\n\n"
+                keepalive_at = loop.time() + SSE_KEEPALIVE_SECONDS
+            await asyncio.sleep(interval)
+        logger.info("verify_sumup.stream_timeout amount=%s ts=%s", amount, ts_ms)
+        yield _sse('timeout', payload)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Proxy soll nicht puffern
+    return response
 
-            # WICHTIG: Die VAT Rate muss explizit ermittelt und übergeben werden.
-            # Wenn unit_price gesetzt ist, greift die automatische Ermittlung im Model.save() oft nicht.
-            vat_rate = product.vat.rate if product.vat else Decimal('0.00')
 
-            # SaleItem erstellen (Audit Log passiert automatisch im SaleItem.save())
-            SaleItem.objects.create(
-                sale=sale,
-                product=product,
-                quantity=qty,
-                unit_price_gross=unit_price, # Hier nutzen wir den (evtl. manuellen) Preis
-                vat_rate=vat_rate # <--- BUGFIX: Explizit übergeben
-            )
+# --- CHECKOUT LOGIK ---
 
-            total_gross += (unit_price * qty)
+@staff_member_required
+@require_POST
+def api_checkout(request):
+    data = {}
+    try:
+        data = json.loads(request.body)
+        # Eine Transaktion pro Verkauf: ein Fehler mittendrin rollt alles zurück.
+        with transaction.atomic():
+            payload, status = book_checkout(request.user, data)
+        return JsonResponse(payload, status=status)
+    except Exception as e:
+        logger.exception("checkout.error user=%s method=%s tx=%s",
+                         getattr(request.user, 'id', None), data.get('payment_method', 'CASH'),
+                         data.get('transaction_code') or '-')
+        return JsonResponse({'success': False, 'error': str(e)})
 
-        # 3. Totals berechnen
-        sale.total_amount_gross = total_gross
-        
-        # Exakte Netto-Berechnung
-        total_net = Decimal('0.00')
-        # Items neu laden um sicherzugehen, dass wir die gespeicherten Daten haben
-        for s_item in sale.items.all():
-            vr = s_item.vat_rate or Decimal('0.00')
-            # Netto = Brutto / (1 + Steuersatz)
-            net_price = s_item.total_price_gross / (Decimal('1.00') + (vr / Decimal('100.00')))
-            total_net += net_price
-
-        sale.total_amount_net = round(total_net, 2)
-        sale.save()
-
-        # PDF URL Logic (Standard: Thermo-Bon)
-        pdf_url = f"/commerce/sale/{sale.id}/pdf/"
-
-        # 4. Spezifische Logik für RECHNUNG
-        invoice_email_sent = None
-        invoice_email_error = ''
-        if payment_method == 'INVOICE' and customer_data:
-            # CLEANING: Leerzeichen entfernen
-            email = (customer_data.get('email') or '').strip()
-            customer_data['email'] = email
-
-            # Kundendaten am Sale persistieren BEVOR wir versenden
-            sale.customer_first_name = (customer_data.get('first_name') or '').strip()
-            sale.customer_last_name = (customer_data.get('last_name') or '').strip()
-            sale.customer_address = (customer_data.get('address') or '').strip()
-            sale.customer_zip_code = (customer_data.get('zip_code') or '').strip()
-            sale.customer_city = (customer_data.get('city') or '').strip()
-            sale.customer_email = email
-            sale.save()
 
-            success, info = send_invoice_email(sale, customer_data)
-            invoice_email_sent = success
-            if success:
-                sale.invoice_status = Sale.InvoiceStatus.SENT
-                sale.invoice_sent_at = timezone.now()
-                sale.invoice_last_error = ''
-            else:
-                sale.invoice_status = Sale.InvoiceStatus.FAILED
-                sale.invoice_last_error = info or 'Unbekannter Fehler'
-                invoice_email_error = sale.invoice_last_error
-                logger.warning("invoice.email_failed sale=%s err=%s", sale.id, info)
-            sale.save(update_fields=['invoice_status', 'invoice_sent_at', 'invoice_last_error'])
+@staff_member_required
+@require_POST
+def api_checkout_batch(request):
+    """
+    Nachbuchen offline gepufferter Bar-Verkäufe (Service Worker der Kasse).
+    Jeder Verkauf läuft in einer eigenen Transaktion; ein fehlerhafter Eintrag
+    blockiert die übrigen nicht. Der Idempotency-Key jedes Eintrags macht den
+    Replay wiederholbar: bereits gebuchte Verkäufe kommen als Duplikat zurück.
+    """
+    try:
+        checkouts = json.loads(request.body).get('checkouts') or []
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Ungültiger Payload'}, status=400)
+    max_batch = getattr(settings, 'POS_OFFLINE_BATCH_MAX', 200)
+    if not isinstance(checkouts, list) or len(checkouts) > max_batch:
+        return JsonResponse({'success': False, 'error': f'Maximal {max_batch} Verkäufe pro Batch'}, status=400)
 
-        logger.info("checkout.success sale=%s user=%s method=%s tx=%s gross=%s",
-                    sale.id, request.user.id, payment_method, transaction_code or '-', total_gross)
+    results = []
+    for entry in checkouts:
+        entry = entry if isinstance(entry, dict) else {}
+        key = (entry.get('idempotency_key') or '').strip()
+        result = {'idempotency_key': key}
+        if not key:
+            result.update(success=False, error='Idempotency-Key fehlt')
+        elif entry.get('payment_method', 'CASH') != 'CASH':
+            # SumUp muss verifiziert, Rechnungen versendet werden — nur Bar darf offline.
+            result.update(success=False, error='Offline nur Barzahlung möglich')
+        else:
+            try:
+                with transaction.atomic():
+                    # Schicht 3 (Rückfrage bei Fast-Duplikat) greift hier nicht:
+                    # niemand steht mehr an der Kasse, der Key schützt vor Doppelbuchung.
+                    payload, _status = book_checkout(
+                        request.user, {**entry, 'confirm_duplicate': True}, offline=True,
+                    )
+                result.update(
+                    success=payload['success'],
+                    sale_id=payload.get('sale_id'),
+                    duplicate_prevented=payload.get('duplicate_prevented', False),
+                    error=payload.get('error', ''),
+                )
+            except Exception as e:
+                logger.exception("checkout.batch_error user=%s idem=%s", request.user.id, key)
+                result.update(success=False, error=str(e))
+        results.append(result)
+
+    logger.info("checkout.batch user=%s count=%d ok=%d", request.user.id, len(results),
+                sum(1 for r in results if r['success']))
+    return JsonResponse({'success': True, 'results': results})
 
-        response_data = {
-            'success': True,
-            'sale_id': sale.id,
-            'pdf_url': pdf_url,
-            'admin_url': reverse('admin:commerce_sale_change', args=[sale.id]),
-            'resend_invoice_url': reverse('sale_resend_invoice', args=[sale.id]),
-        }
-        if invoice_email_sent is not None:
-            response_data['invoice_email_sent'] = invoice_email_sent
-            response_data['invoice_email_error'] = invoice_email_error
-        return JsonResponse(response_data)
 
-    except Exception as e:
-        logger.exception("checkout.error user=%s method=%s tx=%s",
-                         getattr(request.user, 'id', None), payment_method, transaction_code or '-')
-        return JsonResponse({'success': False, 'error': str(e)})
+@require_GET
+def pos_service_worker(request):
+    """
+    Service Worker der Kasse. Über einen View statt /static/ ausgeliefert,
+    damit sein Scope /commerce/ abdeckt (inkl. api/checkout/).
+    """
+    response = render(request, 'commerce/pos_sw.js', content_type='application/javascript')
+    response['Service-Worker-Allowed'] = '/commerce/'
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 # --- PDF VIEWS ---
 
@@ -434,9 +415,12 @@ def sale_invoice_pdf_view(request, sale_id):
 
 
 @staff_member_required
-def sale_resend_invoice_view(request, sale_id):
-    """Korrigieren der Rechnungs-Kundendaten + erneuter Mail-Versand."""
-    sale = get_object_or_404(Sale, id=sale_id)
+async def sale_resend_invoice_view(request, sale_id):
+    """
+    Korrigieren der Rechnungs-Kundendaten + erneuter Mail-Versand.
+    Async: PDF und SMTP laufen per sync_to_async in einem Thread.
+    """
+    sale = await aget_object_or_404(Sale, id=sale_id)
 
     if request.method == 'POST':
         first_name = (request.POST.get('first_name') or '').strip()
@@ -468,25 +452,30 @@ def sale_resend_invoice_view(request, sale_id):
             sale.customer_zip_code = zip_code
             sale.customer_city = city
             sale.customer_email = email
-            sale.save()
+            await sale.asave()
 
-            success, info = send_invoice_email(sale, sale.customer_data_dict())
+            success, info = await sync_to_async(send_invoice_email)(sale, sale.customer_data_dict())
             if success:
                 sale.invoice_status = Sale.InvoiceStatus.RESENT
                 sale.invoice_sent_at = timezone.now()
                 sale.invoice_last_error = ''
-                sale.save(update_fields=['invoice_status', 'invoice_sent_at', 'invoice_last_error'])
+                await sale.asave(update_fields=['invoice_status', 'invoice_sent_at', 'invoice_last_error'])
                 messages.success(request, f"Rechnung erneut an {email} versendet.")
+                user = await request.auser()
                 logger.info("invoice.resent sale=%s to=%s user=%s",
-                            sale.id, email, request.user.id)
+                            sale.id, email, user.id)
                 return redirect(reverse('admin:commerce_sale_change', args=[sale.id]))
             else:
                 sale.invoice_status = Sale.InvoiceStatus.FAILED
                 sale.invoice_last_error = info or 'Unbekannter Fehler'
-                sale.save(update_fields=['invoice_status', 'invoice_last_error'])
+                await sale.asave(update_fields=['invoice_status', 'invoice_last_error'])
                 messages.error(request, f"Versand fehlgeschlagen: {sale.invoice_last_error}")
                 logger.warning("invoice.resend_failed sale=%s err=%s", sale.id, info)
 
+    return await sync_to_async(_render_resend_invoice)(request, sale)
+
+
+def _render_resend_invoice(request, sale):
     context = admin.site.each_context(request)
     context.update({
         'sale': sale,
@@ -495,6 +484,19 @@ def sale_resend_invoice_view(request, sale_id):
     })
     return render(request, 'commerce/sale_resend_invoice.html', context)
 
+
+@staff_member_required
+@require_GET
+def api_invoice_status(request, sale_id):
+    """Versandstatus der Rechnung — pollt die Kasse, solange der Versand aussteht."""
+    sale = get_object_or_404(Sale.objects.only('id', 'invoice_status', 'invoice_sent_at', 'invoice_last_error'), id=sale_id)
+    return JsonResponse({
+        'sale_id': sale.id,
+        'invoice_status': sale.invoice_status,
+        'invoice_sent_at': sale.invoice_sent_at.isoformat() if sale.invoice_sent_at else None,
+        'invoice_email_error': sale.invoice_last_error if sale.invoice_status == Sale.InvoiceStatus.FAILED else '',
+    })
+
 # --- PURCHASE CHECKOUT ---
 
 @staff_member_required
@@ -614,48 +616,53 @@ def accounting_report_view(request):
             categories = form.cleaned_data['categories']
             payment_methods = form.cleaned_data['payment_methods'] # NEU: Liste der gewählten Codes
             
-            # 1. Sale Items holen (für Kategorie-Stats)
-            items_qs = SaleItem.objects.filter(
-                sale__date__date__gte=start_date,
-                sale__date__date__lte=end_date
-            ).select_related('product', 'product__category', 'sale')
-            
+            # 1. Kategorie-Summen aus dem Reporting-Würfel (pro Tag verdichtet):
+            #    alle Verkäufe am Verkaufstag, auch später stornierte — wie die Liste
+            facts = SalesFact.objects.filter(day__gte=start_date, day__lte=end_date, kind=SalesFact.Kind.SALE)
             if categories:
-                items_qs = items_qs.filter(product__category__in=categories)
-            
-            # NEU: Filter nach Zahlungsmethode (auf Sale-Ebene via Relation)
+                facts = facts.filter(category__in=categories)
             if payment_methods:
-                items_qs = items_qs.filter(sale__payment_method__in=payment_methods)
-            
-            # Aggregation
+                facts = facts.filter(payment_method__in=payment_methods)
+
             category_stats = {}
-            total_period_gross = Decimal('0.00')
-            for item in items_qs:
-                cat_name = item.product.category.name if item.product.category else "Ohne Kategorie"
-                if cat_name not in category_stats:
-                    category_stats[cat_name] = {'gross': Decimal('0.00'), 'net': Decimal('0.00'), 'vat': Decimal('0.00')}
-                
-                qty = item.quantity
-                gross = item.unit_price_gross * qty if item.unit_price_gross else Decimal('0.00')
-                vat_rate = item.vat_rate or Decimal('0.00')
-                divisor = Decimal('1.00') + (vat_rate / Decimal('100.00'))
-                net = gross / divisor
-                vat_amt = gross - net
-                
-                category_stats[cat_name]['gross'] += gross
-                category_stats[cat_name]['net'] += net
-                category_stats[cat_name]['vat'] += vat_amt
-                total_period_gross += gross
-            
-            # 2. Sales Liste holen
-            sales_qs = Sale.objects.filter(date__date__gte=start_date, date__date__lte=end_date).order_by('date')
+            rows = facts.values('category__name').annotate(
+                gross=Sum('gross'), net=Sum('net'), vat=Sum('vat'),
+            ).order_by('category__name')
+            for row in rows:
+                cat_name = row['category__name'] or "Ohne Kategorie"
+                stats = category_stats.setdefault(
+                    cat_name, {'gross': Decimal('0.00'), 'net': Decimal('0.00'), 'vat': Decimal('0.00')}
+                )
+                stats['gross'] += row['gross'] or 0
+                stats['net'] += row['net'] or 0
+                stats['vat'] += row['vat'] or 0
+
+            # 2. Sales Liste holen: Betrag = Positionen der gewählten Kategorien,
+            #    das Total ist die Summe der Zeilen (gleiche Quelle wie die Liste)
+            line_gross = ExpressionWrapper(
+                F('items__quantity') * Coalesce(F('items__unit_price_gross'), Value(Decimal('0.00'))),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            )
+            if categories:
+                amount = Sum(line_gross, filter=Q(items__product__category__in=categories))
+            else:
+                amount = Sum(line_gross)
+            sales_qs = (
+                Sale.objects.filter(date__date__gte=start_date, date__date__lte=end_date)
+                .select_related('created_by')
+                .annotate(item_count=Count('items', distinct=True), amount_gross=amount)  # Count: alle Positionen
+                .order_by('date')
+            )
             
             if categories:
-                sales_qs = sales_qs.filter(items__product__category__in=categories).distinct()
+                sales_qs = sales_qs.filter(amount_gross__isnull=False)
             
             # NEU: Filter nach Zahlungsmethode für die Sales-Liste
             if payment_methods:
                 sales_qs = sales_qs.filter(payment_method__in=payment_methods)
+
+            sales_list = list(sales_qs)
+            total_period_gross = sum((sale.amount_gross or Decimal('0.00') for sale in sales_list), Decimal('0.00'))
             
             # "Schöne" Namen für die gewählten Methoden für das PDF aufbereiten
             payment_methods_display = []
@@ -669,7 +676,7 @@ def accounting_report_view(request):
                 'start_date': start_date, 
                 'end_date': end_date, 
                 'category_stats': category_stats, 
-                'sales_list': sales_qs, 
+                'sales_list': sales_list, 
                 'total_period_gross': total_period_gross, 
                 'generation_date': timezone.now(),
                 # Für Anzeige im PDF
@@ -733,18 +740,19 @@ def mwst_report_view(request):
         if form.is_valid():
             start_date = form.cleaned_data['start_date']
             end_date = form.cleaned_data['end_date']
-            sale_items = SaleItem.objects.filter(sale__date__date__gte=start_date, sale__date__date__lte=end_date)
+            # Umsatz pro MWST-Satz aus dem Reporting-Würfel: alle Verkäufe am Verkaufstag
+            by_rate = SalesFact.objects.filter(day__gte=start_date, day__lte=end_date, kind=SalesFact.Kind.SALE)\
+                .values('vat_rate').annotate(gross=Sum('gross'), net=Sum('net'), vat=Sum('vat'))\
+                .order_by('vat_rate')
             
             ziffer_200_total = Decimal('0.00')
             norm_base = norm_tax = red_base = red_tax = spec_base = spec_tax = Decimal('0.00')
             
-            for item in sale_items:
-                gross = item.total_price_gross
-                ziffer_200_total += gross
-                rate = item.vat_rate or Decimal('0.00')
-                divisor = Decimal('1.00') + (rate / Decimal('100.00'))
-                net = gross / divisor
-                tax = gross - net
+            for row in by_rate:
+                ziffer_200_total += row['gross'] or 0
+                rate = row['vat_rate'] or Decimal('0.00')
+                net = row['net'] or Decimal('0.00')
+                tax = row['vat'] or Decimal('0.00')
                 if rate >= Decimal('7.0'): norm_base += net; norm_tax += tax
                 elif rate >= Decimal('3.0'): spec_base += net; spec_tax += tax
                 elif rate > Decimal('0.0'): red_base += net; red_tax += tax
@@ -18,8 +18,8 @@ Auth: ``Authorization: Token <WEBSHOP_API_TOKEN>`` (shared secret, env-provided)
 Sales are attributed to the ``webshop_bot`` user (created by migration 0011).
 
 This deliberately does NOT reuse the Shopify webhook (HMAC + Shopify payload
-shape). It reuses the *model* layer (SaleItem.save -> Product.adjust_stock) and
-replaces only the HTTP/auth layer. See supportelle/docs/STOCKKEEPER_ANALYSIS.md.
+shape). It reuses the *model* layer (Sale.add_items -> Product.objects.bulk_adjust_stock)
+and replaces only the HTTP/auth layer. See supportelle/docs/STOCKKEEPER_ANALYSIS.md.
 """
 import base64
 import functools
@@ -197,6 +197,10 @@ def sales(request):
                 customer_city=customer.get('city', ''),
                 customer_email=customer.get('email', ''),
             )
+            # One catalog query for the whole order instead of one per line.
+            skus = {str(it.get('sku') or '').strip() for it in items}
+            by_sku = Product.objects.filter(sku__in=skus).select_related('vat').in_bulk(field_name='sku')
+            lines = []
             for it in items:
                 sku = str(it.get('sku') or '').strip()
                 try:
@@ -205,7 +209,7 @@ def sales(request):
                     qty = 0
                 if not sku or qty <= 0:
                     continue
-                product = Product.objects.filter(sku=sku).first()
+                product = by_sku.get(sku)
                 if not product:
                     missing.append(sku)
                     continue
@@ -215,10 +219,11 @@ def sales(request):
                 except (InvalidOperation, TypeError):
                     price = product.sales_price
                 vat_rate = product.vat.rate if product.vat else Decimal('0.00')
-                SaleItem.objects.create(
-                    sale=sale, product=product, quantity=qty,
+                lines.append(SaleItem(
+                    product=product, quantity=qty,
                     unit_price_gross=price, vat_rate=vat_rate,
-                )
+                ))
+            sale.add_items(lines)
             sale.calculate_totals()
     except IntegrityError:
         # Concurrent duplicate — return the winner.
@@ -0,0 +1,113 @@
+"""Concurrency-Benchmark für den Lager-Ledger (Product.adjust_stock).
+
+Hämmert einen einzelnen Artikel aus vielen Threads gleichzeitig mit
+Lagerbuchungen (je eigene DB-Verbindung/Transaktion) und prüft danach:
+
+  - Endbestand == Startbestand + Σ Buchungen   (kein Lost Update)
+  - Anzahl StockMovements == Anzahl Buchungen
+  - stock_after der Movements ist lückenlos und eindeutig — jeder Eintrag
+    trägt den tatsächlich committeten Bestand.
+
+Läuft gegen die konfigurierte Datenbank (MySQL in dev/prod). Der Test-Artikel
+wird angelegt und am Ende samt Bewegungen wieder gelöscht.
+
+    python manage.py bench_stock_ledger --threads 16 --iterations 50
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from core.models import Product, StockMovement
+
+BENCH_SKU = 'BENCH-LEDGER'
+
+
+class Command(BaseCommand):
+    help = "Parallele adjust_stock-Buchungen auf einen Artikel; prüft, dass nichts verloren geht."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Anzahl paralleler Threads. Default: 16.')
+        parser.add_argument('--iterations', type=int, default=50, help='Buchungen pro Thread. Default: 50.')
+        parser.add_argument('--keep', action='store_true', help='Test-Artikel nach dem Lauf nicht löschen.')
+
+    def handle(self, *args, **opts):
+        threads = max(1, opts['threads'])
+        iterations = max(1, opts['iterations'])
+
+        if connection.vendor == 'sqlite':
+            raise CommandError(
+                "SQLite serialisiert Schreibzugriffe global — der Benchmark braucht MySQL."
+            )
+
+        Product.objects.filter(sku=BENCH_SKU).delete()
+        product = Product.objects.create(
+            name='Benchmark Ledger', sku=BENCH_SKU,
+            cost_price=Decimal('0.00'), sales_price=Decimal('0.00'),
+            stock_quantity=0, track_stock=True,
+        )
+        start_stock = product.stock_quantity
+        errors = []
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            # Eigene Instanz je Thread: simuliert parallele Requests mit
+            # jeweils (potenziell veraltetem) Product-Objekt.
+            local = Product.objects.get(pk=product.pk)
+            barrier.wait()
+            own = []
+            try:
+                for _ in range(iterations):
+                    t0 = time.perf_counter()
+                    local.adjust_stock(1, StockMovement.Type.CORRECTION, notes='bench_stock_ledger')
+                    own.append(time.perf_counter() - t0)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                with lock:
+                    latencies.extend(own)
+                connections.close_all()
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        t_start = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - t_start
+
+        expected_total = threads * iterations
+        product.refresh_from_db()
+        movements = StockMovement.objects.filter(product=product)
+        stock_after_values = sorted(movements.values_list('stock_after', flat=True))
+        expected_after = list(range(start_stock + 1, start_stock + expected_total + 1))
+
+        lost = (start_stock + expected_total) - product.stock_quantity
+        ok = not errors and lost == 0 and stock_after_values == expected_after
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0
+
+        self.stdout.write(
+            f"{threads} Threads × {iterations} Buchungen = {expected_total} in {elapsed:.2f}s "
+            f"({expected_total / elapsed:.0f} Buchungen/s, p50 {p50:.1f} ms, p99 {p99:.1f} ms)"
+        )
+        self.stdout.write(
+            f"  Endbestand {product.stock_quantity} (erwartet {start_stock + expected_total}), "
+            f"verloren: {lost}, Movements: {len(stock_after_values)}, Fehler: {len(errors)}"
+        )
+        for e in errors[:5]:
+            self.stderr.write(f"  {type(e).__name__}: {e}")
+
+        if not opts['keep']:
+            product.delete()
+
+        if not ok:
+            raise CommandError("Ledger inkonsistent — Buchungen verloren oder stock_after falsch.")
+        self.stdout.write(self.style.SUCCESS("OK — keine verlorenen Buchungen."))
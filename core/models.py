@@ -1,13 +1,16 @@
 from django.db import models
-from django.db.models import Max
+from django.db.models import Case, DecimalField, F, IntegerField, Max, Value, When
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
+from django.utils import timezone
 import random
 
+from .search import bump_catalog_version
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
@@ -58,6 +61,127 @@ class Vat(models.Model):
     def __str__(self):
         return f"{self.name} ({self.rate}%)"
 
+class ProductQuerySet(models.QuerySet):
+
+    @transaction.atomic
+    def bulk_adjust_stock(self, lines, movement_type, reference=None, user=None, notes=""):
+        """
+        Bucht die Lagerveränderungen eines ganzen Belegs (Verkauf, Storno,
+        Wareneingang) in einem Rutsch.
+
+        lines: Iterable von Positionen; ein Produkt darf mehrfach vorkommen
+        (stock_after wird pro Zeile fortgeschrieben). Akzeptierte Formen:
+
+          (product_id, quantity)
+          (product_id, quantity, reference)
+          (product_id, quantity, reference, notes)
+          (product_id, quantity, reference, notes, user)
+
+        Fehlende Felder gelten aus reference/notes/user des Aufrufs —
+        Sammelbuchungen über mehrere Belege geben Beleg, Notiz und Benutzer
+        pro Zeile mit.
+
+        Unabhängig von der Zeilenzahl: 1x SELECT ... FOR UPDATE auf die
+        betroffenen Produkte, 1x UPDATE (CASE), 1x INSERT der StockMovements.
+        Produkte ohne Lagerführung werden übersprungen.
+        """
+        lines = [
+            (
+                line[0],
+                line[1],
+                line[2] if len(line) > 2 else reference,
+                line[3] if len(line) > 3 else notes,
+                line[4] if len(line) > 4 else user,
+            )
+            for line in lines if line[1]
+        ]
+        if not lines:
+            return []
+
+        # Sperren in PK-Reihenfolge: parallele Belege mit überlappenden
+        # Artikeln warten aufeinander statt sich gegenseitig zu deadlocken.
+        stock = dict(
+            self.model.objects.select_for_update()
+            .filter(pk__in={line[0] for line in lines}, track_stock=True)
+            .order_by('pk')
+            .values_list('pk', 'stock_quantity')
+        )
+        if not stock:
+            return []
+
+        deltas = {}
+        movements = []
+        for product_id, quantity, line_reference, line_notes, line_user in lines:
+            if product_id not in stock:
+                continue
+            stock[product_id] += quantity
+            deltas[product_id] = deltas.get(product_id, 0) + quantity
+            movements.append(StockMovement(
+                product_id=product_id,
+                quantity=quantity,
+                stock_after=stock[product_id],
+                movement_type=movement_type,
+                user=line_user,
+                notes=line_notes,
+                content_type=ContentType.objects.get_for_model(line_reference) if line_reference else None,
+                object_id=line_reference.pk if line_reference else None,
+            ))
+
+        self.model.objects.filter(pk__in=deltas).update(
+            stock_quantity=Case(
+                *[When(pk=product_id, then=F('stock_quantity') + Value(delta))
+                  for product_id, delta in deltas.items()],
+                default=F('stock_quantity'),
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        bump_catalog_version()  # Suchindex: Bestand geändert
+        return StockMovement.objects.bulk_create(movements)
+
+    @transaction.atomic
+    def bulk_update_moving_average_price(self, lines):
+        """
+        Mengen-Variante von Product.update_moving_average_price für einen ganzen
+        Wareneingang. lines: Iterable von (product_id, incoming_qty, incoming_price).
+        Rechnet wie die Einzelbuchung Zeile für Zeile (Preis vor Bestand), aber
+        mit 1x SELECT ... FOR UPDATE und 1x UPDATE für alle Produkte.
+        """
+        lines = [line for line in lines if line[1] > 0 and line[2] and line[2] > 0]
+        if not lines:
+            return
+
+        current = {
+            row['pk']: row
+            for row in self.model.objects.select_for_update()
+            .filter(pk__in={product_id for product_id, _, _ in lines})
+            .order_by('pk')
+            .values('pk', 'stock_quantity', 'cost_price', 'track_stock')
+        }
+        new_prices = {}
+        for product_id, incoming_qty, incoming_price in lines:
+            row = current.get(product_id)
+            if row is None:
+                continue
+            row['cost_price'] = Product.moving_average_price(
+                row['stock_quantity'], row['cost_price'], incoming_qty, incoming_price
+            )
+            new_prices[product_id] = row['cost_price']
+            # Folgezeilen desselben Artikels sehen den bereits erhöhten Bestand
+            if row['track_stock']:
+                row['stock_quantity'] += incoming_qty
+
+        self.model.objects.filter(pk__in=new_prices).update(
+            cost_price=Case(
+                *[When(pk=product_id, then=Value(price)) for product_id, price in new_prices.items()],
+                default=F('cost_price'),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ),
+            updated_at=timezone.now(),
+        )
+        bump_catalog_version()
+
+
 class Product(models.Model):
     class Unit(models.TextChoices):
         PIECE = 'PCS', _('Stück')
@@ -106,6 +230,8 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         # 1. Start mit dem Produktnamen
         display = self.name
@@ -181,20 +307,16 @@ class Product(models.Model):
             
         super().save(*args, **kwargs)
 
-    @transaction.atomic
-    def update_moving_average_price(self, incoming_qty, incoming_price):
+    @staticmethod
+    def moving_average_price(current_stock, current_cost, incoming_qty, incoming_price):
         """
-        Berechnet den gleitenden Durchschnittspreis (Moving Average Price) neu.
-        Wird bei Wareneingängen aufgerufen.
+        Gleitender Durchschnittspreis nach einem Wareneingang, auf Rappen gerundet.
         Formel: ((Alter Bestand * Alter Preis) + (Neuer Eingang * Neuer Preis)) / Neuer Gesamtbestand
         """
-        if incoming_qty <= 0:
-            return
-
         # Sicherstellen, dass wir mit Decimals rechnen
         incoming_price = Decimal(incoming_price)
-        current_stock = Decimal(self.stock_quantity)
-        current_cost = self.cost_price or Decimal('0.00')
+        current_stock = Decimal(current_stock)
+        current_cost = current_cost or Decimal('0.00')
 
         # Fall 1: Lager war leer oder negativ -> Preis ist einfach der neue Preis
         if current_stock <= 0:
@@ -209,17 +331,51 @@ class Product(models.Model):
             new_cost_price = (current_value + incoming_value) / total_qty
 
         # Runden auf 2 Stellen (Schweizer Standard)
-        self.cost_price = new_cost_price.quantize(Decimal('0.01'))
-        self.save()
+        return new_cost_price.quantize(Decimal('0.01'))
+
+    @transaction.atomic
+    def update_moving_average_price(self, incoming_qty, incoming_price):
+        """
+        Berechnet den gleitenden Durchschnittspreis (Moving Average Price) neu.
+        Wird bei Wareneingängen aufgerufen.
+        Formel: ((Alter Bestand * Alter Preis) + (Neuer Eingang * Neuer Preis)) / Neuer Gesamtbestand
+        """
+        if incoming_qty <= 0:
+            return
+
+        # Aktuellen Bestand + Preis gesperrt nachladen: die Instanz kann veraltet
+        # sein (parallele Verkäufe), und wir schreiben unten nur cost_price zurück.
+        current = Product.objects.select_for_update().filter(pk=self.pk).values(
+            'stock_quantity', 'cost_price'
+        ).get()
+
+        self.stock_quantity = current['stock_quantity']
+        self.cost_price = self.moving_average_price(
+            current['stock_quantity'], current['cost_price'], incoming_qty, incoming_price
+        )
+        # Nur die Preis-Spalte schreiben — ein Full-Row-save() würde einen
+        # veralteten stock_quantity zurückschreiben (Lost Update).
+        self.save(update_fields=['cost_price', 'updated_at'])
 
     @transaction.atomic
     def adjust_stock(self, quantity, movement_type, user=None, reference=None, notes=""):
         if not self.track_stock:
             return None
 
-        # Bestand aktualisieren
-        self.stock_quantity += quantity
-        self.save()
+        # Ledger-Write: atomares UPDATE ... SET stock_quantity = stock_quantity + n
+        # direkt in der DB statt Read-Modify-Write in Python + Full-Row-save().
+        # Parallele Buchungen (POS, Webshop, Inventur) auf denselben Artikel
+        # gehen so nicht verloren, und die Zeilensperre hält nur dieses UPDATE.
+        Product.objects.filter(pk=self.pk).update(
+            stock_quantity=F('stock_quantity') + quantity,
+            updated_at=timezone.now(),
+        )
+        bump_catalog_version()  # Suchindex: Bestand geändert
+        # Unser UPDATE sperrt die Zeile bis zum Commit: der gelesene Wert ist
+        # exakt der Bestand, den diese Transaktion committet.
+        self.stock_quantity = Product.objects.filter(pk=self.pk).values_list(
+            'stock_quantity', flat=True
+        ).get()
         
         # Audit Eintrag
         movement = StockMovement(
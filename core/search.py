@@ -0,0 +1,452 @@
+"""
+Prozess-lokaler Suchindex für die Artikelsuche (POS, Inventur, Scanner, Einkauf).
+
+Statt bei jedem Tastendruck `name__icontains` (Full-Table-Scan auf MySQL)
+hält jeder Prozess den Katalog im Speicher:
+
+  - exakte Maps EAN → id und SKU (casefold) → id, über *alle* Artikel — ein
+    Scan eines inaktiven Artikels (Inventur) findet ihn weiterhin,
+  - für aktive Artikel einen gefalteten (Umlaute/Akzente, Gross/klein)
+    Token-Index über name, size, color, variant_group: Posting-Listen je
+    Wort und je Wortanfang, vorsortiert nach Rang, sodass auch eine
+    Ein-Buchstaben-Suche nur die ersten Treffer anfasst; dazu ein
+    Trigramm-Index als Teilstring-Fallback (alte icontains-Semantik).
+
+Aktualität: ein Katalog-Versions-Token im gemeinsamen Cache (CACHES['catalog'])
+wird nach jedem Commit geändert, der Artikel oder Bestand ändert
+(Product-Signale, Lager-Ledger). Ändert sich das Token, lädt der Index nur die
+Artikel mit neuerem `updated_at` nach. Löschungen sowie MWST-/Lieferanten-
+Änderungen setzen ein Epoch-Token → kompletter Neuaufbau.
+
+updated_at wird vor dem Commit gesetzt. Committet eine Transaktion länger
+als REFRESH_OVERLAP nach ihrem Zeitstempel (langsamer Checkout, Sammelbuchung
+unter Sperre), sieht das Nachladen die Zeile nicht. Deshalb gleicht der Index
+alle CATALOG_RECONCILE_SECONDS (id, updated_at) aller Artikel mit seinem Stand
+ab und lädt Abweichungen nach — verpasste Änderungen sind so höchstens ein
+Intervall alt.
+"""
+import bisect
+import json
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CACHE_ALIAS = 'catalog'
+VERSION_KEY = 'core.catalog.version'
+EPOCH_KEY = 'core.catalog.epoch'
+
+# Commits können in anderer Reihenfolge sichtbar werden als ihr updated_at —
+# beim Nachladen etwas zurückgreifen (Zeilen werden idempotent neu indiziert).
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+# Präfix-Listen bis zu dieser Länge; längere Suchwörter werden nachgeprüft.
+PREFIX_MAX = 8
+
+
+def fold(text):
+    """'Größe Weiß' → 'grosse weiss': NFKD, Akzente weg, casefold."""
+    if not text or text.isascii():
+        return (text or '').casefold()
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return text.casefold()
+
+
+def tokens(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bump_catalog_version(full=False):
+    """Nach dem Commit: neues Versions-Token (bzw. Epoch-Token für Neuaufbau)."""
+    def _bump():
+        cache = caches[CACHE_ALIAS]
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        if full:
+            cache.set(EPOCH_KEY, uuid.uuid4().hex, None)
+    transaction.on_commit(_bump)
+
+
+def _payload(p):
+    return {
+        'id': p.id,
+        'name': str(p),
+        'ean': p.ean,
+        'sku': p.sku,  # SKU für Frontend-Logik (Diverses)
+        'price': float(p.sales_price),
+        'cost': float(p.cost_price),
+        'stock': p.stock_quantity,
+        'track_stock': p.track_stock,
+        'vat_rate': float(p.vat.rate) if p.vat else 0.0,
+        'supplier_id': p.supplier.id if p.supplier else None,
+        'supplier_name': p.supplier.name if p.supplier else "Unbekannt",
+    }
+
+
+class CatalogIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._state = (None, None)  # (version, epoch) des Cache-Stands
+        self._reconcile_due = 0.0    # time.monotonic() des nächsten Abgleichs
+        self._built = False
+        self._subscribers = []
+        self.clear()
+
+    def subscribe(self, callback):
+        """callback(ids) nach jedem Nachladen; ids=None bei komplettem Neuaufbau."""
+        self._subscribers.append(callback)
+
+    def clear(self):
+        with self._lock:
+            self._built = False
+            self._high_water = None
+            self.payloads = {}      # id → Such-Resultat (fertig serialisierbar)
+            self.by_ean = {}
+            self.by_sku = {}
+            self._keys = {}         # id → (ean, sku) für das Entfernen
+            self._updated_ms = {}   # id → updated_at in ms (Katalog-Snapshot)
+            # Textindex (nur aktive Artikel). Posting-Listen sind nach dem
+            # statischen Rang sortiert — die Suche liest nur die ersten Treffer.
+            self._rank = {}         # id → (len(name), gefalteter Name, id)
+            self._tokens = {}       # id → frozenset der Tokens
+            self._haystack = {}     # id → gefalteter Suchtext
+            self._exact = {}        # token → [rank, …] sortiert
+            self._prefix = {}       # Präfix (1..PREFIX_MAX Zeichen) → [rank, …] sortiert
+            self._trigrams = {}     # Trigramm → {ids}
+
+    # --- Aufbau -----------------------------------------------------------
+
+    def _queryset(self):
+        from .models import Product
+        return Product.objects.select_related('vat', 'supplier').only(
+            'id', 'name', 'size', 'color', 'variant_group', 'ean', 'sku', 'is_active',
+            'sales_price', 'cost_price', 'stock_quantity', 'track_stock', 'updated_at',
+            'vat__rate', 'supplier__id', 'supplier__name',
+        )
+
+    @staticmethod
+    def _prefixes(toks):
+        return {t[:n] for t in toks for n in range(1, min(len(t), PREFIX_MAX) + 1)}
+
+    @staticmethod
+    def _list_remove(index, key, rank):
+        lst = index.get(key)
+        if lst is None:
+            return
+        i = bisect.bisect_left(lst, rank)
+        if i < len(lst) and lst[i] == rank:
+            del lst[i]
+        if not lst:
+            del index[key]
+
+    def _remove(self, pid):
+        ean, sku = self._keys.pop(pid, (None, None))
+        if ean and self.by_ean.get(ean) == pid:
+            del self.by_ean[ean]
+        if sku and self.by_sku.get(sku) == pid:
+            del self.by_sku[sku]
+        self.payloads.pop(pid, None)
+        self._updated_ms.pop(pid, None)
+        rank = self._rank.pop(pid, None)
+        if rank is None:
+            return
+        toks = self._tokens.pop(pid)
+        for tok in toks:
+            self._list_remove(self._exact, tok, rank)
+        for prefix in self._prefixes(toks):
+            self._list_remove(self._prefix, prefix, rank)
+        for tri in trigrams(self._haystack.pop(pid)):
+            ids = self._trigrams.get(tri)
+            if ids is not None:
+                ids.discard(pid)
+                if not ids:
+                    del self._trigrams[tri]
+
+    def _add(self, p, bulk=False):
+        # bulk: Neuaufbau — anhängen und am Ende einmal sortieren statt insort
+        insert = list.append if bulk else bisect.insort
+        if not bulk:
+            self._remove(p.id)
+        self.payloads[p.id] = _payload(p)
+        sku = (p.sku or '').casefold()
+        self._keys[p.id] = (p.ean, sku)
+        self._updated_ms[p.id] = int(p.updated_at.timestamp() * 1000)
+        if p.ean:
+            self.by_ean[p.ean] = p.id
+        if sku:
+            self.by_sku[sku] = p.id
+        if not p.is_active:
+            return
+        toks = tokens(' '.join(filter(None, [p.name, p.size, p.color, p.variant_group])))
+        name = fold(self.payloads[p.id]['name'])
+        rank = (len(name), name, p.id)  # kürzere Namen zuerst, dann alphabetisch
+        self._rank[p.id] = rank
+        self._tokens[p.id] = frozenset(toks)
+        self._haystack[p.id] = haystack = ' '.join(toks)
+        for tok in self._tokens[p.id]:
+            insert(self._exact.setdefault(tok, []), rank)
+        for prefix in self._prefixes(toks):
+            insert(self._prefix.setdefault(prefix, []), rank)
+        for tri in trigrams(haystack):
+            self._trigrams.setdefault(tri, set()).add(p.id)
+
+    def _load(self, qs, bulk=False):
+        ids = set()
+        for p in qs.iterator(chunk_size=2000):
+            self._add(p, bulk=bulk)
+            ids.add(p.id)
+            if self._high_water is None or p.updated_at > self._high_water:
+                self._high_water = p.updated_at
+        if bulk:
+            for lst in self._exact.values():
+                lst.sort()
+            for lst in self._prefix.values():
+                lst.sort()
+        return ids
+
+    def _reconcile(self):
+        """Lädt Artikel nach, deren updated_at vom Indexstand abweicht (verpasste Commits)."""
+        from .models import Product
+        current = {
+            pid: int(updated_at.timestamp() * 1000)
+            for pid, updated_at in Product.objects.values_list('id', 'updated_at').iterator(chunk_size=5000)
+        }
+        stale = {pid for pid, ms in current.items() if self._updated_ms.get(pid) != ms}
+        gone = set(self._updated_ms) - set(current)
+        for pid in gone:
+            self._remove(pid)
+        if stale:
+            self._load(self._queryset().filter(pk__in=stale))
+        return stale | gone
+
+    def refresh(self):
+        """Gleicht den Index mit dem Cache-Token ab; lädt nur Geändertes nach."""
+        state = caches[CACHE_ALIAS].get_many([VERSION_KEY, EPOCH_KEY])
+        state = (state.get(VERSION_KEY), state.get(EPOCH_KEY))
+        now = time.monotonic()
+        with self._lock:
+            reconcile = now >= self._reconcile_due
+            if self._built and state == self._state and not reconcile:
+                return
+            if not self._built or state[1] != self._state[1] or self._high_water is None:
+                self.clear()
+                self._load(self._queryset(), bulk=True)
+                self._built = True
+                changed = None
+            else:
+                changed = set()
+                if state != self._state:
+                    changed = self._load(
+                        self._queryset().filter(updated_at__gte=self._high_water - REFRESH_OVERLAP)
+                    )
+                if reconcile:
+                    changed |= self._reconcile()
+            if reconcile or changed is None:
+                self._reconcile_due = now + getattr(settings, 'CATALOG_RECONCILE_SECONDS', 60)
+            self._state = state
+            for callback in self._subscribers:
+                callback(changed)
+
+    # --- Suche ------------------------------------------------------------
+
+    @staticmethod
+    def _scan(lists, match, limit, hits):
+        """Läuft die kürzeste Posting-Liste in Rang-Reihenfolge ab, bis `limit` Treffer passen."""
+        if not lists or not all(lists):
+            return
+        for rank in min(lists, key=len):
+            pid = rank[-1]
+            if pid not in hits and match(pid):
+                hits.append(pid)
+                if len(hits) >= limit:
+                    return
+
+    def search(self, query, limit=10):
+        """
+        Reihenfolge: exakte EAN/SKU, dann Artikel, die alle Suchwörter als ganze
+        Wörter enthalten, dann als Wortanfang, zuletzt Teilstring (icontains).
+        Innerhalb einer Stufe: kürzere Namen zuerst, dann alphabetisch.
+        """
+        self.refresh()
+        query = (query or '').strip()
+        with self._lock:
+            hits = []
+            for pid in (self.by_ean.get(query), self.by_sku.get(query.casefold())):
+                if pid is not None and pid not in hits:
+                    hits.append(pid)
+
+            q_tokens = sorted(set(tokens(query)))
+            if q_tokens and len(hits) < limit:
+                self._scan(
+                    [self._exact.get(q) for q in q_tokens],
+                    lambda pid: all(q in self._tokens[pid] for q in q_tokens),
+                    limit, hits,
+                )
+            if q_tokens and len(hits) < limit:
+                self._scan(
+                    [self._prefix.get(q[:PREFIX_MAX]) for q in q_tokens],
+                    lambda pid: all(any(t.startswith(q) for t in self._tokens[pid]) for q in q_tokens),
+                    limit, hits,
+                )
+            needle = ' '.join(tokens(query))
+            if not hits and len(needle) >= 3:
+                grams = sorted((self._trigrams.get(g, ()) for g in trigrams(needle)), key=len)
+                found = set(grams[0]).intersection(*grams[1:]) if grams else ()
+                hits = sorted(
+                    (pid for pid in found if needle in self._haystack[pid]),
+                    key=self._rank.__getitem__,
+                )
+            return [self.payloads[pid] for pid in hits[:limit]]
+
+
+    # --- Kassen-Snapshot ---------------------------------------------------
+
+    SNAPSHOT_FIELDS = ('id', 'ean', 'sku', 'name', 'price', 'vat_rate', 'track_stock', 'stock')
+
+    def snapshot(self, since=None):
+        """
+        Kompakter Katalog für den Offline-Cache der Kasse. Enthält wie by_ean/
+        by_sku auch inaktive Artikel (`active`=False) — der Client findet sie
+        per Scan, aber nicht in der Textsuche. version = jüngstes updated_at
+        (ms). Mit `since` nur die seither geänderten Zeilen plus die Liste aller
+        IDs, damit der Client gelöschte Artikel verwerfen kann.
+        """
+        self.refresh()
+        with self._lock:
+            version = max(self._updated_ms.values(), default=0)
+            data = {'version': str(version), 'fields': list(self.SNAPSHOT_FIELDS) + ['active'], 'count': len(self._rank)}
+            if since is None:
+                pids = sorted(self.payloads)
+                data['full'] = True
+            else:
+                cutoff = since - int(REFRESH_OVERLAP.total_seconds() * 1000)
+                pids = sorted(pid for pid, ms in self._updated_ms.items() if ms >= cutoff)
+                data['full'] = False
+                data['ids'] = sorted(self.payloads)
+            data['rows'] = [
+                [self.payloads[pid][f] for f in self.SNAPSHOT_FIELDS] + [pid in self._rank]
+                for pid in pids
+            ]
+            return data
+
+    def etag(self, since=None):
+        self.refresh()
+        with self._lock:
+            version = max(self._updated_ms.values(), default=0)
+            # Anzahl Artikel im Tag: Löschungen ändern kein updated_at
+            return f'"catalog-{version}-{len(self.payloads)}-{len(self._rank)}-{since if since is not None else "full"}"'
+
+
+catalog_index = CatalogIndex()
+
+
+class ScanCache:
+    """
+    LRU EAN → fertig serialisiertes Kompakt-Payload für den Scanner-Fast-Path.
+    Wird über den Katalog-Index invalidiert (Artikel gespeichert, Bestand
+    gebucht — auch aus anderen Prozessen). Zähler pro Prozess.
+    """
+
+    def __init__(self, index, maxsize=None):
+        self._index = index
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ean → (id, bytes)
+        self.hits = self.misses = 0
+        index.subscribe(self._invalidate)
+
+    @property
+    def maxsize(self):
+        return self._maxsize or getattr(settings, 'SCAN_CACHE_SIZE', 2048)
+
+    def _invalidate(self, ids):
+        with self._lock:
+            if ids is None:
+                self._entries.clear()
+                return
+            for ean in [ean for ean, (pid, _) in self._entries.items() if pid in ids]:
+                del self._entries[ean]
+
+    def get(self, ean):
+        """JSON-Bytes für die EAN oder None, wenn unbekannt."""
+        self._index.refresh()
+        with self._lock:
+            entry = self._entries.get(ean)
+            if entry is not None:
+                self._entries.move_to_end(ean)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with self._index._lock:
+            pid = self._index.by_ean.get(ean)
+            full = self._index.payloads.get(pid)
+        if full is None:
+            return None
+        body = json.dumps({
+            key: full[key]
+            for key in ('id', 'name', 'ean', 'sku', 'price', 'vat_rate', 'stock', 'track_stock')
+        }).encode()
+        with self._lock:
+            self._entries[ean] = (pid, body)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return body
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+scan_cache = ScanCache(catalog_index)
+
+
+# --- Invalidierung --------------------------------------------------------
+
+def _product_saved(sender, instance, update_fields=None, **kwargs):
+    # save(update_fields=[…]) ohne updated_at lässt auto_now aus — nachziehen,
+    # sonst sieht das inkrementelle Nachladen die Änderung nicht.
+    if update_fields is not None and 'updated_at' not in update_fields:
+        from django.utils import timezone
+        sender.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    bump_catalog_version()
+
+
+def _catalog_reset(sender, **kwargs):
+    bump_catalog_version(full=True)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    from .models import Product, Supplier, Vat
+
+    post_save.connect(_product_saved, sender=Product, dispatch_uid='core.search.product_saved')
+    post_delete.connect(_catalog_reset, sender=Product, dispatch_uid='core.search.product_deleted')
+    for model in (Vat, Supplier):
+        post_save.connect(_catalog_reset, sender=model, dispatch_uid=f'core.search.{model.__name__}_saved')
+        post_delete.connect(_catalog_reset, sender=model, dispatch_uid=f'core.search.{model.__name__}_deleted')
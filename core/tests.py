@@ -1,13 +1,21 @@
-"""Tests for variant grouping: clone action + suggest_groups base name."""
+"""Tests for variant grouping (clone action, suggest_groups base name), the stock ledger and the search index/scan cache."""
+import json
+import time
+from datetime import timedelta
 from decimal import Decimal
+from unittest import mock
 
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
 from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import caches
 from django.test import RequestFactory, TestCase
+from django.utils import timezone
 
 from core.admin import ProductAdmin
 from core.management.commands.suggest_groups import base_name
-from core.models import Category, Product, Vat
+from core.models import Category, Product, StockMovement, Vat
+from core.search import catalog_index, scan_cache
 
 
 def _request():
@@ -85,3 +93,174 @@ class BaseNameTests(TestCase):
         self.assertNotIn("(", base)
         self.assertNotIn("17.02.01.09.1", base)
         self.assertIn("open toe", base.lower())
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.vat = Vat.objects.create(name="Normal", rate=Decimal("8.10"), is_default=True)
+        self.cat = Category.objects.create(name="Still-BHs")
+        self.product = Product.objects.create(
+            name="Still-BH", category=self.cat, sales_price=Decimal("49.90"), cost_price=Decimal("20.00"),
+            stock_quantity=10, vat=self.vat,
+        )
+
+    def test_stale_instances_do_not_lose_updates(self):
+        # Zwei Requests mit je eigener (veralteter) Instanz desselben Artikels.
+        a = Product.objects.get(pk=self.product.pk)
+        b = Product.objects.get(pk=self.product.pk)
+        a.adjust_stock(-2, StockMovement.Type.SALE)
+        m = b.adjust_stock(-3, StockMovement.Type.SALE)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 5)
+        # stock_after = tatsächlich committeter Bestand, nicht 10 - 3.
+        self.assertEqual(m.stock_after, 5)
+        self.assertEqual(b.stock_quantity, 5)
+
+    def test_adjust_stock_does_not_rewrite_other_columns(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(name="Still-BH Clara")
+        stale.adjust_stock(1, StockMovement.Type.CORRECTION)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Still-BH Clara")
+        self.assertEqual(self.product.stock_quantity, 11)
+
+    def test_moving_average_uses_current_stock_and_keeps_it(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.product.adjust_stock(-10, StockMovement.Type.SALE)  # Lager leer
+        stale.update_moving_average_price(5, Decimal("30.00"))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cost_price, Decimal("30.00"))
+        self.assertEqual(self.product.stock_quantity, 0)
+
+    def test_untracked_product_is_ignored(self):
+        self.product.track_stock = False
+        self.product.save()
+        self.assertIsNone(self.product.adjust_stock(-1, StockMovement.Type.SALE))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+
+    def test_bulk_adjust_stock_applies_all_lines(self):
+        other = Product.objects.create(
+            name="Stilleinlagen", category=self.cat, sales_price=Decimal("9.90"), cost_price=Decimal("4.00"),
+            stock_quantity=3, vat=self.vat,
+        )
+        movements = Product.objects.bulk_adjust_stock(
+            [(self.product.pk, -2), (other.pk, 4), (self.product.pk, -1)],
+            StockMovement.Type.SALE,
+        )
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 7)
+        self.assertEqual(other.stock_quantity, 7)
+        # stock_after wird pro Zeile fortgeschrieben.
+        self.assertEqual([m.stock_after for m in movements], [8, 7, 7])
+        self.assertEqual(StockMovement.objects.filter(product=self.product).count(), 2)
+
+    def test_bulk_adjust_stock_accepts_partial_line_shapes(self):
+        ref = self.cat  # any model instance works as reference
+        user = get_user_model().objects.create_user("lager")
+        movements = Product.objects.bulk_adjust_stock(
+            [(self.product.pk, 1), (self.product.pk, 1, ref), (self.product.pk, 1, ref, "Zeile", user)],
+            StockMovement.Type.PURCHASE, notes="Beleg",
+        )
+        self.assertEqual([m.object_id for m in movements], [None, ref.pk, ref.pk])
+        self.assertEqual([m.notes for m in movements], ["Beleg", "Beleg", "Zeile"])
+        self.assertEqual([m.user for m in movements], [None, None, user])
+
+    def test_bulk_adjust_stock_query_count_is_flat(self):
+        products = [
+            Product.objects.create(
+                name=f"Artikel {i}", category=self.cat, sales_price=Decimal("1"), cost_price=Decimal("1"),
+                stock_quantity=10, vat=self.vat,
+            )
+            for i in range(30)
+        ]
+        # Savepoint, Lock, UPDATE, INSERT, Release — egal ob 1 oder 30 Zeilen.
+        with self.assertNumQueries(5):
+            Product.objects.bulk_adjust_stock([(products[0].pk, -1)], StockMovement.Type.SALE)
+        with self.assertNumQueries(5):
+            Product.objects.bulk_adjust_stock([(p.pk, -1) for p in products], StockMovement.Type.SALE)
+
+
+class CatalogIndexTests(TestCase):
+    def setUp(self):
+        caches["catalog"].clear()
+        catalog_index.clear()
+        self.vat = Vat.objects.create(name="Normal", rate=Decimal("8.10"), is_default=True)
+        self.cat = Category.objects.create(name="Stützstrümpfe")
+        self.bh = self._product("Still-BH Größe", size="M", color="Weiß")
+        self.strumpf = self._product("Schenkelstrümpfe offene Zehen", size="L", color="schwarz")
+        self.old = self._product("Alter Still-BH", is_active=False)
+
+    def _product(self, name, **kwargs):
+        return Product.objects.create(
+            name=name, category=self.cat, vat=self.vat, stock_quantity=5,
+            sales_price=Decimal("39.90"), cost_price=Decimal("20.00"), **kwargs,
+        )
+
+    def _ids(self, query):
+        return [r["id"] for r in catalog_index.search(query)]
+
+    def test_folded_prefix_search_requires_all_terms(self):
+        self.assertEqual(self._ids("still gross"), [self.bh.id])
+        self.assertEqual(self._ids("STRÜMPFE"), [self.strumpf.id])
+        self.assertEqual(self._ids("weiss m"), [self.bh.id])
+        self.assertEqual(self._ids("schenkel l"), [self.strumpf.id])
+        self.assertEqual(self._ids("still zehen"), [])
+
+    def test_substring_fallback_and_exact_codes(self):
+        self.assertEqual(self._ids("kelstr"), [self.strumpf.id])
+        # Exakte EAN/SKU treffen auch inaktive Artikel (Inventur-Scan)
+        self.assertEqual(self._ids(self.old.ean), [self.old.id])
+        self.assertEqual(self._ids(self.bh.sku.lower())[0], self.bh.id)
+        self.assertNotIn(self.old.id, self._ids("still"))
+
+    def test_warm_search_hits_no_database(self):
+        catalog_index.search("still")
+        with self.assertNumQueries(0):
+            result = catalog_index.search("still")
+        self.assertEqual(result[0]["price"], 39.9)
+
+    def test_incremental_refresh_after_commit(self):
+        catalog_index.search("still")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bh.adjust_stock(-2, StockMovement.Type.SALE)
+            self.strumpf.name = "Kniestrümpfe"
+            self.strumpf.save()
+        self.assertEqual(catalog_index.search("still")[0]["stock"], 3)
+        self.assertEqual(self._ids("knie"), [self.strumpf.id])
+        self.assertEqual(self._ids("schenkel"), [])
+
+    def test_periodic_reconcile_picks_up_late_commit(self):
+        catalog_index.search("still")
+        # A transaction stamped updated_at long before it committed; meanwhile
+        # another commit moved the high-water mark past the refresh overlap.
+        stamped = timezone.now() - timedelta(minutes=1)
+        Product.objects.filter(pk=self.bh.pk).update(stock_quantity=1, updated_at=stamped)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.strumpf.save()
+        self.assertEqual(catalog_index.search("still")[0]["stock"], 5)
+
+        later = time.monotonic() + 61  # past CATALOG_RECONCILE_SECONDS
+        with mock.patch("core.search.time.monotonic", return_value=later):
+            self.assertEqual(catalog_index.search("still")[0]["stock"], 1)
+
+    def test_delete_triggers_rebuild(self):
+        catalog_index.search("still")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.strumpf.delete()
+        self.assertEqual(self._ids("strumpfe"), [])
+
+    def test_scan_cache_counts_hits_and_invalidates_on_stock_change(self):
+        scan_cache.reset()
+        self.assertIsNone(scan_cache.get("0000000000000"))
+        first = json.loads(scan_cache.get(self.bh.ean))
+        self.assertEqual((first["stock"], first["vat_rate"]), (5, 8.1))
+        scan_cache.get(self.bh.ean)
+        self.assertEqual(scan_cache.stats()["hits"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bh.adjust_stock(-1, StockMovement.Type.SALE)
+        self.assertEqual(json.loads(scan_cache.get(self.bh.ean))["stock"], 4)
+        stats = scan_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 3))
@@ -18,7 +18,7 @@ import json
 import statistics
 from .models import Product, Category, StockMovement
 from .forms import InventoryReportForm
-from commerce.models import Sale, SaleItem, PurchaseOrder
+from commerce.models import Sale, SalesFact, PurchaseOrder
 from commerce.utils import render_to_pdf 
 
 @staff_member_required
@@ -95,15 +95,12 @@ def dashboard_view(request):
         stats = {'mean': '–', 'median': '–', 'mode': '–', 'sum': '–'}
 
     # 2. Verkaufsumsatz CHF nach Produktkategorie (nur abgeschlossene Verkäufe)
-    revenue_expr = ExpressionWrapper(
-        F('quantity') * F('unit_price_gross'),
-        output_field=DecimalField(max_digits=14, decimal_places=2),
-    )
+    # Aus dem Reporting-Würfel: Zeilen pro Tag statt pro Verkaufsposition;
+    # Verkäufe plus (negative) Stornos = Umsatz der abgeschlossenen Verkäufe
     cat_rev_qs = (
-        SaleItem.objects
-        .filter(sale__status=Sale.Status.COMPLETED)
-        .values('product__category__name')
-        .annotate(revenue=Sum(revenue_expr))
+        SalesFact.objects
+        .values('category__name')
+        .annotate(revenue=Sum('gross'))
         .order_by('-revenue')
     )
     cat_labels = []
@@ -112,7 +109,7 @@ def dashboard_view(request):
         rev = float(entry['revenue'] or 0)
         if rev <= 0:
             continue
-        cat_labels.append(entry['product__category__name'] or 'Ohne Kategorie')
+        cat_labels.append(entry['category__name'] or 'Ohne Kategorie')
         cat_data.append(round(rev, 2))
 
     # 2b. Kassen-Verkäufe nach Wochentag & Uhrzeit (Heatmap)
@@ -250,7 +247,9 @@ def api_inventory_correct(request):
         if product_id is None or counted_qty is None:
             return JsonResponse({'error': 'Fehlende Daten'}, status=400)
 
-        product = Product.objects.get(pk=product_id)
+        # Zeile sperren: die Differenz muss gegen den aktuellen Bestand gerechnet
+        # werden, nicht gegen einen, den ein paralleler Verkauf gerade ändert.
+        product = Product.objects.select_for_update().get(pk=product_id)
         
         if not product.track_stock:
             return JsonResponse({'error': 'Für dieses Produkt wird kein Lager geführt.'}, status=400)
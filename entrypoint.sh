@@ -3,12 +3,28 @@
 # Stoppt das Skript bei Fehlern
 set -e
 
+# Mit Argumenten (docker-compose `command:`) läuft genau dieser Prozess,
+# z.B. der Job-Worker oder Uvicorn für die Event-Streams (:8001).
+# collectstatic/migrate macht nur der Web-Container.
+if [ "$#" -gt 0 ]; then
+    exec "$@"
+fi
+
 echo "Sammle statische Dateien..."
 python manage.py collectstatic --noinput --clear
 
 echo "Führe Datenbank-Migrationen aus..."
 python manage.py migrate
+python manage.py createcachetable
 
-echo "Starte Gunicorn Server..."
 # Wir binden an 0.0.0.0:8000 damit es von außen erreichbar ist
-exec gunicorn stock_keeper.wsgi:application --bind 0.0.0.0:8000 --workers 3
\ No newline at end of file
+# DJANGO_SERVER=asgi: Uvicorn mit stock_keeper.asgi — async Views (SumUp,
+# SMTP) warten im Event-Loop statt einen der Worker zu blockieren.
+if [ "${DJANGO_SERVER:-wsgi}" = "asgi" ]; then
+    echo "Starte Uvicorn (ASGI)..."
+    exec uvicorn stock_keeper.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers "${WEB_WORKERS:-3}" --proxy-headers --forwarded-allow-ips '*'
+fi
+
+echo "Starte Gunicorn Server..."
+exec gunicorn stock_keeper.wsgi:application --bind 0.0.0.0:8000 --workers "${WEB_WORKERS:-3}"
\ No newline at end of file
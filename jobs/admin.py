@@ -0,0 +1,33 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job, JobRun
+
+
+class JobRunInline(admin.TabularInline):
+    model = JobRun
+    extra = 0
+    can_delete = False
+    readonly_fields = ['attempt', 'worker', 'started_at', 'wait_ms', 'duration_ms', 'success', 'error']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'priority', 'attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['locked_by', 'locked_at', 'created_at', 'finished_at', 'last_error']
+    inlines = [JobRunInline]
+    actions = ['requeue']
+
+    @admin.action(description="Erneut einreihen (sofort)")
+    def requeue(self, request, queryset):
+        n = queryset.exclude(status=Job.Status.RUNNING).update(
+            status=Job.Status.QUEUED, run_after=timezone.now(), attempts=0, finished_at=None,
+        )
+        self.message_user(request, f"{n} Job(s) neu eingereiht.")
+
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ['job', 'attempt', 'worker', 'started_at', 'wait_ms', 'duration_ms', 'success']
+    list_filter = ['success', 'job__name']
@@ -0,0 +1,69 @@
+"""
+Arbeitet die Job-Queue ab (eigener Container/Prozess neben Gunicorn).
+
+Claimt fällige Jobs per SELECT … FOR UPDATE SKIP LOCKED und führt sie in einem
+Thread-Pool aus (I/O-lastig: SMTP, SumUp, IMAP, PDF). Mehrere Worker-Prozesse
+dürfen parallel laufen. SIGTERM/SIGINT lässt laufende Jobs fertig werden.
+
+    python manage.py run_worker --threads 4
+    python manage.py run_worker --once      # Queue einmal leeren, dann beenden
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from jobs.queue import claim_jobs, execute
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Startet einen Worker für die Hintergrund-Job-Queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Parallele Jobs pro Prozess. Default: 4.')
+        parser.add_argument('--poll', type=float, default=1.0, help='Sekunden zwischen Polls bei leerer Queue. Default: 1.')
+        parser.add_argument('--once', action='store_true', help='Nur fällige Jobs abarbeiten, dann beenden.')
+
+    def handle(self, *args, **opts):
+        threads = max(1, opts['threads'])
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        stop = threading.Event()
+        slots = threading.Semaphore(threads)
+
+        def _shutdown(signum, frame):
+            self.stdout.write("Beende nach laufenden Jobs …")
+            stop.set()
+
+        signal.signal(signal.SIGTERM, _shutdown)
+        signal.signal(signal.SIGINT, _shutdown)
+
+        def run(job):
+            try:
+                execute(job, worker=worker)
+            except Exception:
+                logger.exception("jobs.worker_error job=%s", job.pk)
+            finally:
+                connections.close_all()
+                slots.release()
+
+        self.stdout.write(f"Worker {worker} gestartet ({threads} Threads)")
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') as pool:
+            while not stop.is_set():
+                slots.acquire()
+                close_old_connections()
+                jobs = claim_jobs(worker, limit=1)
+                if not jobs:
+                    slots.release()
+                    if opts['once']:
+                        break
+                    stop.wait(opts['poll'])
+                    continue
+                pool.submit(run, jobs[0])
+        self.stdout.write(f"Worker {worker} beendet")
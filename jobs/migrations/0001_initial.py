@@ -0,0 +1,59 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100, verbose_name='Task')),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('priority', models.SmallIntegerField(choices=[(-10, 'Tief'), (0, 'Normal'), (10, 'Hoch')], default=0)),
+                ('status', models.CharField(choices=[('QUEUED', 'Wartend'), ('RUNNING', 'Läuft'), ('DONE', 'Erledigt'), ('FAILED', 'Fehlgeschlagen')], default='QUEUED', max_length=10)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Frühestens ausführen ab')),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5)),
+                ('last_error', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Job',
+                'verbose_name_plural': 'Jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='jobs_job_claim_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.PositiveSmallIntegerField()),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('wait_ms', models.PositiveIntegerField(verbose_name='Wartezeit (ms)')),
+                ('duration_ms', models.PositiveIntegerField(verbose_name='Laufzeit (ms)')),
+                ('success', models.BooleanField()),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='jobs.job')),
+            ],
+            options={
+                'verbose_name': 'Job-Ausführung',
+                'verbose_name_plural': 'Job-Ausführungen',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
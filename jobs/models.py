@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    Ein Eintrag in der Hintergrund-Queue. Langsame Arbeit (PDF-Rendering,
+    SMTP, SumUp-API, IMAP-Polling) wird hier abgelegt und von
+    `manage.py run_worker` abgearbeitet, statt einen Gunicorn-Worker zu blockieren.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', 'Wartend'
+        RUNNING = 'RUNNING', 'Läuft'
+        DONE = 'DONE', 'Erledigt'
+        FAILED = 'FAILED', 'Fehlgeschlagen'  # alle Versuche aufgebraucht
+
+    class Priority(models.IntegerChoices):
+        LOW = -10, 'Tief'
+        NORMAL = 0, 'Normal'
+        HIGH = 10, 'Hoch'  # z.B. Rechnungsversand aus dem Checkout
+
+    name = models.CharField(max_length=100, db_index=True, verbose_name="Task")
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(choices=Priority.choices, default=Priority.NORMAL)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Frühestens ausführen ab")
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        indexes = [
+            # Claim-Query: WHERE status=… AND run_after<=now ORDER BY priority, run_after
+            models.Index(fields=['status', 'run_after'], name='jobs_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
+
+    def backoff_delay(self):
+        """Exponentieller Backoff nach dem n-ten Fehlversuch: base · 2^(n-1), gedeckelt."""
+        base = getattr(settings, 'JOBS_BACKOFF_BASE_SECONDS', 30)
+        cap = getattr(settings, 'JOBS_BACKOFF_MAX_SECONDS', 3600)
+        return timedelta(seconds=min(cap, base * 2 ** max(0, self.attempts - 1)))
+
+
+class JobRun(models.Model):
+    """Timing-Protokoll pro Ausführungsversuch (Wartezeit in der Queue + Laufzeit)."""
+    job = models.ForeignKey(Job, related_name='runs', on_delete=models.CASCADE)
+    attempt = models.PositiveSmallIntegerField()
+    worker = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField()
+    wait_ms = models.PositiveIntegerField(verbose_name="Wartezeit (ms)")
+    duration_ms = models.PositiveIntegerField(verbose_name="Laufzeit (ms)")
+    success = models.BooleanField()
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        verbose_name = "Job-Ausführung"
+        verbose_name_plural = "Job-Ausführungen"
+
+    def __str__(self):
+        return f"{self.job.name} #{self.job_id} Versuch {self.attempt}: {self.duration_ms} ms"
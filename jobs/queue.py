@@ -0,0 +1,223 @@
+"""
+Task-Registry, Enqueue und Claim/Ausführung für die DB-Queue.
+
+    # commerce/tasks.py
+    @task('commerce.send_invoice', priority=Job.Priority.HIGH)
+    def send_invoice(sale_id): ...
+
+    # irgendwo im Request
+    enqueue('commerce.send_invoice', sale_id=sale.id)
+
+Payloads sind JSON (IDs statt Model-Instanzen). Der Worker claimt Jobs mit
+SELECT … FOR UPDATE SKIP LOCKED, mehrere Worker-Prozesse können also parallel
+laufen, ohne sich gegenseitig zu blockieren oder einen Job doppelt zu ziehen.
+
+Ein Claim ist ein Lease: Während der Job läuft, erneuert ein Heartbeat-Thread
+locked_at alle JOBS_HEARTBEAT_SECONDS. Erst wenn das länger als
+JOBS_LOCK_TIMEOUT ausbleibt (Worker abgestürzt), wird der Job neu geclaimt —
+lange Jobs wie der initiale SumUp-Sync laufen also nicht doppelt.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job, JobRun
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class UnknownTask(LookupError):
+    pass
+
+
+def task(name, priority=Job.Priority.NORMAL, max_attempts=5):
+    """Registriert eine Funktion als Task. Defaults gelten für enqueue()."""
+    def decorator(fn):
+        fn.task_name = name
+        fn.task_defaults = {'priority': priority, 'max_attempts': max_attempts}
+        _registry[name] = fn
+        return fn
+    return decorator
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(name) from None
+
+
+def enqueue(name, *, priority=None, run_after=None, max_attempts=None, **payload):
+    """
+    Legt einen Job an. Läuft im aktuellen Transaktionskontext — innerhalb von
+    transaction.atomic wird der Job nur sichtbar, wenn die Transaktion committet.
+    """
+    defaults = get_task(name).task_defaults
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        priority=defaults['priority'] if priority is None else priority,
+        max_attempts=defaults['max_attempts'] if max_attempts is None else max_attempts,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def _lock_timeout():
+    return timedelta(seconds=getattr(settings, 'JOBS_LOCK_TIMEOUT_SECONDS', 900))
+
+
+def _heartbeat_interval():
+    return getattr(settings, 'JOBS_HEARTBEAT_SECONDS', 60)
+
+
+def claim_jobs(worker, limit=1, job_ids=None):
+    """
+    Zieht bis zu `limit` fällige Jobs und markiert sie als RUNNING.
+    Jobs, deren Worker abgestürzt ist (kein Heartbeat seit JOBS_LOCK_TIMEOUT),
+    werden wieder mitgenommen — ausser ihre Versuche sind aufgebraucht, dann
+    werden sie FAILED. `job_ids` schränkt auf bestimmte Jobs ein.
+    """
+    now = timezone.now()
+    due = (
+        Q(status=Job.Status.QUEUED, run_after__lte=now)
+        | Q(status=Job.Status.RUNNING, locked_at__lt=now - _lock_timeout())
+    )
+    with transaction.atomic():
+        qs = Job.objects.select_for_update(skip_locked=True).filter(due)
+        if job_ids is not None:
+            qs = qs.filter(pk__in=job_ids)
+        jobs = list(qs.order_by('-priority', 'run_after', 'pk')[:limit])
+        # Abgelaufener Lease ohne Versuche übrig: nicht noch einmal starten
+        exhausted = {j.pk for j in jobs if j.status == Job.Status.RUNNING and j.attempts >= j.max_attempts}
+        if exhausted:
+            Job.objects.filter(pk__in=exhausted).update(
+                status=Job.Status.FAILED, finished_at=now, locked_by='', locked_at=None,
+                last_error='Lease abgelaufen (Worker abgestürzt?), Versuche aufgebraucht',
+            )
+            for job in jobs:
+                if job.pk in exhausted:
+                    logger.error("jobs.failed job=%s name=%s attempts=%d lease expired (worker %s)",
+                                 job.pk, job.name, job.attempts, job.locked_by)
+            jobs = [j for j in jobs if j.pk not in exhausted]
+        if not jobs:
+            return []
+        Job.objects.filter(pk__in=[j.pk for j in jobs]).update(
+            status=Job.Status.RUNNING, locked_by=worker, locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+    for job in jobs:
+        job.status, job.locked_by, job.locked_at = Job.Status.RUNNING, worker, now
+        job.attempts += 1
+    return jobs
+
+
+def renew_lease(job):
+    """Setzt locked_at neu, solange der Job noch diesem Claim gehört. False = Lease verloren."""
+    now = timezone.now()
+    renewed = Job.objects.filter(
+        pk=job.pk, status=Job.Status.RUNNING, locked_by=job.locked_by,
+    ).update(locked_at=now)
+    if renewed:
+        job.locked_at = now
+    return bool(renewed)
+
+
+def _heartbeat(job, stop):
+    try:
+        while not stop.wait(_heartbeat_interval()):
+            if not renew_lease(job):
+                logger.warning("jobs.lease_lost job=%s name=%s worker=%s", job.pk, job.name, job.locked_by)
+                return
+    except Exception:
+        logger.exception("jobs.heartbeat_failed job=%s", job.pk)
+    finally:
+        connections.close_all()  # nur die Verbindungen dieses Threads
+
+
+def execute(job, worker=''):
+    """Führt einen geclaimten Job aus, protokolliert das Timing und plant bei Fehler neu ein."""
+    started_at = timezone.now()
+    wait_ms = max(0, int((started_at - job.run_after).total_seconds() * 1000))
+    t0 = time.perf_counter()
+    error = ''
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), name=f'job-{job.pk}-lease', daemon=True)
+    heartbeat.start()
+    try:
+        get_task(job.name)(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        stop.set()
+        heartbeat.join()
+    duration_ms = int((time.perf_counter() - t0) * 1000)
+
+    if not error:
+        job.status = Job.Status.DONE
+        job.finished_at = timezone.now()
+        job.last_error = ''
+        logger.info("jobs.done job=%s name=%s wait=%dms run=%dms", job.pk, job.name, wait_ms, duration_ms)
+    elif job.attempts >= job.max_attempts:
+        job.status = Job.Status.FAILED
+        job.finished_at = timezone.now()
+        job.last_error = error
+        logger.error("jobs.failed job=%s name=%s attempts=%d\n%s", job.pk, job.name, job.attempts, error)
+    else:
+        job.status = Job.Status.QUEUED
+        job.run_after = timezone.now() + job.backoff_delay()
+        job.last_error = error
+        logger.warning("jobs.retry job=%s name=%s attempt=%d next=%s",
+                       job.pk, job.name, job.attempts, job.run_after.isoformat())
+    # Nur schreiben, solange der Claim noch uns gehört: hat der Heartbeat die
+    # Lease verloren und ein anderer Worker den Job übernommen, gehört er ihm.
+    owner = job.locked_by
+    job.locked_by, job.locked_at = '', None
+    written = Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, locked_by=owner).update(
+        status=job.status, run_after=job.run_after, finished_at=job.finished_at,
+        last_error=job.last_error, locked_by='', locked_at=None,
+    )
+    if not written:
+        logger.warning("jobs.result_dropped job=%s name=%s worker=%s (Lease verloren, neu geclaimt)",
+                       job.pk, job.name, owner)
+
+    JobRun.objects.create(
+        job=job, attempt=job.attempts, worker=worker, started_at=started_at,
+        wait_ms=wait_ms, duration_ms=duration_ms, success=not error, error=error,
+    )
+    return not error
+
+
+def dispatch_on_commit(job):
+    """
+    Outbox-Dispatch: startet den Job direkt nach dem Commit in einem
+    Hintergrund-Thread dieses Prozesses, statt auf den nächsten Worker-Poll zu
+    warten. Der Request wartet nicht darauf. Claimt der Worker den Job zuerst
+    (oder stirbt der Prozess), bleibt es beim normalen Queue-Weg.
+    """
+    if not getattr(settings, 'JOBS_DISPATCH_ON_COMMIT', True):
+        return
+    transaction.on_commit(lambda: threading.Thread(
+        target=_run_inline, args=(job.pk,), name=f'job-{job.pk}', daemon=True,
+    ).start())
+
+
+def _run_inline(job_id):
+    worker = f"{socket.gethostname()}:{os.getpid()}:inline"
+    try:
+        for job in claim_jobs(worker, job_ids=[job_id]):
+            execute(job, worker=worker)
+    except Exception:
+        logger.exception("jobs.inline_dispatch_failed job=%s", job_id)
+    finally:
+        connections.close_all()
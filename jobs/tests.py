@@ -0,0 +1,131 @@
+"""Tests for the DB-backed job queue (enqueue, claim, retry with backoff, timing records)."""
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job, JobRun
+from .queue import claim_jobs, enqueue, execute, renew_lease, task
+
+calls = []
+
+
+@task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task('tests.boom', max_attempts=2)
+def boom():
+    raise RuntimeError('kaputt')
+
+
+beats = []
+
+
+@task('tests.slow')
+def slow():
+    # locked_at as seen by the task while the heartbeat runs next to it
+    time.sleep(0.2)
+    beats.append(Job.objects.filter(name='tests.slow').values_list('locked_at', flat=True).get())
+
+
+@override_settings(JOBS_BACKOFF_BASE_SECONDS=10, JOBS_BACKOFF_MAX_SECONDS=60)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_orders_by_priority_and_skips_future_jobs(self):
+        low = enqueue('tests.record', value='low', priority=Job.Priority.LOW)
+        high = enqueue('tests.record', value='high', priority=Job.Priority.HIGH)
+        enqueue('tests.record', value='later', run_after=timezone.now() + timedelta(hours=1))
+
+        claimed = claim_jobs('w1', limit=5)
+        self.assertEqual([j.pk for j in claimed], [high.pk, low.pk])
+        self.assertEqual(claim_jobs('w2', limit=5), [])
+        high.refresh_from_db()
+        self.assertEqual((high.status, high.attempts, high.locked_by), (Job.Status.RUNNING, 1, 'w1'))
+
+    def test_execute_records_timing_and_marks_done(self):
+        job = enqueue('tests.record', value=42)
+        self.assertTrue(execute(claim_jobs('w')[0], worker='w'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(calls, [42])
+        run = JobRun.objects.get(job=job)
+        self.assertTrue(run.success)
+        self.assertEqual(run.attempt, 1)
+
+    def test_failure_backs_off_then_gives_up(self):
+        job = enqueue('tests.boom')
+        before = timezone.now()
+        self.assertFalse(execute(claim_jobs('w')[0]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=10))
+        self.assertIn('kaputt', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        execute(claim_jobs('w')[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.runs.filter(success=False).count(), 2)
+
+    def test_stale_running_job_is_reclaimed(self):
+        job = enqueue('tests.record', value=1)
+        claim_jobs('dead-worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual([j.pk for j in claim_jobs('w')], [job.pk])
+
+    def test_heartbeat_keeps_lease_and_exhausted_jobs_fail_on_reclaim(self):
+        job = enqueue('tests.boom')  # max_attempts=2
+        (claimed,) = claim_jobs('w1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertTrue(renew_lease(claimed))
+        self.assertEqual(claim_jobs('w2'), [])
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        (reclaimed,) = claim_jobs('w2')
+        self.assertEqual(reclaimed.attempts, 2)
+        self.assertFalse(renew_lease(claimed))  # lease now belongs to w2
+
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_jobs('w3'), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+        self.assertIn('Lease', job.last_error)
+
+    def test_late_result_does_not_overwrite_new_owner(self):
+        job = enqueue('tests.record', value=7)
+        (claimed,) = claim_jobs('w1')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        claim_jobs('w2')
+
+        execute(claimed, worker='w1')  # w1 finishes after losing the lease
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.Status.RUNNING, 'w2'))
+        self.assertEqual(calls, [7])
+        self.assertEqual(JobRun.objects.filter(job=job, worker='w1').count(), 1)
+
+
+class RunWorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_run_worker_once_drains_queue(self):
+        for i in range(3):
+            enqueue('tests.record', value=i)
+        call_command('run_worker', once=True, threads=1, stdout=StringIO())
+        self.assertEqual(sorted(calls), [0, 1, 2])
+        self.assertFalse(Job.objects.exclude(status=Job.Status.DONE).exists())
+
+    @override_settings(JOBS_HEARTBEAT_SECONDS=0.05)
+    def test_execute_renews_lease_while_task_runs(self):
+        job = enqueue('tests.slow')
+        (claimed,) = claim_jobs('w')
+        started = claimed.locked_at
+        self.assertTrue(execute(claimed, worker='w'))
+        self.assertGreater(beats[-1], started)
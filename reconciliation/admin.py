@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import SumUpPayout, ReconciliationItem
+from .models import SumUpPayout, ReconciliationItem, SumUpTransaction, SumUpSyncState
 
 
 class ReconciliationItemInline(admin.TabularInline):
@@ -23,3 +23,24 @@ class SumUpPayoutAdmin(admin.ModelAdmin):
 class ReconciliationItemAdmin(admin.ModelAdmin):
     list_display = ['payout', 'match_status', 'sk_amount', 'sumup_amount', 'channel', 'resolution']
     list_filter = ['match_status', 'channel', 'resolution']
+
+
+@admin.register(SumUpTransaction)
+class SumUpTransactionAdmin(admin.ModelAdmin):
+    list_display = ['timestamp', 'transaction_code', 'type', 'status', 'amount', 'refunded_amount', 'description']
+    list_filter = ['type', 'status']
+    search_fields = ['transaction_code', 'sumup_id', 'description']
+    date_hierarchy = 'timestamp'
+    readonly_fields = [f.name for f in SumUpTransaction._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SumUpSyncState)
+class SumUpSyncStateAdmin(admin.ModelAdmin):
+    list_display = ['synced_until', 'last_run_at', 'last_fetched']
+    readonly_fields = ['synced_until', 'last_run_at', 'last_fetched']
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,166 @@
+"""
+Circuit Breaker und Latenz-Statistik für die SumUp-API.
+
+Ist api.sumup.com langsam oder down, warten sonst Kasse, Cron-Commands und
+Abgleich jeder für sich bis zum Timeout und binden Worker. Der Breaker hält
+seinen Zustand im gemeinsamen Cache (CACHES['default']), damit alle Prozesse
+— Gunicorn/Uvicorn-Worker, Job-Worker, Commands — denselben sehen:
+
+  closed     normaler Betrieb; Fehler werden gezählt, ein Erfolg setzt zurück
+  open       nach SUMUP_BREAKER_THRESHOLD Fehlern in Folge: jeder Call
+             scheitert sofort mit SumUpUnavailable, SUMUP_BREAKER_RESET_SECONDS lang
+  half_open  danach darf genau ein Probe-Call durch; Erfolg schliesst,
+             Fehler öffnet erneut
+
+Als Fehler zählen Timeouts, Verbindungsfehler, 429/5xx und kaputtes JSON —
+nicht 4xx wie ein unbekannter transaction_code.
+
+Fehler werden über cache.add gezählt: der n-te Fehler belegt den Slot
+`failure:n` (add ist im Datenbank-Cache atomar) — zwei Prozesse können
+denselben Fehler nicht doppelt oder gar nicht zählen, anders als bei get/set.
+
+Jeder Call landet mit seiner Dauer in einer kurzen Liste pro Endpunkt
+(letzte LATENCY_SAMPLES); daraus rechnet die Statusseite Perzentile.
+Diese Liste ist get/set — unter Last gehen einzelne Samples verloren, für
+Perzentile unerheblich.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY = 'reconciliation.sumup_breaker'
+LATENCY_KEY = 'reconciliation.sumup_latency'
+LATENCY_SAMPLES = 200
+ENDPOINTS = ('history', 'transaction', 'payouts')
+
+# Zustand überlebt den Reset deutlich, damit die Statusseite ihn noch zeigt
+_STATE_TTL = 24 * 3600
+
+
+def budget(endpoint: str) -> float:
+    """Latenzbudget (Read-Timeout pro Versuch) eines Endpunkts in Sekunden."""
+    budgets = getattr(settings, 'SUMUP_LATENCY_BUDGETS', {})
+    return budgets.get(endpoint, 15)
+
+
+def deadline(endpoint: str) -> float:
+    """Gesamtzeit eines Calls inkl. Wiederholungen und Backoff in Sekunden."""
+    deadlines = getattr(settings, 'SUMUP_CALL_DEADLINES', {})
+    return deadlines.get(endpoint, budget(endpoint) * 2)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.key = f"{KEY}:{name}"
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'SUMUP_BREAKER_THRESHOLD', 5)
+
+    @property
+    def reset_seconds(self):
+        return getattr(settings, 'SUMUP_BREAKER_RESET_SECONDS', 30)
+
+    def _keys(self):
+        return f"{self.key}:open_until", f"{self.key}:last_error"
+
+    def _failure_keys(self):
+        return [f"{self.key}:failure:{n}" for n in range(1, self.threshold + 1)]
+
+    def state(self) -> dict:
+        open_key, error_key = self._keys()
+        failure_keys = self._failure_keys()
+        values = cache.get_many([open_key, error_key, *failure_keys])
+        open_until = values.get(open_key)
+        if open_until is None:
+            state = 'closed'
+        elif time.time() < open_until:
+            state = 'open'
+        else:
+            state = 'half_open'
+        return {
+            'state': state,
+            'failures': sum(1 for key in failure_keys if key in values),
+            'open_until': open_until,
+            'last_error': values.get(error_key, ''),
+            'threshold': self.threshold,
+            'reset_seconds': self.reset_seconds,
+        }
+
+    def before_call(self):
+        """Wirft SumUpUnavailable, solange der Breaker offen ist (bzw. ein Probe läuft)."""
+        from .sumup_client import SumUpUnavailable
+
+        open_until = cache.get(f"{self.key}:open_until")
+        if open_until is None:
+            return
+        remaining = open_until - time.time()
+        # half_open: nur ein Prozess bekommt den Probe-Call (Sperre überdauert seine Deadline)
+        probe_ttl = max(deadline(e) for e in ENDPOINTS) + 5
+        if remaining <= 0 and cache.add(f"{self.key}:probe", 1, probe_ttl):
+            return
+        raise SumUpUnavailable(
+            f"SumUp ist gestört (Breaker offen, nächster Versuch in {max(int(remaining), 0) + 1} s)"
+        )
+
+    def record(self, endpoint: str, seconds: float, error: str | None = None):
+        """Latenz festhalten und Erfolg/Fehler zählen."""
+        self._sample(endpoint, seconds, error is None)
+        open_key, error_key = self._keys()
+        failure_keys = self._failure_keys()
+        if error is None:
+            if cache.get_many([failure_keys[0], open_key]):
+                cache.delete_many([*failure_keys, open_key, f"{self.key}:probe"])
+                logger.info("sumup_breaker.closed endpoint=%s", endpoint)
+            return
+
+        # Nächsten freien Slot belegen; sind alle belegt, ist die Schwelle erreicht
+        failures = next(
+            (n for n, key in enumerate(failure_keys, 1) if cache.add(key, 1, _STATE_TTL)),
+            self.threshold,
+        )
+        cache.set(error_key, f"{endpoint}: {error}"[:300], _STATE_TTL)
+        if failures >= self.threshold:
+            cache.set(open_key, time.time() + self.reset_seconds, _STATE_TTL)
+            cache.delete(f"{self.key}:probe")
+            logger.warning("sumup_breaker.open failures=%d endpoint=%s err=%s", failures, endpoint, error)
+
+    def _sample(self, endpoint, seconds, ok):
+        key = f"{LATENCY_KEY}:{endpoint}"
+        samples = cache.get(key) or []
+        samples.append((round(seconds * 1000), ok))
+        cache.set(key, samples[-LATENCY_SAMPLES:], _STATE_TTL)
+
+    def reset(self):
+        cache.delete_many([*self._keys(), *self._failure_keys(), f"{self.key}:probe"])
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct))] if values else None
+
+
+def latency_stats() -> list[dict]:
+    """Perzentile (ms) der letzten Calls pro Endpunkt, für die Statusseite."""
+    samples = cache.get_many([f"{LATENCY_KEY}:{e}" for e in ENDPOINTS])
+    rows = []
+    for endpoint in ENDPOINTS:
+        entries = samples.get(f"{LATENCY_KEY}:{endpoint}", [])
+        ms = sorted(m for m, _ok in entries)
+        rows.append({
+            'endpoint': endpoint,
+            'budget_ms': int(budget(endpoint) * 1000),
+            'count': len(ms),
+            'errors': sum(1 for _m, ok in entries if not ok),
+            'p50': _percentile(ms, 0.50),
+            'p95': _percentile(ms, 0.95),
+            'p99': _percentile(ms, 0.99),
+            'max': ms[-1] if ms else None,
+        })
+    return rows
+
+
+sumup_breaker = CircuitBreaker('sumup')
@@ -0,0 +1,91 @@
+"""
+Laufzeit-Benchmark für run_matching (Tier 2/3) mit synthetischen Daten.
+
+Erzeugt N SumUp-Transaktionen und M SK-Sales über einen Monat — viele
+wiederkehrende Café-Beträge, Sales leicht gegen die Zahlung versetzt, ein
+Anteil ohne Gegenstück — und misst die Zuordnung allein (assign_amount_time)
+sowie run_matching komplett inkl. DB-Laden. Alles in einer Transaktion, die
+zurückgerollt wird.
+
+    python manage.py bench_matching --transactions 10000 --sales 10000
+"""
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from commerce.models import Sale
+from reconciliation.matching import assign_amount_time, run_matching
+from reconciliation.models import SumUpPayout
+
+PRICES = ['4.50', '4.50', '4.50', '3.80', '3.80', '6.20', '12.90', '19.90', '34.90', '79.00']
+
+
+class Command(BaseCommand):
+    help = "Misst run_matching (Tier 2/3) auf synthetischen Transaktionen und Sales."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=10_000)
+        parser.add_argument('--sales', type=int, default=10_000)
+        parser.add_argument('--days', type=int, default=30, help='Länge der Periode. Default: 30.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **opts):
+        rng = random.Random(opts['seed'])
+        period_start = date(2025, 1, 1)
+        period_end = period_start + timedelta(days=opts['days'] - 1)
+        start = datetime.combine(period_start, datetime.min.time(), tzinfo=timezone.utc)
+        span = opts['days'] * 86400
+
+        txns = []
+        for n in range(opts['transactions']):
+            ts = start + timedelta(seconds=rng.uniform(0, span))
+            txns.append({
+                'id': f"bench-{n}",
+                'transaction_code': f"B{n:08d}",
+                'amount': float(Decimal(rng.choice(PRICES))),
+                'timestamp': ts.isoformat(),
+                'type': 'PAYMENT',
+            })
+
+        # Sales: zu den ersten 95% der Transaktionen ein versetzter Sale, Rest zufällig
+        sales = []
+        for txn in txns[:min(opts['sales'], int(len(txns) * 0.95))]:
+            ts = datetime.fromisoformat(txn['timestamp']) + timedelta(seconds=rng.gauss(0, 45))
+            sales.append((ts, Decimal(str(txn['amount']))))
+        while len(sales) < opts['sales']:
+            sales.append((start + timedelta(seconds=rng.uniform(0, span)), Decimal(rng.choice(PRICES))))
+
+        with transaction.atomic():
+            Sale.objects.bulk_create([
+                Sale(date=ts, total_amount_gross=amount, payment_method='SUMUP', status='COMPLETED')
+                for ts, amount in sales
+            ], batch_size=2000)
+            payout = SumUpPayout.objects.create(
+                bank_credit_amount=Decimal('0'), bank_credit_date=period_end,
+                period_start=period_start, period_end=period_end,
+            )
+            sk_sales = list(Sale.objects.filter(
+                payment_method='SUMUP', status='COMPLETED',
+                date__date__gte=period_start, date__date__lte=period_end,
+            ))
+
+            t0 = time.perf_counter()
+            assignment = assign_amount_time(txns, sk_sales)
+            t_assign = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            items = run_matching(payout, txns)
+            t_run = time.perf_counter() - t0
+            transaction.set_rollback(True)
+
+        tiers = {}
+        for item in items:
+            tiers[item.match_tier] = tiers.get(item.match_tier, 0) + 1
+        self.stdout.write(f"{len(txns)} Transaktionen × {len(sk_sales)} Sales, {opts['days']} Tage")
+        self.stdout.write(f"  assign_amount_time {t_assign * 1000:>8.0f} ms  {len(assignment)} Paare")
+        self.stdout.write(f"  run_matching       {t_run * 1000:>8.0f} ms  "
+                          + ", ".join(f"{k}={v}" for k, v in sorted(tiers.items())))
@@ -0,0 +1,137 @@
+"""
+Durchsatz-Benchmark der SumUp-Pipeline gegen den lokalen Stand-in — ohne Live-API.
+
+Startet reconciliation.standin im Prozess (oder nutzt --base-url) und misst:
+
+  1. sync      — Backfill des Transaktionsspiegels (SyncFacade, parallele Tages-Slices)
+  2. unmatched — check_unmatched_sumup --dry-run für einen Tag
+  3. refunds   — sync_sumup_refunds --dry-run (7 Tage)
+  4. payout    — fetch_payout_bundle + payout_transactions + run_matching für die
+                 letzte Auszahlung, gegen passend erzeugte SK-Sales
+
+Alles läuft in einer Transaktion, die am Ende zurückgerollt wird (ausser
+--keep): Spiegel, Sales und Abgleich hinterlassen nichts in der Datenbank.
+
+    python manage.py bench_sumup_pipeline --per-month 50000 --months 3
+"""
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from commerce.models import Sale
+from reconciliation.matching import run_matching
+from reconciliation.models import ReconciliationItem, SumUpPayout, SumUpTransaction
+from reconciliation.standin import Dataset, serve
+from reconciliation.sumup_async import SyncFacade, fetch_payout_bundle
+from reconciliation.sync import day_bounds, payout_transactions, sync_transactions
+
+
+class Command(BaseCommand):
+    help = "Misst Spiegel-Sync, Abgleiche und Payout-Matching gegen den SumUp-Stand-in."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-month', type=int, default=50_000, help='Zahlungen pro Monat. Default: 50000.')
+        parser.add_argument('--months', type=int, default=3, help='Monate bis heute. Default: 3.')
+        parser.add_argument('--sales-ratio', type=float, default=0.97,
+                            help='Anteil der Zahlungen mit SK-Sale (Rest → ONLY_SUMUP). Default: 0.97.')
+        parser.add_argument('--base-url', default=None,
+                            help='Externen Stand-in verwenden (z.B. http://127.0.0.1:8765) statt im Prozess zu starten.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Daten nicht zurückrollen.')
+
+    def handle(self, *args, **opts):
+        self.timings = []
+        # Auch bei --base-url lokal erzeugen (gleicher Seed) — für Gutschrift und Stichtag
+        dataset = self._lap('dataset', lambda: Dataset(opts['per_month'], opts['months'], seed=opts['seed']))
+        server = None
+        base_url = opts['base_url']
+        if not base_url:
+            server = serve(dataset, background=True)
+            base_url = f"http://127.0.0.1:{server.server_port}"
+        credits = dataset.payout_credits()
+        if not credits:
+            raise CommandError("Datensatz enthält keine Auszahlung — --months erhöhen.")
+        self.stdout.write(f"{len(dataset.transactions)} Transaktionen, Stand-in {base_url}")
+
+        # Der Stand-in drosselt nicht — Rate-Limit für den Lauf aufheben
+        overrides = dict(SUMUP_API_BASE=base_url, SUMUP_API_KEY='standin',
+                         SUMUP_RATE_PER_SECOND=10_000, SUMUP_RATE_BURST=10_000)
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                self._run(dataset, credits[-1], opts)
+                if not opts['keep']:
+                    transaction.set_rollback(True)
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write("")
+        for name, seconds, note in self.timings:
+            self.stdout.write(f"  {name:<10} {seconds * 1000:>10.0f} ms  {note}")
+
+    def _lap(self, name, fn, note=lambda result: ''):
+        t0 = time.perf_counter()
+        result = fn()
+        self.timings.append((name, time.perf_counter() - t0, note(result)))
+        return result
+
+    def _run(self, dataset, credit, opts):
+        first_day = datetime.fromisoformat(dataset.timestamps[0].replace('Z', '+00:00')).date()
+        self._lap(
+            'sync', lambda: sync_transactions(since=day_bounds(first_day, first_day)[0], client=SyncFacade()),
+            lambda n: f"{n} Transaktionen → {SumUpTransaction.objects.count()} im Spiegel",
+        )
+
+        check_day = (datetime.fromisoformat(dataset.timestamps[-1].replace('Z', '+00:00')) - timedelta(days=1)).date()
+        self._lap('unmatched', lambda: call_command(
+            'check_unmatched_sumup', date=check_day.isoformat(), dry_run=True, stdout=io.StringIO(),
+        ), lambda _: check_day.isoformat())
+        self._lap('refunds', lambda: call_command(
+            'sync_sumup_refunds', days=7, dry_run=True, stdout=io.StringIO(),
+        ))
+
+        credit_date, amount = credit
+        credit_date = datetime.strptime(credit_date, '%Y-%m-%d').date()
+        bundle = self._lap('bundle', lambda: fetch_payout_bundle(amount, credit_date),
+                           lambda b: f"{len(b.payouts)} Payouts, {len(b.transactions)} Transaktionen")
+        transactions, period_start, period_end = payout_transactions(bundle.payouts, prefetched=True)
+        created = self._lap('sales', lambda: self._create_sales(transactions, opts), lambda n: f"{n} SK-Sales")
+
+        payout = SumUpPayout.objects.create(
+            bank_credit_amount=amount, bank_credit_date=credit_date,
+            period_start=period_start, period_end=period_end,
+        )
+        items = self._lap('matching', lambda: run_matching(payout, transactions),
+                          lambda items: f"{len(items)} Zeilen, "
+                                        f"{sum(1 for i in items if i.match_status == 'MATCHED')} MATCHED")
+        self._lap('persist', lambda: ReconciliationItem.objects.bulk_create(items, batch_size=2000))
+        self._lap('rebuild', payout.rebuild_summary)
+        self._lap('summary', lambda: payout.booking_summary, lambda s: f"net_delta={s['net_delta']}")
+        return created
+
+    def _create_sales(self, transactions, opts):
+        """SK-Sales zu den Zahlungen: Zeit leicht versetzt, die Hälfte mit transaction_id."""
+        rng = random.Random(opts['seed'])
+        sales = []
+        for txn in transactions:
+            if txn.get('type') != 'PAYMENT' or rng.random() > opts['sales_ratio']:
+                continue
+            ts = datetime.fromisoformat(txn['timestamp'].replace('Z', '+00:00'))
+            sales.append(Sale(
+                date=ts + timedelta(seconds=rng.uniform(-60, 60)),
+                payment_method=Sale.PaymentMethod.SUMUP,
+                status=Sale.Status.COMPLETED,
+                channel=Sale.SalesChannel.POS,
+                total_amount_gross=Decimal(str(txn['amount'])),
+                transaction_id=txn['transaction_code'] if rng.random() < 0.5 else None,
+            ))
+        Sale.objects.bulk_create(sales, batch_size=2000)
+        return len(sales)
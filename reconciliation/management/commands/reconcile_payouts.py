@@ -0,0 +1,180 @@
+"""
+Batch-Abgleich aller SumUp-Auszahlungen eines Zeitraums.
+
+Für Nachträge (mehrere Monate ohne Abgleich) oder Re-Imports: Statt jede
+Bankgutschrift einzeln über die Admin-Maske zu starten, werden alle
+Payout-Daten in --from..--to entdeckt, Payouts und Historie in einem Zug
+parallel geladen (sumup_async.fetch_payout_range) und das Matching pro
+Auszahlung in einem Prozess-Pool gerechnet — es ist CPU-gebunden und pro
+Payout unabhängig. Geschrieben wird im Hauptprozess mit bulk_create.
+
+Bereits vorhandene Abgleiche (gleiches sumup_payout_id) werden übersprungen.
+Entwürfe zählen nicht dazu: Köpfe eines abgebrochenen Laufs (oder ohne
+ermittelbare Periode) werden beim nächsten Lauf wiederverwendet und neu gematcht.
+Als Bankgutschrift gilt der SumUp-Nettobetrag am Payout-Datum; weicht die
+tatsächliche Gutschrift ab, zeigt das der Review wie gewohnt.
+
+    python manage.py reconcile_payouts --from 2025-01-01 --to 2025-06-30
+    python manage.py reconcile_payouts --from 2025-01-01 --to 2025-06-30 --workers 1
+"""
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from reconciliation.matching import run_matching
+from reconciliation.models import ReconciliationItem, SumUpPayout
+from reconciliation.sumup_async import fetch_payout_range
+from reconciliation.sumup_client import SumUpAPIError, payout_fee_maps
+from reconciliation.sync import payout_transactions
+
+logger = logging.getLogger(__name__)
+
+
+def _match_payout(task):
+    """Worker: Matching für einen Payout, gibt die ungespeicherten Zeilen zurück."""
+    payout_pk, transactions, payout_fees, payout_settled = task
+    payout = SumUpPayout.objects.get(pk=payout_pk)
+    return payout_pk, run_matching(
+        payout, transactions, payout_fees=payout_fees, payout_settled=payout_settled,
+    )
+
+
+class Command(BaseCommand):
+    help = "Gleicht alle SumUp-Auszahlungen eines Zeitraums ab (paralleles Matching)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', required=True, help='Erstes Payout-Datum YYYY-MM-DD.')
+        parser.add_argument('--to', dest='date_to', required=True, help='Letztes Payout-Datum YYYY-MM-DD.')
+        parser.add_argument(
+            '--workers', type=int, default=min(os.cpu_count() or 1, 4),
+            help='Prozesse fürs Matching (1 = im Hauptprozess). Default: CPUs, höchstens 4.',
+        )
+
+    def handle(self, *args, **opts):
+        try:
+            date_from = date.fromisoformat(opts['date_from'])
+            date_to = date.fromisoformat(opts['date_to'])
+        except ValueError:
+            raise CommandError("Datum im Format YYYY-MM-DD angeben")
+        if date_from > date_to:
+            raise CommandError("--from liegt nach --to")
+        started = time.perf_counter()
+        timings = {}
+
+        # 1. Payouts + Historie parallel laden (landet im Spiegel)
+        t0 = time.perf_counter()
+        try:
+            bundle = fetch_payout_range(date_from, date_to)
+        except SumUpAPIError as e:
+            logger.error("reconcile_payouts: SumUp API Fehler: %s", e)
+            raise CommandError(f"SumUp API Fehler: {e}")
+        timings['fetch'] = time.perf_counter() - t0
+
+        by_date = defaultdict(list)
+        for p in bundle.payouts:
+            by_date[p['date']].append(p)
+        existing = set(
+            SumUpPayout.objects.filter(sumup_payout_id__in=list(by_date))
+            .exclude(status=SumUpPayout.Status.DRAFT)
+            .values_list('sumup_payout_id', flat=True)
+        )
+        for payout_date in sorted(existing):
+            self.stdout.write(f"  {payout_date}: bereits abgeglichen, übersprungen")
+        dates = sorted(set(by_date) - existing)
+        if not dates:
+            self.stdout.write(f"Keine neuen Auszahlungen zwischen {date_from} und {date_to}.")
+            return
+
+        # 2. Payout-Köpfe anlegen (DRAFT, bis die Zeilen geschrieben sind).
+        # Entwürfe eines früheren Laufs haben keine Zeilen (die entstehen nur
+        # zusammen mit IN_REVIEW) und werden aufgefrischt statt doppelt angelegt.
+        t0 = time.perf_counter()
+        stale = SumUpPayout.objects.filter(sumup_payout_id__in=dates, status=SumUpPayout.Status.DRAFT)
+        drafts = {p.sumup_payout_id: p for p in stale.order_by('pk')}
+        heads, reused, tasks = [], [], {}
+        for payout_date in dates:
+            sumup_payouts = by_date[payout_date]
+            transactions, period_start, period_end = payout_transactions(sumup_payouts, prefetched=True)
+            total_net = sum(Decimal(str(p.get('amount', 0))) for p in sumup_payouts)
+            total_fees = sum(Decimal(str(p.get('fee', 0))) for p in sumup_payouts)
+            head = drafts.get(payout_date) or SumUpPayout(
+                bank_credit_amount=total_net,
+                bank_credit_date=date.fromisoformat(payout_date),
+                sumup_payout_id=payout_date,
+                status=SumUpPayout.Status.DRAFT,
+            )
+            head.sumup_net_amount = total_net
+            head.sumup_fees_amount = total_fees
+            head.sumup_gross_amount = total_net + total_fees
+            head.period_start = period_start
+            head.period_end = period_end
+            (reused if head.pk else heads).append(head)
+            if period_start and period_end:
+                tasks[payout_date] = (transactions, *payout_fee_maps(sumup_payouts))
+        SumUpPayout.objects.bulk_update(reused, [
+            'sumup_net_amount', 'sumup_fees_amount', 'sumup_gross_amount', 'period_start', 'period_end',
+        ])
+        SumUpPayout.objects.bulk_create(heads)
+        # MySQL liefert bei bulk_create keine PKs zurück
+        pks = dict(
+            SumUpPayout.objects.filter(sumup_payout_id__in=dates, status=SumUpPayout.Status.DRAFT)
+            .order_by('pk').values_list('sumup_payout_id', 'pk')
+        )
+        payouts = {pks[d]: d for d in dates}
+        timings['prepare'] = time.perf_counter() - t0
+
+        # 3. Matching pro Payout, parallel in Prozessen
+        t0 = time.perf_counter()
+        work = [(pks[d], *tasks[d]) for d in dates if d in tasks]
+        results = self._run_pool(work, opts['workers'])
+        timings['match'] = time.perf_counter() - t0
+
+        # 4. Zeilen schreiben, Summen bilden, zur Prüfung freigeben
+        t0 = time.perf_counter()
+        items = [item for _pk, payout_items in results for item in payout_items]
+        matched_at = timezone.now()
+        with transaction.atomic():
+            ReconciliationItem.objects.bulk_create(items, batch_size=2000)
+            for payout in SumUpPayout.objects.filter(pk__in=[pk for pk, _items in results]):
+                payout.rebuild_summary()
+            SumUpPayout.objects.filter(pk__in=[pk for pk, _items in results]).update(
+                status=SumUpPayout.Status.IN_REVIEW, last_matched_at=matched_at,
+            )
+        timings['write'] = time.perf_counter() - t0
+
+        counts = {pk: (len(payout_items), sum(1 for i in payout_items if i.match_status == 'MATCHED'))
+                  for pk, payout_items in results}
+        for pk, payout_date in payouts.items():
+            if pk in counts:
+                total, matched = counts[pk]
+                self.stdout.write(f"  {payout_date}: {matched}/{total} gematched")
+            else:
+                self.stdout.write(self.style.WARNING(f"  {payout_date}: Periode nicht ermittelbar, bleibt Entwurf"))
+
+        elapsed = time.perf_counter() - started
+        n_txns = sum(len(t[1]) for t in work)
+        self.stdout.write(
+            f"{len(payouts)} Auszahlung(en), {n_txns} Transaktionen, {len(items)} Zeilen "
+            f"in {elapsed:.1f} s ({len(items) / elapsed:.0f} Zeilen/s, {opts['workers']} Worker)"
+        )
+        self.stdout.write("  " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in timings.items()))
+
+    def _run_pool(self, work, workers):
+        if workers <= 1 or len(work) <= 1:
+            return [_match_payout(task) for task in work]
+        # Offene Verbindungen nicht an die Kinder vererben — jeder Worker
+        # verbindet sich selbst, der Hauptprozess danach neu.
+        connections.close_all()
+        # fork: Worker erben die konfigurierte Django-Umgebung ohne erneutes setup()
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(workers, len(work)), mp_context=ctx) as pool:
+            return list(pool.map(_match_payout, work))
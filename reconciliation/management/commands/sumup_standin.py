@@ -0,0 +1,50 @@
+"""
+Startet den lokalen SumUp-API-Stand-in (reconciliation.standin).
+
+    python manage.py sumup_standin --port 8765 --per-month 50000 --months 3
+    SUMUP_API_BASE=http://127.0.0.1:8765 SUMUP_API_KEY=dummy python manage.py sync_sumup_transactions
+
+Läuft bis Ctrl-C. Der Datensatz ist deterministisch (--seed).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from reconciliation.standin import Dataset, serve
+
+
+class Command(BaseCommand):
+    help = "Lokaler SumUp-API-Stand-in mit synthetischen Transaktionen und Payouts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--per-month', type=int, default=50_000, help='Zahlungen pro Monat. Default: 50000.')
+        parser.add_argument('--months', type=int, default=3, help='Monate bis heute. Default: 3.')
+        parser.add_argument('--refund-rate', type=float, default=0.02, help='Anteil rückerstatteter Zahlungen. Default: 0.02.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--delay', type=float, default=0, help='Antwortzeit pro Request in Sekunden (langsame API). Default: 0.')
+        parser.add_argument('--verbose-log', action='store_true', help='Jeden Request loggen.')
+
+    def handle(self, *args, **opts):
+        t0 = time.perf_counter()
+        dataset = Dataset(
+            per_month=opts['per_month'], months=opts['months'],
+            refund_rate=opts['refund_rate'], seed=opts['seed'],
+        )
+        self.stdout.write(
+            f"{len(dataset.transactions)} Transaktionen, {len(dataset.payouts_by_date)} Auszahlungstage "
+            f"in {time.perf_counter() - t0:.1f}s erzeugt"
+        )
+        for credit_date, total in dataset.payout_credits():
+            self.stdout.write(f"  Auszahlung {credit_date}: CHF {total}")
+
+        server = serve(dataset, host=opts['host'], port=opts['port'], quiet=not opts['verbose_log'],
+                       delay=opts['delay'])
+        self.stdout.write(f"SumUp-Stand-in auf http://{opts['host']}:{server.server_port} (Ctrl-C beendet)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,51 @@
+"""
+Spiegelt die SumUp-Transaktionshistorie inkrementell in SumUpTransaction.
+
+Lädt ab der High-Water-Mark (minus SUMUP_SYNC_OVERLAP_DAYS Überlappung) bis
+jetzt. Danach lesen check_unmatched_sumup, sync_sumup_refunds, die
+POS-Verifizierung und die Reconciliation aus der lokalen Tabelle.
+
+    python manage.py sync_sumup_transactions                   # inkrementell
+    python manage.py sync_sumup_transactions --since 2025-01-01  # Backfill
+
+Cron (Host, vor den Abgleichen, täglich 06:45 CH-Zeit):
+  45 4,5 * * * /home/daniel/mileja/workbench/run_at_swiss_time.sh 06:45 \
+      docker exec stock_keeper_web python manage.py sync_sumup_transactions
+"""
+import logging
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reconciliation.models import SumUpSyncState
+from reconciliation.sumup_async import SyncFacade
+from reconciliation.sumup_client import SumUpAPIError
+from reconciliation.sync import day_bounds, sync_transactions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Lädt neue/geänderte SumUp-Transaktionen in den lokalen Spiegel."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=str, default=None,
+            help='Ab Tag YYYY-MM-DD neu laden (Backfill). Default: High-Water-Mark minus Überlappung.',
+        )
+
+    def handle(self, *args, **opts):
+        since = None
+        if opts['since']:
+            since = day_bounds(datetime.strptime(opts['since'], '%Y-%m-%d').date(), timezone.now().date())[0]
+
+        try:
+            # Tages-Slices eines Backfills laufen über den async Client parallel
+            fetched = sync_transactions(since=since, client=SyncFacade())
+        except SumUpAPIError as e:
+            logger.error("sync_sumup_transactions: SumUp API Fehler: %s", e)
+            raise CommandError(f"SumUp API Fehler: {e}")
+
+        state = SumUpSyncState.load()
+        self.stdout.write(f"{fetched} Transaktion(en) geladen, Spiegel vollständig bis {state.synced_until}")
@@ -8,6 +8,11 @@ Matching-Hierarchie (Tier 1 zuerst, dann Fallbacks):
   Tier 3 — AMOUNT_DATE: sumup.amount == sale.total_amount_gross UND gleicher Tag
   Tier 4 — NO_MATCH:    Keine Übereinstimmung → als Diskrepanz kennzeichnen
 
+Tier 2/3 ordnen global zu statt first-fit: Bei wiederkehrenden Beträgen (Café,
+CHF 4.50 den ganzen Tag) bekommt jede Transaktion den zeitlich nächsten Sale,
+ohne einer späteren Transaktion den besseren Treffer wegzunehmen. Siehe
+assign_amount_time().
+
 Hinweis: Aktuell übergibt die POS-Kasse keine Sale-ID an SumUp (nur Kauf-{timestamp}),
 daher funktioniert Tier 1 nicht für historische Daten. Matching läuft über Tier 2/3.
 
@@ -22,11 +27,17 @@ behandelt; sumup_amount bleibt der volle Transaktionsbetrag.
 """
 
 import logging
-from datetime import datetime, timedelta, timezone
-from decimal import Decimal
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
 
-from commerce.models import Sale
-from .models import ReconciliationItem, SumUpPayout
+from commerce.models import Sale, SaleItem
+from .models import ReconciliationItem, SumUpPayout, SumUpTransaction
 
 logger = logging.getLogger(__name__)
 
@@ -36,30 +47,45 @@ TIME_WINDOW_MINUTES = 2
 FEE_TOLERANCE_PCT = Decimal('3.0')
 
 
-def detect_channel(sale: Sale | None) -> str:
-    if sale is None:
+def _channel_for(categories: dict[str, int]) -> str:
+    """Kanal aus {Kategoriename: Anzahl Positionen}: Café, wenn > 50% Café-Positionen."""
+    total = sum(categories.values())
+    if not total:
         return ReconciliationItem.Channel.UNKNOWN
+    cafe_count = sum(
+        n for name, n in categories.items()
+        if any(kw in name.lower() for kw in CAFE_CATEGORY_KEYWORDS)
+    )
+    if cafe_count / total > 0.5:
+        return ReconciliationItem.Channel.CAFE
+    return ReconciliationItem.Channel.LADEN
 
-    try:
-        categories = [
-            item.product.category.name.lower()
-            for item in sale.items.select_related('product__category').all()
-            if item.product and item.product.category
-        ]
-    except Exception:
-        return ReconciliationItem.Channel.UNKNOWN
 
-    if not categories:
-        return ReconciliationItem.Channel.UNKNOWN
+def classify_channels(sales) -> dict[int, str]:
+    """
+    Kanal für viele Sales mit einer Abfrage: Positionen je (Sale, Kategorie)
+    in SQL gezählt, Keyword-Anteil in Python (Umlaute/Akzente unabhängig von
+    der DB-Collation). `sales`: QuerySet (wird Subquery) oder Sale-IDs.
 
-    cafe_count = sum(
-        1 for cat in categories
-        if any(kw in cat for kw in CAFE_CATEGORY_KEYWORDS)
+    Returns:
+        {sale_id: channel} — Sales ohne kategorisierte Positionen fehlen (→ UNKNOWN)
+    """
+    rows = (
+        SaleItem.objects.filter(sale__in=sales, product__category__isnull=False)
+        .values_list('sale_id', 'product__category__name')
+        .annotate(n=Count('id'))
+        .order_by()
     )
+    per_sale = defaultdict(dict)
+    for sale_id, name, n in rows:
+        per_sale[sale_id][name] = n
+    return {sale_id: _channel_for(categories) for sale_id, categories in per_sale.items()}
 
-    if cafe_count / len(categories) > 0.5:
-        return ReconciliationItem.Channel.CAFE
-    return ReconciliationItem.Channel.LADEN
+
+def detect_channel(sale: Sale | None) -> str:
+    if sale is None:
+        return ReconciliationItem.Channel.UNKNOWN
+    return classify_channels([sale.pk]).get(sale.pk, ReconciliationItem.Channel.UNKNOWN)
 
 
 def parse_sumup_timestamp(ts_str: str) -> datetime | None:
@@ -91,9 +117,150 @@ def compute_gap_pct(sk_amount: Decimal, sumup_amount: Decimal) -> Decimal:
     return abs((sk_amount - sumup_amount) / sk_amount * 100).quantize(Decimal('0.01'))
 
 
+def _cents(value) -> int:
+    return int((Decimal(str(value)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _within_minutes(sale_ts: list[float], ts: float) -> tuple[int, int]:
+    """Tier 2: Index-Bereich der Sales mit |Δt| ≤ TIME_WINDOW_MINUTES."""
+    window = TIME_WINDOW_MINUTES * 60
+    return bisect_left(sale_ts, ts - window), bisect_right(sale_ts, ts + window)
+
+
+def _same_day(sale_ts: list[float], ts: float) -> tuple[int, int]:
+    """Tier 3: Index-Bereich der Sales am gleichen Tag (UTC)."""
+    day_start = ts - ts % 86400
+    return bisect_left(sale_ts, day_start), bisect_left(sale_ts, day_start + 86400)
+
+
+def _line_assignment(txn_ts: list[float], sale_ts: list[float], window) -> list[tuple[int, int]]:
+    """
+    Optimale Zuordnung innerhalb eines Betrags-Buckets: möglichst viele Paare,
+    bei Gleichstand minimale Summe |Δt|.
+
+    Beide Listen sind nach Zeit sortiert. Zwei gekreuzte Paare lassen sich
+    immer entkreuzen, ohne das Zeitfenster zu verlassen oder die Summe zu
+    vergrössern — eine DP über die beiden Folgen findet also das Optimum.
+    Die Kandidatenbereiche aus `window` (bisect) sind monoton; Transaktionen
+    mit überlappenden Bereichen bilden einen Cluster, der einzeln gelöst wird.
+
+    Returns:
+        [(txn_index, sale_index)]
+    """
+    pairs = []
+    cluster = []
+    cluster_hi = 0
+    for k, ts in enumerate(txn_ts):
+        lo, hi = window(sale_ts, ts)
+        if lo >= hi:
+            continue
+        if cluster and lo >= cluster_hi:
+            pairs += _solve_cluster(cluster, txn_ts, sale_ts)
+            cluster = []
+        if not cluster:
+            cluster_hi = hi
+        cluster.append((k, lo, hi))
+        cluster_hi = max(cluster_hi, hi)
+    if cluster:
+        pairs += _solve_cluster(cluster, txn_ts, sale_ts)
+    return pairs
+
+
+def _solve_cluster(cluster, txn_ts, sale_ts):
+    base = cluster[0][1]
+    width = max(hi for _k, _lo, hi in cluster) - base
+    # Score (Anzahl Paare, −Summe |Δt|), grösser ist besser.
+    # choice: 0 = Transaktion auslassen, 1 = Sale auslassen, 2 = Paar
+    prev = [(0, 0.0)] * (width + 1)
+    choices = []
+    for k, lo, hi in cluster:
+        ts = txn_ts[k]
+        row = [prev[0]]
+        choice = bytearray(width + 1)
+        for j in range(1, width + 1):
+            best, c = prev[j], 0
+            if row[j - 1] > best:
+                best, c = row[j - 1], 1
+            if lo <= base + j - 1 < hi:
+                matches, score = prev[j - 1]
+                paired = (matches + 1, score - abs(ts - sale_ts[base + j - 1]))
+                if paired > best:
+                    best, c = paired, 2
+            row.append(best)
+            choice[j] = c
+        choices.append(choice)
+        prev = row
+
+    pairs = []
+    i, j = len(cluster), width
+    while i > 0 and j > 0:
+        c = choices[i - 1][j]
+        if c == 2:
+            pairs.append((cluster[i - 1][0], base + j - 1))
+            i, j = i - 1, j - 1
+        elif c == 1:
+            j -= 1
+        else:
+            i -= 1
+    return pairs
+
+
+def assign_amount_time(sumup_transactions: list[dict], sales: list[Sale]) -> dict[int, tuple[Sale, str]]:
+    """
+    Tier 2 + 3 für alle offenen Transaktionen und Sales auf einmal.
+
+    Sales werden nach Betrag in Rappen gebucketet und je Bucket nach Zeit
+    sortiert; die Kandidaten im Zeitfenster liefert bisect. Reihenfolge:
+    Tier 2 vor Tier 3, jeweils exakter Betrag vor ±AMOUNT_TOLERANCE.
+
+    Returns:
+        {Index in sumup_transactions: (sale, match_tier)}
+    """
+    txn_keys = []
+    for i, txn in enumerate(sumup_transactions):
+        ts = parse_sumup_timestamp(txn.get('timestamp'))
+        if ts:
+            txn_keys.append((_cents(txn.get('amount', 0)), ts.timestamp(), i))
+    sale_keys = [
+        (_cents(sale.total_amount_gross), sale.date.timestamp(), i)
+        for i, sale in enumerate(sales) if sale.date
+    ]
+
+    tolerance = _cents(AMOUNT_TOLERANCE)
+    offsets = [0] + [d for k in range(1, tolerance + 1) for d in (-k, k)]
+    assigned = {}
+    taken = set()
+    for tier, window in (
+        (ReconciliationItem.MatchTier.AMOUNT_TIME, _within_minutes),
+        (ReconciliationItem.MatchTier.AMOUNT_DATE, _same_day),
+    ):
+        for offset in offsets:
+            txn_buckets = defaultdict(list)
+            for cents, ts, i in txn_keys:
+                if i not in assigned:
+                    txn_buckets[cents].append((ts, i))
+            sale_buckets = defaultdict(list)
+            for cents, ts, i in sale_keys:
+                if i not in taken:
+                    sale_buckets[cents].append((ts, i))
+
+            for cents, bucket in txn_buckets.items():
+                candidates = sale_buckets.get(cents + offset)
+                if not candidates:
+                    continue
+                bucket.sort()
+                candidates.sort()
+                pairs = _line_assignment([ts for ts, _ in bucket], [ts for ts, _ in candidates], window)
+                for k, j in pairs:
+                    assigned[bucket[k][1]] = (sales[candidates[j][1]], tier)
+                    taken.add(candidates[j][1])
+    return assigned
+
+
 def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
                  payout_fees: dict[str, Decimal] = None,
-                 payout_settled: dict[str, Decimal] = None) -> list[ReconciliationItem]:
+                 payout_settled: dict[str, Decimal] = None,
+                 sales=None) -> list[ReconciliationItem]:
     """
     Hauptfunktion: Führt das Matching für einen Payout durch.
 
@@ -104,6 +271,8 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
         payout_settled: Mapping von transaction_code → tatsächlich abgerechneter
             Bruttobetrag (Payout-Netto + Gebühr). Fällt eine Teilrückerstattung an,
             ist dieser Wert kleiner als txn.amount.
+        sales: Einschränkung der Sales (QuerySet), z.B. für rematch_payout.
+            Default: alle SumUp-Sales der Periode.
     """
     if not payout.period_start or not payout.period_end:
         raise ValueError("Payout hat keine Periode — bitte zuerst Periode ermitteln")
@@ -112,14 +281,14 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
     payout_settled = payout_settled or {}
 
     # Stock Keeper Sales für den Zeitraum laden
-    sk_sales = list(
-        Sale.objects.filter(
-            payment_method='SUMUP',
-            status='COMPLETED',
-            date__date__gte=payout.period_start,
-            date__date__lte=payout.period_end,
-        ).prefetch_related('items__product__category')
+    sales_qs = (Sale.objects.all() if sales is None else sales).filter(
+        payment_method='SUMUP',
+        status='COMPLETED',
+        date__date__gte=payout.period_start,
+        date__date__lte=payout.period_end,
     )
+    sk_sales = list(sales_qs)
+    channels = classify_channels(sales_qs)
 
     logger.info(
         f"Matching: {len(sumup_transactions)} SumUp Txn vs. {len(sk_sales)} SK Sales "
@@ -167,7 +336,7 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
                 match_status=status,
                 gap_amount=gap,
                 gap_pct=gap_pct,
-                channel=detect_channel(sale),
+                channel=channels.get(sale.id, ReconciliationItem.Channel.UNKNOWN),
                 resolution=ReconciliationItem.Resolution.PENDING,
             )
             items.append(item)
@@ -178,38 +347,15 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
     unmatched_sales = [s for s in sk_sales if s.id not in matched_sale_ids]
     unmatched_txns = [t for t in sumup_transactions if t.get('transaction_code') not in matched_sumup_ids]
 
-    for txn in unmatched_txns:
+    assignment = assign_amount_time(unmatched_txns, unmatched_sales)
+
+    for i, txn in enumerate(unmatched_txns):
         tx_code = txn.get('transaction_code', '')
         sumup_amount = Decimal(str(txn.get('amount', 0)))
         refund_deduction = _refund_deduction(sumup_amount, tx_code, payout_settled)
         sumup_ts = parse_sumup_timestamp(txn.get('timestamp'))
         fee = payout_fees.get(tx_code, Decimal(0))
-        matched_sale = None
-        tier = None
-
-        for sale in unmatched_sales:
-            if sale.id in matched_sale_ids:
-                continue
-            sk_amount = Decimal(str(sale.total_amount_gross))
-            if abs(sk_amount - sumup_amount) > AMOUNT_TOLERANCE:
-                continue
-
-            # Tier 2: ±2 Minuten
-            if sumup_ts and sale.date:
-                try:
-                    delta = abs((sumup_ts - sale.date.astimezone(timezone.utc)).total_seconds())
-                    if delta <= TIME_WINDOW_MINUTES * 60:
-                        matched_sale = sale
-                        tier = ReconciliationItem.MatchTier.AMOUNT_TIME
-                        break
-                except Exception:
-                    pass
-
-            # Tier 3: Gleicher Tag
-            if sumup_ts and sale.date:
-                if sumup_ts.date() == sale.date.date():
-                    matched_sale = sale
-                    tier = ReconciliationItem.MatchTier.AMOUNT_DATE
+        matched_sale, tier = assignment.get(i, (None, None))
 
         if matched_sale:
             sk_amount = Decimal(str(matched_sale.total_amount_gross))
@@ -234,7 +380,7 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
                 match_status=status,
                 gap_amount=abs(sk_amount - sumup_amount),
                 gap_pct=gap_pct,
-                channel=detect_channel(matched_sale),
+                channel=channels.get(matched_sale.id, ReconciliationItem.Channel.UNKNOWN),
                 resolution=ReconciliationItem.Resolution.PENDING,
             )
             items.append(item)
@@ -273,7 +419,7 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
             match_status=ReconciliationItem.MatchStatus.ONLY_SK,
             gap_amount=sk_amount,
             gap_pct=Decimal('100'),
-            channel=detect_channel(sale),
+            channel=channels.get(sale.id, ReconciliationItem.Channel.UNKNOWN),
             resolution=ReconciliationItem.Resolution.PENDING,
         )
         items.append(item)
@@ -283,3 +429,86 @@ def run_matching(payout: SumUpPayout, sumup_transactions: list[dict],
         f"{sum(1 for i in items if i.match_status != 'MATCHED')} Diskrepanzen"
     )
     return items
+
+
+def _item_transaction(item: ReconciliationItem) -> dict:
+    """Minimales Transaktions-Dict aus einer Zeile (Fallback, wenn der Spiegel sie nicht kennt)."""
+    return {
+        'id': item.sumup_tx_id,
+        'transaction_code': item.sumup_tx_code,
+        'amount': str(item.sumup_amount),
+        'timestamp': item.sumup_timestamp.isoformat() if item.sumup_timestamp else None,
+        'client_transaction_id': item.sumup_foreign_tx_id,
+    }
+
+
+@transaction.atomic
+def rematch_payout(payout: SumUpPayout) -> dict:
+    """
+    Inkrementeller Neu-Abgleich ohne SumUp-API und ohne manuelle Auflösungen
+    zu verlieren.
+
+    Neu gematcht werden nur offene Zeilen (Resolution PENDING), und davon:
+      - alle Diskrepanzen (nicht MATCHED),
+      - MATCHED-Zeilen, deren Sale oder Transaktion sich seit last_matched_at
+        geändert hat (Sale.updated_at bzw. SumUpTransaction.synced_at).
+    Dazu kommen seither geänderte/neu erfasste Sales der Periode, die an keiner
+    verbleibenden Zeile hängen. Alle anderen Zeilen bleiben unverändert.
+
+    Returns:
+        {'reopened': n, 'matched_before': n, 'matched_after': n, 'sales_added': n}
+    """
+    started = timezone.now()
+    since = payout.last_matched_at
+    items = payout.items.select_for_update()
+
+    changed_sales = Sale.objects.all() if since is None else Sale.objects.filter(updated_at__gt=since)
+    open_items = items.filter(resolution=ReconciliationItem.Resolution.PENDING)
+    reopen = ~Q(match_status=ReconciliationItem.MatchStatus.MATCHED) | Q(sale__in=changed_sales)
+    if since is not None:
+        changed_txn_ids = SumUpTransaction.objects.filter(synced_at__gt=since).values('sumup_id')
+        reopen |= Q(sumup_tx_id__in=changed_txn_ids)
+    affected = list(open_items.filter(reopen))
+
+    kept_sale_ids = set(
+        items.exclude(pk__in=[i.pk for i in affected])
+        .filter(sale__isnull=False).values_list('sale_id', flat=True)
+    )
+    affected_sale_ids = {i.sale_id for i in affected if i.sale_id}
+    new_sale_ids = set(
+        changed_sales.filter(date__date__gte=payout.period_start, date__date__lte=payout.period_end)
+        .values_list('pk', flat=True)
+    ) - kept_sale_ids - affected_sale_ids
+    sale_pool = Sale.objects.filter(pk__in=(affected_sale_ids | new_sale_ids) - kept_sale_ids)
+
+    sumup_items = [i for i in affected if i.sumup_tx_id or i.sumup_tx_code]
+    mirrored = dict(
+        SumUpTransaction.objects.filter(sumup_id__in=[i.sumup_tx_id for i in sumup_items if i.sumup_tx_id])
+        .values_list('sumup_id', 'raw')
+    )
+    transactions = [mirrored.get(i.sumup_tx_id) or _item_transaction(i) for i in sumup_items]
+    # Gebühr und Refund-Abzug stammen aus dem Payout — von den alten Zeilen übernehmen
+    payout_fees = {i.sumup_tx_code: i.sumup_fee for i in sumup_items if i.sumup_fee is not None}
+    payout_settled = {
+        i.sumup_tx_code: i.sumup_amount - i.sumup_refund_deduction
+        for i in sumup_items if i.sumup_refund_deduction
+    }
+
+    new_items = run_matching(payout, transactions, payout_fees, payout_settled, sales=sale_pool)
+    ReconciliationItem.objects.filter(pk__in=[i.pk for i in affected]).delete()
+    ReconciliationItem.objects.bulk_create(new_items)
+    payout.rebuild_summary()
+    SumUpPayout.objects.filter(pk=payout.pk).update(last_matched_at=started)
+    payout.last_matched_at = started
+
+    def matched(rows):
+        return sum(1 for i in rows if i.match_status == ReconciliationItem.MatchStatus.MATCHED)
+
+    stats = {
+        'reopened': len(affected),
+        'matched_before': matched(affected),
+        'matched_after': matched(new_items),
+        'sales_added': len(new_sale_ids),
+    }
+    logger.info("Re-Match Payout %s: %s", payout.pk, stats)
+    return stats
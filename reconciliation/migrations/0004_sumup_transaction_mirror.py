@@ -0,0 +1,48 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reconciliation', '0003_reconciliationitem_sumup_refund_deduction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SumUpSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('synced_until', models.DateTimeField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_fetched', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'SumUp Sync-Status',
+                'verbose_name_plural': 'SumUp Sync-Status',
+            },
+        ),
+        migrations.CreateModel(
+            name='SumUpTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sumup_id', models.CharField(max_length=64, unique=True, verbose_name='SumUp ID')),
+                ('transaction_code', models.CharField(db_index=True, max_length=64)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('refunded_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(max_length=20)),
+                ('type', models.CharField(max_length=20)),
+                ('timestamp', models.DateTimeField()),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('raw', models.JSONField(default=dict)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'SumUp Transaktion',
+                'verbose_name_plural': 'SumUp Transaktionen',
+                'ordering': ['timestamp'],
+                'indexes': [models.Index(fields=['timestamp'], name='reconciliat_timesta_b1db9f_idx'), models.Index(fields=['type', 'status', 'timestamp'], name='reconciliat_type_944d2c_idx')],
+            },
+        ),
+    ]
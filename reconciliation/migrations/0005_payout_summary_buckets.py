@@ -0,0 +1,36 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reconciliation', '0004_sumup_transaction_mirror'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sumuppayout',
+            name='summary_built',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PayoutSummaryBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('match_status', models.CharField(max_length=20)),
+                ('channel', models.CharField(max_length=10)),
+                ('item_count', models.IntegerField(default=0)),
+                ('booked_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('sumup_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fees', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refund_deductions', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('payout', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summary_buckets', to='reconciliation.sumuppayout')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('payout', 'match_status', 'channel'), name='unique_payout_summary_bucket')],
+            },
+        ),
+    ]
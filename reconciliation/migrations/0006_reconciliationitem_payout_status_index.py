@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commerce', '0012_alter_sale_invoice_status'),
+        ('reconciliation', '0005_payout_summary_buckets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reconciliationitem',
+            index=models.Index(fields=['payout', 'match_status'], name='reconciliat_payout__1df64b_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reconciliation', '0006_reconciliationitem_payout_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sumuppayout',
+            name='last_matched_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from decimal import Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from commerce.models import Sale
 
@@ -47,6 +49,10 @@ class SumUpPayout(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Stand des letzten Matchings; rematch_payout() gleicht nur später Geändertes neu ab
+    last_matched_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Summen in PayoutSummaryBucket sind aufgebaut und werden inkrementell gepflegt
+    summary_built = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ['-bank_credit_date']
@@ -87,44 +93,48 @@ class SumUpPayout(models.Model):
         net_delta = (Laden + Café + Unbekannt − Gebühren − Refund-Abzüge) − Bankgutschrift.
         Ein Wert ≠ 0 bedeutet: der Abgleich geht nicht auf (z. B. nicht erfasste
         SumUp-Transaktion).
+
+        Liest nur die Summenzeilen (PayoutSummaryBucket), nicht die Items.
         """
-        items = list(self.items.all())
-
-        def booked_amount(i):
-            # Voller Transaktions-Bruttobetrag; Fallback auf SK-Betrag.
-            if i.sumup_amount is not None:
-                return i.sumup_amount
-            return i.sk_amount or Decimal('0')
-
-        booked = [i for i in items if i.match_status in ('MATCHED', 'GAP')]
-        laden = sum((booked_amount(i) for i in booked if i.channel == 'LADEN'), Decimal('0'))
-        cafe = sum((booked_amount(i) for i in booked if i.channel == 'CAFE'), Decimal('0'))
-        unknown = sum((booked_amount(i) for i in booked if i.channel == 'UNKNOWN'), Decimal('0'))
-        fees = sum((i.sumup_fee for i in items if i.sumup_fee), Decimal('0'))
-        refund_deductions = sum(
-            (i.sumup_refund_deduction for i in items if i.sumup_refund_deduction), Decimal('0')
-        )
+        if not self.summary_built:
+            self.rebuild_summary()
+        buckets = list(self.summary_buckets.all())
+
+        def total(field, status=None, channel=None):
+            return sum((
+                getattr(b, field) for b in buckets
+                if (status is None or b.match_status in status) and (channel is None or b.channel == channel)
+            ), Decimal('0'))
+
+        def count(status):
+            return sum(b.item_count for b in buckets if b.match_status == status)
+
+        booked = ('MATCHED', 'GAP')
+        laden = total('booked_amount', booked, 'LADEN')
+        cafe = total('booked_amount', booked, 'CAFE')
+        unknown = total('booked_amount', booked, 'UNKNOWN')
+        fees = total('fees')
+        refund_deductions = total('refund_deductions')
 
         computed_net = laden + cafe + unknown - fees - refund_deductions
         net_delta = None
         if self.bank_credit_amount is not None:
             net_delta = computed_net - self.bank_credit_amount
 
-        # Zeilen mit Refund-Abzug (nicht erstattete Gebühr einer Rückerstattung)
-        deduction_lines = [
-            i for i in items if i.sumup_refund_deduction and i.sumup_refund_deduction > Decimal('0')
-        ]
+        # Zeilen mit Refund-Abzug (nicht erstattete Gebühr einer Rückerstattung).
+        # Lazy — nur der PDF-Beleg listet sie auf.
+        deduction_lines = self.items.filter(sumup_refund_deduction__gt=0)
 
-        matched = [i for i in items if i.match_status == 'MATCHED']
-        gap = [i for i in items if i.match_status == 'GAP']
-        only_sumup = [i for i in items if i.match_status == 'ONLY_SUMUP']
-        only_sk = [i for i in items if i.match_status == 'ONLY_SK']
+        matched_count = count('MATCHED')
+        gap_count = count('GAP')
+        only_sumup_count = count('ONLY_SUMUP')
+        only_sk_count = count('ONLY_SK')
 
         # net_matches: das Nettototal deckt sich mit der Bankgutschrift.
         # is_balanced: zusätzlich keine offenen Positionen. Refund-Abzüge sind
         # erklärte Gebühren (eigene Kachel) und gelten NICHT als offener Punkt.
         net_matches = net_delta is not None and abs(net_delta) <= BALANCE_TOLERANCE
-        has_open_items = bool(gap or only_sumup or only_sk)
+        has_open_items = bool(gap_count or only_sumup_count or only_sk_count)
         is_balanced = net_matches and not has_open_items
 
         return {
@@ -136,16 +146,62 @@ class SumUpPayout(models.Model):
             'deduction_lines': deduction_lines,
             'computed_net': computed_net,
             'net_delta': net_delta,
-            'matched_count': len(matched),
-            'gap_count': len(gap),
-            'only_sumup_count': len(only_sumup),
-            'only_sk_count': len(only_sk),
-            'total_matched': sum((i.sumup_amount or Decimal('0') for i in matched), Decimal('0')),
+            'matched_count': matched_count,
+            'gap_count': gap_count,
+            'only_sumup_count': only_sumup_count,
+            'only_sk_count': only_sk_count,
+            'total_matched': total('sumup_amount', ('MATCHED',)),
             'net_matches': net_matches,
             'has_open_items': has_open_items,
             'is_balanced': is_balanced,
         }
 
+    def rebuild_summary(self):
+        """Summenzeilen per GROUP BY (Status, Kanal) neu aufbauen — nach bulk_create u.ä."""
+        zero = Value(Decimal('0'))
+        money = DecimalField(max_digits=12, decimal_places=2)
+        rows = (
+            self.items.order_by()
+            .values('match_status', 'channel')
+            .annotate(
+                item_count=Count('id'),
+                booked_amount=Coalesce(Sum(Coalesce('sumup_amount', 'sk_amount', zero)), zero, output_field=money),
+                sumup_amount=Coalesce(Sum('sumup_amount'), zero, output_field=money),
+                fees=Coalesce(Sum('sumup_fee'), zero, output_field=money),
+                refund_deductions=Coalesce(Sum('sumup_refund_deduction'), zero, output_field=money),
+            )
+        )
+        with transaction.atomic():
+            self.summary_buckets.all().delete()
+            PayoutSummaryBucket.objects.bulk_create([PayoutSummaryBucket(payout=self, **row) for row in rows])
+            SumUpPayout.objects.filter(pk=self.pk).update(summary_built=True)
+        self.summary_built = True
+
+
+class PayoutSummaryBucket(models.Model):
+    """
+    Vorberechnete Summen eines Payouts je (Match-Status, Kanal) für
+    booking_summary. Aufbau: SumUpPayout.rebuild_summary(); danach hält
+    ReconciliationItem.save() sie per Delta aktuell.
+    """
+    payout = models.ForeignKey(SumUpPayout, on_delete=models.CASCADE, related_name='summary_buckets')
+    match_status = models.CharField(max_length=20)
+    channel = models.CharField(max_length=10)
+    item_count = models.IntegerField(default=0)
+    # sumup_amount, sonst sk_amount — der Betrag, mit dem gebucht wird
+    booked_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    sumup_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fees = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refund_deductions = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['payout', 'match_status', 'channel'], name='unique_payout_summary_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.payout_id} {self.match_status}/{self.channel}: {self.item_count}"
+
 
 class ReconciliationItem(models.Model):
     """
@@ -219,6 +275,109 @@ class ReconciliationItem(models.Model):
 
     class Meta:
         ordering = ['sumup_timestamp', 'sk_timestamp']
+        indexes = [
+            # Review-Liste: Zeilen eines Payouts nach Status gefiltert
+            models.Index(fields=['payout', 'match_status']),
+        ]
 
     def __str__(self):
         return f"{self.match_status} | CHF {self.sumup_amount or self.sk_amount}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        item._summary_loaded = item._summary_contribution()
+        return item
+
+    def _summary_contribution(self):
+        """Beitrag dieser Zeile zu ihrer Summenzeile: ((Status, Kanal), Werte)."""
+        booked = self.sumup_amount if self.sumup_amount is not None else (self.sk_amount or Decimal('0'))
+        return (self.match_status, self.channel), {
+            'item_count': 1,
+            'booked_amount': Decimal(str(booked)),
+            'sumup_amount': Decimal(str(self.sumup_amount or 0)),
+            'fees': Decimal(str(self.sumup_fee or 0)),
+            'refund_deductions': Decimal(str(self.sumup_refund_deduction or 0)),
+        }
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            new = self._summary_contribution()
+            old = getattr(self, '_summary_loaded', None)
+            if new != old and SumUpPayout.objects.filter(pk=self.payout_id, summary_built=True).exists():
+                if old:
+                    self._apply_to_summary(*old, sign=-1)
+                self._apply_to_summary(*new, sign=1)
+            self._summary_loaded = new
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            if getattr(self, '_summary_loaded', None) and \
+                    SumUpPayout.objects.filter(pk=self.payout_id, summary_built=True).exists():
+                self._apply_to_summary(*self._summary_loaded, sign=-1)
+            return super().delete(*args, **kwargs)
+
+    def _apply_to_summary(self, key, values, sign):
+        match_status, channel = key
+        bucket, _ = PayoutSummaryBucket.objects.get_or_create(
+            payout_id=self.payout_id, match_status=match_status, channel=channel,
+        )
+        PayoutSummaryBucket.objects.filter(pk=bucket.pk).update(
+            **{field: F(field) + sign * value for field, value in values.items()}
+        )
+
+
+class SumUpTransaction(models.Model):
+    """
+    Lokaler Spiegel der SumUp-Transaktionshistorie (/v0.1/me/transactions/history).
+
+    Gefüllt von `manage.py sync_sumup_transactions` (inkrementell, siehe
+    reconciliation.sync). POS-Verifizierung, Refund-Sync, täglicher Abgleich und
+    Reconciliation lesen von hier statt jeweils selbst die API abzugrasen.
+    `raw` ist das unveränderte API-Objekt — die Matching-Engine arbeitet darauf.
+    """
+    sumup_id = models.CharField(max_length=64, unique=True, verbose_name="SumUp ID")
+    transaction_code = models.CharField(max_length=64, db_index=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status = models.CharField(max_length=20)
+    type = models.CharField(max_length=20)
+    timestamp = models.DateTimeField()
+    description = models.CharField(max_length=255, blank=True)
+    raw = models.JSONField(default=dict)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['type', 'status', 'timestamp']),
+        ]
+        verbose_name = "SumUp Transaktion"
+        verbose_name_plural = "SumUp Transaktionen"
+
+    def __str__(self):
+        return f"{self.transaction_code} {self.type} CHF {self.amount}"
+
+
+class SumUpSyncState(models.Model):
+    """
+    High-Water-Mark des Transaktions-Spiegels (eine Zeile, pk=1).
+    Bis `synced_until` ist die Historie vollständig gespiegelt.
+    """
+    synced_until = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_fetched = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "SumUp Sync-Status"
+        verbose_name_plural = "SumUp Sync-Status"
+
+    def __str__(self):
+        return f"SumUp-Spiegel bis {self.synced_until or '–'}"
+
+    @classmethod
+    def load(cls):
+        state, _ = cls.objects.get_or_create(pk=1)
+        return state
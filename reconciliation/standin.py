@@ -0,0 +1,215 @@
+"""
+Lokaler Stand-in für die SumUp-API (Benchmarks, Offline-Entwicklung).
+
+Implementiert, was Stock Keeper von SumUp liest:
+
+  GET /v0.1/me/transactions/history   — oldest_time/newest_time/limit, Paginierung über links[rel=next]
+  GET /v0.1/me/transactions           — Einzeldetail per ?transaction_code=
+  GET /v0.1/me/financials/payouts     — start_date/end_date, ein Eintrag pro abgerechneter Zahlung
+
+Der Datensatz ist synthetisch und deterministisch (Seed): PAYMENTs über die
+letzten `months` Monate, ein Anteil davon voll oder teilweise rückerstattet
+(refunded_amount + eigener REFUND-Eintrag mit gleichem transaction_code).
+Ausgezahlt wird monatlich am 3. des Folgemonats: Betrag − Gebühr − Refund.
+
+Aktivieren über settings.SUMUP_API_BASE bzw. Env SUMUP_API_BASE, z.B.
+http://127.0.0.1:8765 (siehe `manage.py sumup_standin`).
+"""
+import bisect
+import json
+import random
+import threading
+import time as time_module
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+PRICES = ['4.50', '6.80', '12.90', '19.90', '29.00', '34.90', '54.05', '79.00', '129.00']
+FEE_RATE = Decimal('0.0195')
+PAYOUT_DAY = 3
+CENT = Decimal('0.01')
+
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _add_month(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+class Dataset:
+    """Synthetische Transaktionen + Payouts, nach Zeit sortiert."""
+
+    def __init__(self, per_month=50_000, months=3, refund_rate=0.02, seed=1, end=None):
+        rng = random.Random(seed)
+        # Ganze Sekunden: die Clients fragen mit sekundengenauem newest_time ab
+        end = (end or datetime.now(timezone.utc)).replace(microsecond=0)
+        first_month = _month_start(end.date())
+        for _ in range(months - 1):
+            first_month = _month_start(first_month - timedelta(days=1))
+
+        self.transactions = []
+        self.payouts_by_date = defaultdict(list)
+        self.payments_by_code = {}
+
+        month = first_month
+        seq = 0
+        while month <= end.date():
+            start = datetime.combine(month, time.min, tzinfo=timezone.utc)
+            stop = min(datetime.combine(_add_month(month), time.min, tzinfo=timezone.utc), end)
+            span = (stop - start).total_seconds()
+            # Laufender Monat anteilig
+            count = int(per_month * span / ((datetime.combine(_add_month(month), time.min, tzinfo=timezone.utc) - start).total_seconds()))
+            payout_date = _add_month(month).replace(day=PAYOUT_DAY)
+            for ts_offset in sorted(rng.uniform(0, span) for _ in range(count)):
+                seq += 1
+                ts = start + timedelta(seconds=ts_offset)
+                amount = Decimal(rng.choice(PRICES)) * rng.choice((1, 1, 1, 2, 3))
+                code = f"T{seq:08X}"
+                payment = {
+                    'id': f"00000000-0000-4000-8000-{seq:012x}",
+                    'transaction_code': code,
+                    'amount': float(amount),
+                    'currency': 'CHF',
+                    'timestamp': _iso(ts),
+                    'status': 'SUCCESSFUL',
+                    'type': 'PAYMENT',
+                    'payment_type': 'POS',
+                    'description': f"Kauf-{int(ts.timestamp() * 1000)}",
+                    'refunded_amount': 0.0,
+                }
+                refunded = Decimal('0')
+                if rng.random() < refund_rate:
+                    refunded = amount if rng.random() < 0.7 else (amount / 2).quantize(CENT)
+                    payment['refunded_amount'] = float(refunded)
+                    refund_ts = min(ts + timedelta(hours=rng.uniform(1, 72)), end)
+                    self.transactions.append({
+                        'id': f"00000000-0000-4000-9000-{seq:012x}",
+                        'transaction_code': code,
+                        'amount': float(refunded),
+                        'currency': 'CHF',
+                        'timestamp': _iso(refund_ts),
+                        'status': 'SUCCESSFUL',
+                        'type': 'REFUND',
+                        'payment_type': 'POS',
+                        'description': '',
+                    })
+                self.transactions.append(payment)
+                self.payments_by_code[code] = payment
+
+                if payout_date <= end.date() and refunded < amount:
+                    fee = (amount * FEE_RATE).quantize(CENT, rounding=ROUND_HALF_UP)
+                    self.payouts_by_date[payout_date.isoformat()].append({
+                        'date': payout_date.isoformat(),
+                        'amount': float(amount - fee - refunded),
+                        'fee': float(fee),
+                        'currency': 'CHF',
+                        'status': 'SUCCESSFUL',
+                        'type': 'PAYOUT',
+                        'transaction_code': code,
+                    })
+            month = _add_month(month)
+
+        self.transactions.sort(key=lambda t: t['timestamp'])
+        self.timestamps = [t['timestamp'] for t in self.transactions]
+
+    def history(self, oldest, newest, cursor=0, limit=100):
+        lo = bisect.bisect_left(self.timestamps, oldest) if oldest else 0
+        hi = bisect.bisect_right(self.timestamps, newest) if newest else len(self.timestamps)
+        start = lo + cursor
+        return self.transactions[start:min(start + limit, hi)], start + limit < hi
+
+    def payouts(self, start_date, end_date):
+        out = []
+        day = date.fromisoformat(start_date)
+        while day <= date.fromisoformat(end_date):
+            out.extend(self.payouts_by_date.get(day.isoformat(), ()))
+            day += timedelta(days=1)
+        return out
+
+    def payout_credits(self):
+        """(Auszahlungsdatum, Summe) — für Benchmarks, die eine Bankgutschrift brauchen."""
+        return sorted(
+            (d, sum(Decimal(str(p['amount'])) for p in ps).quantize(CENT))
+            for d, ps in self.payouts_by_date.items()
+        )
+
+
+def _to_iso_z(value):
+    """Query-Zeitpunkt auf das Format der Datensatz-Timestamps bringen (String-Vergleich)."""
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return _iso(dt)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    dataset: Dataset = None
+    quiet = True
+    # Künstliche Antwortzeit in Sekunden (langsame API simulieren, Lasttests)
+    delay = 0
+
+    def log_message(self, fmt, *args):
+        if not self.quiet:
+            super().log_message(fmt, *args)
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.delay:
+            time_module.sleep(self.delay)
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._json({'error_code': 'NOT_AUTHORIZED'}, status=401)
+
+        if url.path == '/v0.1/me/transactions/history':
+            limit = min(int(q.get('limit', 10)), 1000)
+            cursor = int(q.get('cursor', 0))
+            items, more = self.dataset.history(
+                _to_iso_z(q.get('oldest_time')), _to_iso_z(q.get('newest_time')), cursor, limit,
+            )
+            links = []
+            if more:
+                params = dict(q, cursor=cursor + limit)
+                host = self.headers.get('Host') or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+                links.append({'rel': 'next', 'href': f"http://{host}{url.path}?{urlencode(params)}"})
+            return self._json({'items': items, 'links': links})
+
+        if url.path == '/v0.1/me/transactions':
+            txn = self.dataset.payments_by_code.get(q.get('transaction_code', ''))
+            if txn is None:
+                return self._json({'error_code': 'NOT_FOUND'}, status=404)
+            return self._json(txn)
+
+        if url.path == '/v0.1/me/financials/payouts':
+            if 'start_date' not in q or 'end_date' not in q:
+                return self._json({'error_code': 'MISSING', 'param': 'start_date/end_date'}, status=400)
+            return self._json(self.dataset.payouts(q['start_date'], q['end_date']))
+
+        return self._json({'error_code': 'NOT_FOUND'}, status=404)
+
+
+def serve(dataset: Dataset, host='127.0.0.1', port=0, quiet=True, background=False, delay=0):
+    """Startet den Stand-in; mit background=True in einem Daemon-Thread. Gibt den Server zurück."""
+    handler = type('Handler', (StandinHandler,), {'dataset': dataset, 'quiet': quiet, 'delay': delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, name='sumup-standin', daemon=True).start()
+    return server
@@ -0,0 +1,302 @@
+"""
+Asynchroner SumUp-Client (httpx) für Fetches, die parallel laufen sollen.
+
+Ein Abgleich braucht Payouts, die Transaktionshistorie der Abrechnungsperiode
+und ggf. Einzeldetails zu Payout-Codes, die in der Historie fehlen. Seriell
+sind das bei einem vollen Monat Dutzende Requests hintereinander; hier laufen
+sie auf einem gemeinsamen Verbindungspool gleichzeitig, begrenzt durch
+SUMUP_ASYNC_CONCURRENCY und denselben Token-Bucket-Takt wie der Sync-Client.
+
+Sync-Fassade für Views und Management-Commands:
+
+    bundle = fetch_payout_bundle(amount, credit_date)   # blockiert, intern asyncio
+    bundle = await afetch_payout_bundle(amount, credit_date)  # in async Views
+    bundle = fetch_payout_range(start, end)             # alle Payouts eines Zeitraums (Batch)
+    client = SyncFacade()                               # Drop-in für sync_transactions(client=…)
+
+Der httpx-Pool ist an den Event-Loop gebunden und lebt deshalb pro
+Fassaden-Aufruf, nicht pro Prozess. Der Circuit Breaker hält seinen Zustand
+im Datenbank-Cache; seine Calls laufen über sync_to_async, nicht im Loop.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from .breaker import budget, deadline, sumup_breaker
+from .sumup_client import (
+    CONNECT_TIMEOUT, MIN_ATTEMPT_SECONDS, RETRY_STATUSES, SumUpAPIError, api_base, _day_slices,
+    _utc_iso, backoff, credit_window, endpoint_for, estimated_period, payouts_for_credit,
+)
+from .sync import PERIOD_BUFFER_DAYS, day_bounds, upsert_transactions
+
+logger = logging.getLogger(__name__)
+
+
+class _UpstreamError(Exception):
+    """Störung bei SumUp (Netz, Timeout, 429/5xx, kaputtes JSON) — zählt für den Breaker."""
+
+
+class AsyncTokenBucket:
+    """Token-Bucket für Coroutines: `rate` Requests/s, Bursts bis `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            while True:
+                now = loop.time()
+                if self.updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncSumUpClient:
+    """
+    Nur innerhalb von `async with AsyncSumUpClient() as api:` verwenden —
+    dort lebt der Verbindungspool.
+    """
+
+    def __init__(self):
+        self.api_key = settings.SUMUP_API_KEY
+        if not self.api_key:
+            raise SumUpAPIError("SUMUP_API_KEY ist nicht konfiguriert")
+        self.concurrency = getattr(settings, 'SUMUP_ASYNC_CONCURRENCY', 8)
+        self.retries = getattr(settings, 'SUMUP_HTTP_RETRIES', 4)
+        self.http = None
+
+    async def __aenter__(self):
+        self.http = httpx.AsyncClient(
+            base_url=api_base(),
+            headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+            timeout=httpx.Timeout(budget('history'), connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+        )
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.bucket = AsyncTokenBucket(
+            rate=getattr(settings, 'SUMUP_RATE_PER_SECOND', 5),
+            capacity=getattr(settings, 'SUMUP_RATE_BURST', 10),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.http.aclose()
+
+    async def _get(self, url, params=None):
+        """GET über den Circuit Breaker; Dauer inkl. Wiederholungen geht in die Statistik."""
+        endpoint = endpoint_for(url)
+        await sync_to_async(sumup_breaker.before_call)()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            data = await self._get_with_retries(url, params, endpoint, started + deadline(endpoint))
+        except _UpstreamError as e:
+            await sync_to_async(sumup_breaker.record)(endpoint, loop.time() - started, str(e))
+            raise SumUpAPIError(str(e)) from e
+        except SumUpAPIError:
+            # 4xx: Antwort kam, SumUp ist nicht gestört
+            await sync_to_async(sumup_breaker.record)(endpoint, loop.time() - started)
+            raise
+        await sync_to_async(sumup_breaker.record)(endpoint, loop.time() - started)
+        return data
+
+    async def _get_with_retries(self, url, params, endpoint, deadline_at):
+        """
+        GET mit Wiederholung bei 429/5xx/Netzfehler (Backoff + Jitter, Retry-After),
+        Timeout und Wartezeit gekürzt auf die Restzeit bis `deadline_at`.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            remaining = max(deadline_at - loop.time(), MIN_ATTEMPT_SECONDS)
+            timeout = httpx.Timeout(min(budget(endpoint), remaining), connect=min(CONNECT_TIMEOUT, remaining))
+            try:
+                async with self.slots:
+                    resp = await self.http.get(url, params=params, timeout=timeout)
+            except httpx.TransportError as e:
+                # Timeout hat das Budget schon verbraucht — höchstens einmal wiederholen
+                timed_out = isinstance(e, httpx.TimeoutException) and attempt >= 1
+                if attempt >= self.retries or timed_out or not await self._wait(backoff(attempt), deadline_at):
+                    raise _UpstreamError(f"SumUp API Fehler: {e!r}")
+                continue
+            if (resp.status_code in RETRY_STATUSES and attempt < self.retries
+                    and await self._wait(backoff(attempt, resp.headers.get('Retry-After')), deadline_at)):
+                continue
+            if resp.status_code in RETRY_STATUSES:
+                raise _UpstreamError(f"SumUp API Fehler: {resp.status_code} für {resp.url}")
+            if resp.is_error:
+                raise SumUpAPIError(f"SumUp API Fehler: {resp.status_code} für {resp.url}")
+            try:
+                return resp.json()
+            except ValueError as e:
+                raise _UpstreamError(f"SumUp API Fehler: ungültiges JSON ({e})")
+
+    @staticmethod
+    async def _wait(seconds, deadline_at):
+        """Wie sumup_client._wait: nur schlafen, wenn danach noch ein Versuch passt."""
+        if asyncio.get_running_loop().time() + seconds + MIN_ATTEMPT_SECONDS > deadline_at:
+            return False
+        await asyncio.sleep(seconds)
+        return True
+
+    # --- Endpunkte ---
+
+    async def payouts(self, start: date, end: date) -> list[dict]:
+        data = await self._get('/v0.1/me/financials/payouts', params={
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+        })
+        return data if isinstance(data, list) else data.get('items', [])
+
+    async def transactions_between(self, oldest: datetime, newest: datetime, limit: int = 100) -> list[dict]:
+        """Historie in Tages-Slices, alle Slices gleichzeitig. Fehlt eine Seite → SumUpAPIError."""
+        pages = await asyncio.gather(*(
+            self._history_slice(lo, hi, limit) for lo, hi in _day_slices(oldest, newest)
+        ))
+        by_id = {}
+        for txn in (t for page in pages for t in page):
+            by_id.setdefault(txn.get('id') or id(txn), txn)
+        return sorted(by_id.values(), key=lambda t: t.get('timestamp') or '')
+
+    async def _history_slice(self, oldest, newest, limit):
+        params = {'oldest_time': _utc_iso(oldest), 'newest_time': _utc_iso(newest), 'limit': limit}
+        data = await self._get('/v0.1/me/transactions/history', params=params)
+        items = data.get('items', [])
+        transactions = list(items)
+        while len(items) >= limit:
+            next_link = next((l for l in data.get('links', []) if l.get('rel') == 'next'), None)
+            if not next_link or not next_link.get('href'):
+                break
+            try:
+                data = await self._get(next_link['href'])
+            except SumUpAPIError as e:
+                raise SumUpAPIError(
+                    f"SumUp Historie {params['oldest_time']}–{params['newest_time']} unvollständig "
+                    f"(nach {len(transactions)} Transaktionen): {e}"
+                ) from e
+            items = data.get('items', [])
+            transactions.extend(items)
+        return transactions
+
+    async def transaction_detail(self, transaction_code: str) -> dict:
+        return await self._get('/v0.1/me/transactions', params={'transaction_code': transaction_code})
+
+    async def transaction_details(self, codes) -> list[dict]:
+        return list(await asyncio.gather(*(self.transaction_detail(c) for c in codes)))
+
+
+@dataclass
+class PayoutBundle:
+    payouts: list[dict]
+    transactions: list[dict] = field(default_factory=list)
+
+
+async def _fetch_payout_bundle(amount: Decimal, credit_date: date) -> PayoutBundle:
+    # Periode vorab aus dem Gutschriftsdatum schätzen, damit Payouts und
+    # Historie gleichzeitig laden können (Payout-Datum liegt ±3 Tage daneben).
+    lo, hi = credit_window(credit_date)
+    search_start = estimated_period(lo)[0] - timedelta(days=PERIOD_BUFFER_DAYS)
+    search_end = estimated_period(hi)[1] + timedelta(days=PERIOD_BUFFER_DAYS)
+
+    async with AsyncSumUpClient() as api:
+        raw_payouts, history = await asyncio.gather(
+            api.payouts(lo, hi),
+            api.transactions_between(*day_bounds(search_start, search_end)),
+        )
+        payouts = payouts_for_credit(raw_payouts, amount, credit_date)
+        # Payout-Codes ausserhalb des geschätzten Fensters einzeln nachladen
+        known = {t.get('transaction_code') for t in history}
+        missing = sorted({p['transaction_code'] for p in payouts} - known)
+        details = await api.transaction_details(missing) if missing else []
+
+    logger.info("sumup_async.bundle payouts=%d history=%d details=%d",
+                len(payouts), len(history), len(details))
+    return PayoutBundle(payouts=payouts, transactions=history + [d for d in details if d])
+
+
+def fetch_payout_bundle(amount: Decimal, credit_date: date) -> PayoutBundle:
+    """
+    Blockierende Fassade: Payouts + Historie + fehlende Details parallel laden
+    und die Transaktionen in den lokalen Spiegel schreiben.
+    """
+    bundle = async_to_sync(_fetch_payout_bundle)(amount, credit_date)
+    upsert_transactions(bundle.transactions)
+    return bundle
+
+
+async def afetch_payout_bundle(amount: Decimal, credit_date: date) -> PayoutBundle:
+    """Wie fetch_payout_bundle, für async Views: HTTP im Event-Loop, Spiegel-Upsert im Thread."""
+    bundle = await _fetch_payout_bundle(amount, credit_date)
+    await sync_to_async(upsert_transactions)(bundle.transactions)
+    return bundle
+
+
+async def _fetch_payout_range(start: date, end: date) -> PayoutBundle:
+    # Payouts monatsweise und die Historie aller betroffenen Perioden gleichzeitig
+    months = []
+    lo = start
+    while lo <= end:
+        hi = min((lo.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1), end)
+        months.append((lo, hi))
+        lo = hi + timedelta(days=1)
+    search_start = estimated_period(start)[0] - timedelta(days=PERIOD_BUFFER_DAYS)
+    search_end = estimated_period(end)[1] + timedelta(days=PERIOD_BUFFER_DAYS)
+
+    async with AsyncSumUpClient() as api:
+        chunks, history = await asyncio.gather(
+            asyncio.gather(*(api.payouts(lo, hi) for lo, hi in months)),
+            api.transactions_between(*day_bounds(search_start, search_end)),
+        )
+        payouts = [p for chunk in chunks for p in chunk]
+        known = {t.get('transaction_code') for t in history}
+        missing = sorted({p['transaction_code'] for p in payouts} - known)
+        details = await api.transaction_details(missing) if missing else []
+
+    logger.info("sumup_async.range %s..%s payouts=%d history=%d details=%d",
+                start, end, len(payouts), len(history), len(details))
+    return PayoutBundle(payouts=payouts, transactions=history + [d for d in details if d])
+
+
+def fetch_payout_range(start: date, end: date) -> PayoutBundle:
+    """
+    Blockierende Fassade für Batch-Abgleiche: alle Payouts mit Datum in
+    start..end plus die Historie ihrer Perioden, in den Spiegel geschrieben.
+    """
+    bundle = async_to_sync(_fetch_payout_range)(start, end)
+    upsert_transactions(bundle.transactions)
+    return bundle
+
+
+class SyncFacade:
+    """Blockierende Methoden im Stil von SumUpClient, intern asynchron und parallel."""
+
+    def __init__(self):
+        # Fehlenden API-Key sofort melden, nicht erst im Event-Loop
+        AsyncSumUpClient()
+
+    def find_payouts_for_credit(self, amount: Decimal, credit_date: date) -> list[dict]:
+        async def run():
+            async with AsyncSumUpClient() as api:
+                return await api.payouts(*credit_window(credit_date))
+        return payouts_for_credit(async_to_sync(run)(), amount, credit_date)
+
+    def get_transactions_between(self, oldest: datetime, newest: datetime, limit: int = 100) -> list[dict]:
+        async def run():
+            async with AsyncSumUpClient() as api:
+                return await api.transactions_between(oldest, newest, limit)
+        return async_to_sync(run)()
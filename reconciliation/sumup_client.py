@@ -10,42 +10,203 @@ Die monatliche Bankgutschrift ist die Summe aller Payout-Amounts eines Auszahlun
 Mapping: payout.transaction_code == transaction.transaction_code (1:1)
 
 Auth: Bearer Token aus settings.SUMUP_API_KEY
+Basis-URL: settings.SUMUP_API_BASE (Default https://api.sumup.com)
+
+Transport: get_client() liefert einen Client pro Prozess mit gepoolten
+Verbindungen. 429/5xx und Netzfehler werden mit Backoff + Jitter wiederholt
+(Retry-After wird respektiert), ein Token-Bucket begrenzt die Request-Rate
+über alle Threads. Lange Historien-Fenster werden in Tages-Slices parallel geladen;
+fehlt eine Seite, gibt es SumUpAPIError statt einer verkürzten Liste.
+
+Jeder Call geht durch den gemeinsamen Circuit Breaker (reconciliation.breaker)
+und hat pro Endpunkt ein Latenzbudget (SUMUP_LATENCY_BUDGETS) als Read-Timeout
+je Versuch sowie eine Deadline für den ganzen Call (SUMUP_CALL_DEADLINES):
+Wiederholungen, Backoff und Retry-After müssen in die Restzeit passen, sonst
+bleibt es beim letzten Fehler. Ist SumUp gestört, scheitern Calls sofort mit
+SumUpUnavailable.
 """
 
-import requests
 import logging
-from datetime import datetime, date, timedelta
+import random
+import threading
+import time as time_mod
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time, timedelta, timezone
 from decimal import Decimal
+
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .breaker import budget, deadline, sumup_breaker
 
 logger = logging.getLogger(__name__)
 
 SUMUP_BASE = 'https://api.sumup.com'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def api_base() -> str:
+    """settings.SUMUP_API_BASE, z.B. der lokale Stand-in (reconciliation.standin)."""
+    return (getattr(settings, 'SUMUP_API_BASE', '') or SUMUP_BASE).rstrip('/')
 
 
 class SumUpAPIError(Exception):
     pass
 
 
+class SumUpUnavailable(SumUpAPIError):
+    """Circuit Breaker offen — kein Call an SumUp, sofortiger Fehler."""
+
+
+# Verbindungsaufbau: kurz, unabhängig vom Endpunkt-Budget
+CONNECT_TIMEOUT = 3.05
+# Kürzester Read-Timeout, für den sich ein weiterer Versuch noch lohnt
+MIN_ATTEMPT_SECONDS = 0.5
+
+
+def backoff(attempt: int, retry_after: str | None = None) -> float:
+    """Wartezeit vor Versuch `attempt` + 1: Retry-After, sonst exponentiell mit Jitter."""
+    if retry_after:
+        try:
+            return min(float(retry_after), 30)
+        except ValueError:
+            pass
+    return min(0.5 * 2 ** attempt, 30) + random.uniform(0, 0.5)
+
+
+def endpoint_for(path: str) -> str:
+    """API-Pfad bzw. URL → Endpunkt-Name für Budget und Statistik."""
+    if '/financials/payouts' in path:
+        return 'payouts'
+    if '/transactions/history' in path:
+        return 'history'
+    return 'transaction'
+
+
+class TokenBucket:
+    """Thread-sicherer Token-Bucket: `rate` Requests/s, Bursts bis `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time_mod.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time_mod.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Etwas Jitter, damit wartende Threads nicht im Gleichschritt aufwachen
+            time_mod.sleep(wait + random.uniform(0, wait / 4))
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter, der vor jedem Request ein Token aus dem Bucket nimmt."""
+
+    def __init__(self, bucket: TokenBucket, **kwargs):
+        self.bucket = bucket
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.bucket.acquire()
+        return super().send(request, **kwargs)
+
+
+def build_session() -> requests.Session:
+    # Wiederholungen macht SumUpClient selbst (Deadline pro Call), nicht urllib3
+    pool_size = getattr(settings, 'SUMUP_POOL_SIZE', 8)
+    bucket = TokenBucket(
+        rate=getattr(settings, 'SUMUP_RATE_PER_SECOND', 5),
+        capacity=getattr(settings, 'SUMUP_RATE_BURST', 10),
+    )
+    session = requests.Session()
+    session.mount('https://', RateLimitedAdapter(
+        bucket, pool_connections=2, pool_maxsize=pool_size,
+    ))
+    session.mount('http://', RateLimitedAdapter(
+        bucket, pool_connections=2, pool_maxsize=pool_size,
+    ))
+    return session
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> 'SumUpClient':
+    """Prozessweiter SumUpClient (eine Session, ein Verbindungspool, ein Rate-Limit)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SumUpClient(session=build_session())
+    return _client
+
+
 class SumUpClient:
-    def __init__(self):
+    def __init__(self, session: requests.Session | None = None):
         self.api_key = settings.SUMUP_API_KEY
         if not self.api_key:
             raise SumUpAPIError("SUMUP_API_KEY ist nicht konfiguriert")
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.session = session or build_session()
+        self.headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json',
-        })
+        }
 
     def _get(self, path, params=None):
-        url = f"{SUMUP_BASE}{path}"
+        return self._get_url(f"{api_base()}{path}", params=params)
+
+    def _get_url(self, url, params=None):
+        endpoint = endpoint_for(url)
+        sumup_breaker.before_call()
+        started = time_mod.monotonic()
         try:
-            resp = self.session.get(url, params=params, timeout=15)
+            resp = self._get_with_retries(url, params, endpoint, started + deadline(endpoint))
             resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as e:
+            data = resp.json()
+        except requests.HTTPError as e:
+            # 4xx (z.B. unbekannter Code) ist keine Störung von SumUp
+            upstream = e.response is not None and e.response.status_code in RETRY_STATUSES
+            sumup_breaker.record(endpoint, time_mod.monotonic() - started, str(e) if upstream else None)
+            raise SumUpAPIError(f"SumUp API Fehler: {e}")
+        except (requests.RequestException, ValueError) as e:
+            sumup_breaker.record(endpoint, time_mod.monotonic() - started, str(e) or type(e).__name__)
             raise SumUpAPIError(f"SumUp API Fehler: {e}")
+        sumup_breaker.record(endpoint, time_mod.monotonic() - started)
+        return data
+
+    def _get_with_retries(self, url, params, endpoint, deadline_at):
+        """
+        GET mit Wiederholung bei 429/5xx/Netzfehler. Read-Timeout und Wartezeit
+        werden auf die Restzeit bis `deadline_at` gekürzt; passt der nächste
+        Versuch nicht mehr hinein, gilt die letzte Antwort bzw. der letzte Fehler.
+        """
+        retries = getattr(settings, 'SUMUP_HTTP_RETRIES', 4)
+        for attempt in range(retries + 1):
+            remaining = max(deadline_at - time_mod.monotonic(), MIN_ATTEMPT_SECONDS)
+            timeout = (min(CONNECT_TIMEOUT, remaining), min(budget(endpoint), remaining))
+            try:
+                resp = self.session.get(url, params=params, headers=self.headers, timeout=timeout)
+            except requests.RequestException as e:
+                # Ein Read-Timeout hat das Budget schon verbraucht — höchstens einmal wiederholen
+                timed_out = isinstance(e, requests.Timeout) and attempt >= 1
+                if attempt >= retries or timed_out or not _wait(backoff(attempt), deadline_at):
+                    raise
+                continue
+            if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+                return resp
+            if not _wait(backoff(attempt, resp.headers.get('Retry-After')), deadline_at):
+                return resp
 
     def get_payouts_for_date(self, credit_date: date) -> list[dict]:
         """
@@ -70,43 +231,54 @@ class SumUpClient:
         Sucht in einem ±3 Tage Fenster und prüft ob die Summe der Payouts
         eines Datums dem Gutschriftsbetrag entspricht.
         """
-        start = credit_date - timedelta(days=3)
-        end = credit_date + timedelta(days=3)
+        start, end = credit_window(credit_date)
         data = self._get('/v0.1/me/financials/payouts', params={
             'start_date': start.isoformat(),
             'end_date': end.isoformat(),
         })
-        all_payouts = data if isinstance(data, list) else data.get('items', [])
-
-        # Gruppieren nach Datum
-        from collections import defaultdict
-        by_date = defaultdict(list)
-        for p in all_payouts:
-            by_date[p.get('date', '')].append(p)
-
-        # Datum finden dessen Summe zum Betrag passt
-        for payout_date, payouts in by_date.items():
-            total = sum(Decimal(str(p.get('amount', 0))) for p in payouts)
-            if abs(total - amount) <= Decimal('0.10'):
-                logger.info(
-                    f"Payout-Datum gefunden: {payout_date}, "
-                    f"{len(payouts)} Payouts, Summe={total}"
-                )
-                return payouts
-
-        logger.warning(f"Kein passendes Payout-Datum für CHF {amount} um {credit_date}")
-        return []
+        return payouts_for_credit(data, amount, credit_date)
 
     def get_transactions_in_window(self, period_start: date, period_end: date) -> list[dict]:
         """
         Lädt alle Transaktionen der Transaktionshistorie im Zeitraum (paginiert).
         Enthält PAYMENT- wie REFUND-Einträge.
         """
+        return self.get_transactions_between(
+            datetime.combine(period_start, time.min, tzinfo=timezone.utc),
+            datetime.combine(period_end, time(23, 59, 59), tzinfo=timezone.utc),
+        )
+
+    def get_transactions_between(self, oldest: datetime, newest: datetime, limit: int = 100) -> list[dict]:
+        """
+        Wie get_transactions_in_window, aber mit Zeitpunkten statt Tagen.
+        Fenster über mehr als einen Tag werden in Tages-Slices zerlegt und
+        parallel geladen (SUMUP_FETCH_WORKERS), Ergebnis nach Zeit sortiert.
+        Schlägt ein Slice oder eine Folgeseite fehl, wird SumUpAPIError
+        geworfen statt eine unvollständige Liste zurückzugeben — sonst
+        erscheinen fehlende Zahlungen im Abgleich als ONLY_SK.
+        """
+        slices = _day_slices(oldest, newest)
+        if len(slices) == 1:
+            return self._fetch_window(oldest, newest, limit)
+
+        workers = min(getattr(settings, 'SUMUP_FETCH_WORKERS', 4), len(slices))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sumup') as pool:
+            futures = [pool.submit(self._fetch_window, lo, hi, limit) for lo, hi in slices]
+            # result() reicht den ersten Fehler weiter; restliche Slices laufen aus
+            pages = [f.result() for f in futures]
+
+        # Slice-Grenzen sind inklusive → Dubletten über die id entfernen
+        by_id = {}
+        for txn in (t for page in pages for t in page):
+            by_id.setdefault(txn.get('id') or id(txn), txn)
+        return sorted(by_id.values(), key=lambda t: t.get('timestamp') or '')
+
+    def _fetch_window(self, oldest: datetime, newest: datetime, limit: int) -> list[dict]:
         all_transactions = []
         params = {
-            'oldest_time': period_start.isoformat() + 'T00:00:00Z',
-            'newest_time': period_end.isoformat() + 'T23:59:59Z',
-            'limit': 100,
+            'oldest_time': _utc_iso(oldest),
+            'newest_time': _utc_iso(newest),
+            'limit': limit,
         }
 
         data = self._get('/v0.1/me/transactions/history', params=params)
@@ -114,7 +286,7 @@ class SumUpClient:
         all_transactions.extend(items)
 
         # Paginierung über links
-        while len(items) >= 100 and 'links' in data:
+        while len(items) >= limit and 'links' in data:
             links = data.get('links', [])
             next_link = next((l for l in links if l.get('rel') == 'next'), None)
             if not next_link:
@@ -123,63 +295,91 @@ class SumUpClient:
             if not next_url:
                 break
             try:
-                resp = self.session.get(next_url, timeout=15)
-                resp.raise_for_status()
-                data = resp.json()
-                items = data.get('items', [])
-                all_transactions.extend(items)
-            except requests.RequestException:
-                break
+                data = self._get_url(next_url)
+            except SumUpAPIError as e:
+                raise SumUpAPIError(
+                    f"SumUp Historie {params['oldest_time']}–{params['newest_time']} unvollständig "
+                    f"(nach {len(all_transactions)} Transaktionen): {e}"
+                ) from e
+            items = data.get('items', [])
+            all_transactions.extend(items)
 
         return all_transactions
 
-    def get_transactions_by_codes(self, transaction_codes: set[str],
-                                  period_start: date, period_end: date) -> list[dict]:
-        """
-        Lädt Transaktionen für einen Zeitraum und filtert auf die angegebenen
-        transaction_codes.
-        """
-        all_transactions = self.get_transactions_in_window(period_start, period_end)
-        matched = [t for t in all_transactions if t.get('transaction_code') in transaction_codes]
-        logger.info(
-            f"SumUp: {len(all_transactions)} Transaktionen geladen, "
-            f"{len(matched)} matched auf Payout-Codes"
-        )
-        return matched
 
-    def get_payout_transactions(self, payouts: list[dict]) -> tuple[list[dict], date, date]:
-        """
-        Lädt die Transaktions-Details für eine Liste von Payouts.
+def credit_window(credit_date: date) -> tuple[date, date]:
+    """Payout-Suchfenster um eine Bankgutschrift (±3 Tage)."""
+    return credit_date - timedelta(days=3), credit_date + timedelta(days=3)
 
-        Returns:
-            (transactions, period_start, period_end)
-        """
-        if not payouts:
-            return [], None, None
 
-        # Transaction codes aus Payouts
-        tx_codes = set(p['transaction_code'] for p in payouts)
+def payouts_for_credit(data, amount: Decimal, credit_date: date) -> list[dict]:
+    """Payouts des Auszahlungsdatums, dessen Summe zum Gutschriftsbetrag passt."""
+    # API gibt direkt ein Array zurück
+    all_payouts = data if isinstance(data, list) else data.get('items', [])
+
+    # Gruppieren nach Datum
+    by_date = defaultdict(list)
+    for p in all_payouts:
+        by_date[p.get('date', '')].append(p)
 
-        # Geschätzten Zeitraum ermitteln: Payouts des Monats vor dem Auszahlungsdatum
-        payout_date = date.fromisoformat(payouts[0]['date'])
-        # Transaktionen sind typischerweise vom Vormonat
-        period_end = payout_date.replace(day=1) - timedelta(days=1)  # Letzter Tag Vormonat
-        period_start = period_end.replace(day=1)  # Erster Tag Vormonat
+    # Datum finden dessen Summe zum Betrag passt
+    for payout_date, payouts in by_date.items():
+        total = sum(Decimal(str(p.get('amount', 0))) for p in payouts)
+        if abs(total - amount) <= Decimal('0.10'):
+            logger.info(
+                f"Payout-Datum gefunden: {payout_date}, "
+                f"{len(payouts)} Payouts, Summe={total}"
+            )
+            return payouts
 
-        # Etwas Puffer geben
-        search_start = period_start - timedelta(days=5)
-        search_end = period_end + timedelta(days=5)
+    logger.warning(f"Kein passendes Payout-Datum für CHF {amount} um {credit_date}")
+    return []
 
-        transactions = self.get_transactions_by_codes(tx_codes, search_start, search_end)
 
-        # Echte Periode aus Timestamps ableiten
-        if transactions:
-            timestamps = sorted(
-                datetime.fromisoformat(t['timestamp'].replace('Z', '+00:00')).date()
-                for t in transactions if t.get('timestamp')
-            )
-            if timestamps:
-                period_start = timestamps[0]
-                period_end = timestamps[-1]
+def payout_fee_maps(payouts: list[dict]) -> tuple[dict[str, Decimal], dict[str, Decimal]]:
+    """
+    Gebühren-Mapping (transaction_code → fee) und tatsächlich abgerechneter
+    Bruttobetrag pro Transaktion (Netto + Gebühr). Letzterer weicht von
+    txn.amount ab, wenn eine Teilrückerstattung abgezogen wurde.
+    """
+    fees = {p['transaction_code']: Decimal(str(p.get('fee', 0))) for p in payouts}
+    settled = {
+        p['transaction_code']: Decimal(str(p.get('amount', 0))) + Decimal(str(p.get('fee', 0)))
+        for p in payouts
+    }
+    return fees, settled
+
+
+def estimated_period(payout_date: date) -> tuple[date, date]:
+    """Transaktionen eines Payouts sind typischerweise vom Vormonat."""
+    period_end = payout_date.replace(day=1) - timedelta(days=1)  # Letzter Tag Vormonat
+    period_start = period_end.replace(day=1)  # Erster Tag Vormonat
+    return period_start, period_end
+
+
+def _day_slices(oldest: datetime, newest: datetime) -> list[tuple[datetime, datetime]]:
+    """Zerlegt [oldest, newest] an UTC-Mitternacht in Tages-Fenster."""
+    slices = []
+    lo = oldest
+    while True:
+        lo_utc = lo.astimezone(timezone.utc) if lo.tzinfo else lo
+        midnight = datetime.combine(lo_utc.date() + timedelta(days=1), time.min, tzinfo=lo_utc.tzinfo)
+        if midnight >= newest:
+            slices.append((lo, newest))
+            return slices
+        slices.append((lo, midnight))
+        lo = midnight
+
+
+def _wait(seconds: float, deadline_at: float) -> bool:
+    """Schläft `seconds`, wenn danach noch ein Versuch in die Deadline passt."""
+    if time_mod.monotonic() + seconds + MIN_ATTEMPT_SECONDS > deadline_at:
+        return False
+    time_mod.sleep(seconds)
+    return True
+
 
-        return transactions, period_start, period_end
+def _utc_iso(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,244 @@
+"""
+Inkrementeller Spiegel der SumUp-Transaktionshistorie (SumUpTransaction).
+
+Statt dass POS-Verifizierung, Refund-Sync, täglicher Abgleich und
+Reconciliation jeweils selbst /v0.1/me/transactions/history abgrasen, lädt
+sync_transactions() nur das Fenster seit der High-Water-Mark (SumUpSyncState)
+nach. Die Konsumenten lesen aus der Tabelle und rufen vorher ensure_synced()
+auf — ist der Spiegel frisch genug, passiert kein API-Call.
+
+Überlappung: Jeder Lauf lädt SUMUP_SYNC_OVERLAP_DAYS vor der High-Water-Mark
+erneut. So kommen Status- und refunded_amount-Änderungen jüngerer Zahlungen
+(Refund ein paar Tage später) im Spiegel an; der Upsert auf sumup_id macht
+das Nachladen idempotent.
+
+Live-Polling (sync_recent): Die Kassen fragen während einer Zahlung alle paar
+Sekunden nach. Pro Zeit-Bucket (SUMUP_RECENT_TTL_SECONDS) lädt nur ein Prozess
+das jüngste Fenster — Single-Flight über cache.add —, alle anderen lesen
+danach den Spiegel. Diese Live-Fenster verschieben die High-Water-Mark nicht:
+sonst hielte ensure_synced() den Spiegel dauernd für frisch, und der Lauf mit
+Überlappung (Refunds älterer Zahlungen) fände nie statt.
+"""
+import logging
+import time as time_module
+from datetime import date, datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import SumUpSyncState, SumUpTransaction
+from .sumup_client import SumUpAPIError, SumUpUnavailable, estimated_period, get_client
+
+logger = logging.getLogger(__name__)
+
+# Puffer um die geschätzte Abrechnungsperiode (Tage)
+PERIOD_BUFFER_DAYS = 5
+
+UPSERT_FIELDS = [
+    'transaction_code', 'amount', 'refunded_amount', 'status', 'type',
+    'timestamp', 'description', 'raw', 'synced_at',
+]
+
+
+def _overlap():
+    return timedelta(days=getattr(settings, 'SUMUP_SYNC_OVERLAP_DAYS', 7))
+
+
+def _parse_ts(ts_str):
+    if not ts_str:
+        return None
+    try:
+        return datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+    except Exception:
+        return None
+
+
+def _row(txn):
+    ts = _parse_ts(txn.get('timestamp'))
+    if not txn.get('id') or ts is None:
+        return None
+    return SumUpTransaction(
+        sumup_id=txn['id'],
+        transaction_code=txn.get('transaction_code') or '',
+        amount=Decimal(str(txn.get('amount') or 0)),
+        refunded_amount=Decimal(str(txn.get('refunded_amount') or 0)),
+        status=txn.get('status') or '',
+        type=txn.get('type') or '',
+        timestamp=ts,
+        description=(txn.get('description') or '')[:255],
+        raw=txn,
+    )
+
+
+def upsert_transactions(txns):
+    """Schreibt API-Transaktionen in den Spiegel (Insert oder Update auf sumup_id)."""
+    rows = [r for r in map(_row, txns) if r is not None]
+    if not rows:
+        return 0
+    # MySQL kennt kein ON CONFLICT (…): dort greift der Unique-Index implizit
+    unique_fields = ['sumup_id'] if connection.features.supports_update_conflicts_with_target else None
+    SumUpTransaction.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True,
+        unique_fields=unique_fields, update_fields=UPSERT_FIELDS,
+    )
+    return len(rows)
+
+
+def sync_transactions(since=None, until=None, client=None, advance=True):
+    """
+    Lädt die Historie von `since` bis `until` (Default: High-Water-Mark minus
+    Überlappung bis jetzt) und spiegelt sie. Die High-Water-Mark rückt nur vor,
+    wenn das Fenster lückenlos an den bestehenden Spiegel anschliesst und
+    `advance` gesetzt ist — Live-Fenster (sync_recent) übergeben advance=False.
+    Gibt die Anzahl geladener Transaktionen zurück.
+    """
+    state = SumUpSyncState.load()
+    now = timezone.now()
+    until = min(until or now, now)
+    if since is None:
+        if state.synced_until:
+            since = state.synced_until - _overlap()
+        else:
+            since = now - timedelta(days=getattr(settings, 'SUMUP_SYNC_INITIAL_DAYS', 120))
+
+    txns = (client or get_client()).get_transactions_between(since, until)
+    with transaction.atomic():
+        count = upsert_transactions(txns)
+        contiguous = state.synced_until is None or since <= state.synced_until
+        fields = {'last_run_at': now, 'last_fetched': len(txns)}
+        if advance and contiguous and (state.synced_until is None or until > state.synced_until):
+            fields['synced_until'] = until
+        SumUpSyncState.objects.filter(pk=state.pk).update(**fields)
+
+    logger.info("sumup_sync.done since=%s until=%s fetched=%d stored=%d",
+                since.isoformat(), until.isoformat(), len(txns), count)
+    return len(txns)
+
+
+def ensure_synced(until, client=None):
+    """Synchronisiert nur, wenn der Spiegel `until` noch nicht abdeckt."""
+    state = SumUpSyncState.load()
+    if state.synced_until and state.synced_until >= until:
+        return 0
+    return sync_transactions(client=client)
+
+
+# Wie lange Nachzügler auf den Upstream-Call eines anderen Prozesses warten
+RECENT_WAIT_SECONDS = 2.0
+# Sperre überdauert einen hängenden Call: Deadline 'history' inkl.
+# Wiederholungen (SUMUP_CALL_DEADLINES, 12 s), mit Reserve
+RECENT_LOCK_SECONDS = 20
+
+
+def sync_recent(oldest, client=None, ttl=None):
+    """
+    Spiegelt die jüngste Historie ab `oldest` für Polling-Endpunkte, höchstens
+    einmal pro TTL-Bucket für alle Prozesse. Das Fenster ist am Bucket
+    ausgerichtet (Bucket-Start minus Lookback) — parallele Anfragen mehrerer
+    Kassen landen so auf demselben Cache-Key. Wer die Sperre nicht bekommt,
+    wartet kurz auf das Ergebnis und liest dann den Spiegel, wie er ist.
+
+    Die Sperre ist cache.add im Datenbank-Cache (Primärschlüssel) und damit
+    prozessübergreifend atomar.
+
+    `ttl` überschreibt SUMUP_RECENT_TTL_SECONDS (Event-Stream: kürzerer Takt).
+
+    Returns: Anzahl geladener Transaktionen (0, wenn aus dem Cache bedient).
+    Raises: SumUpAPIError, wenn der Upstream-Call dieses Buckets scheiterte.
+    """
+    ttl = ttl or getattr(settings, 'SUMUP_RECENT_TTL_SECONDS', 3)
+    lookback = timedelta(minutes=getattr(settings, 'SUMUP_RECENT_LOOKBACK_MINUTES', 20))
+    now = timezone.now()
+    bucket = int(now.timestamp() // ttl)
+    since = datetime.fromtimestamp(bucket * ttl, tz=dt_timezone.utc) - lookback
+    if oldest < since:
+        # Ältere Zahlung: Fenster auf die Minute abrunden, bleibt teilbar
+        since = oldest.replace(second=0, microsecond=0)
+    key = f"reconciliation.sumup_recent:{ttl}:{int(since.timestamp())}:{bucket}"
+
+    result = cache.get(key)
+    if result is None and cache.add(f"{key}:lock", 1, RECENT_LOCK_SECONDS):
+        try:
+            fetched = sync_transactions(since=since, until=now, client=client, advance=False)
+        except SumUpAPIError as e:
+            cache.set(key, {'error': str(e), 'unavailable': isinstance(e, SumUpUnavailable)}, ttl * 2)
+            raise
+        finally:
+            cache.delete(f"{key}:lock")
+        cache.set(key, {'fetched': fetched}, ttl * 2)
+        return fetched
+
+    deadline = time_module.monotonic() + RECENT_WAIT_SECONDS
+    while result is None and time_module.monotonic() < deadline:
+        time_module.sleep(0.1)
+        result = cache.get(key)
+    if result and 'error' in result:
+        raise (SumUpUnavailable if result.get('unavailable') else SumUpAPIError)(result['error'])
+    return 0
+
+
+def day_bounds(start: date, end: date):
+    """UTC-Tagesgrenzen, wie sie die SumUp-API (oldest_time/newest_time) verwendet."""
+    return (
+        datetime.combine(start, time.min, tzinfo=dt_timezone.utc),
+        datetime.combine(end + timedelta(days=1), time.min, tzinfo=dt_timezone.utc),
+    )
+
+
+def transactions_between(start: date, end: date):
+    """Gespiegelte Transaktionen der Tage start..end (UTC, inklusive)."""
+    lo, hi = day_bounds(start, end)
+    return SumUpTransaction.objects.filter(timestamp__gte=lo, timestamp__lt=hi)
+
+
+def payout_transactions(payouts: list[dict], client=None, prefetched=False) -> tuple[list[dict], date, date]:
+    """
+    Transaktions-Details (Roh-JSON) für eine Liste von Payouts aus dem Spiegel.
+    `prefetched`: das Fenster wurde eben geladen (sumup_async.fetch_payout_bundle),
+    kein erneuter Sync nötig.
+
+    Returns:
+        (transactions, period_start, period_end)
+    """
+    if not payouts:
+        return [], None, None
+
+    tx_codes = set(p['transaction_code'] for p in payouts)
+
+    period_start, period_end = estimated_period(date.fromisoformat(payouts[0]['date']))
+
+    # Etwas Puffer geben
+    search_start = period_start - timedelta(days=PERIOD_BUFFER_DAYS)
+    search_end = period_end + timedelta(days=PERIOD_BUFFER_DAYS)
+    if not prefetched:
+        ensure_synced(day_bounds(search_start, search_end)[1], client=client)
+
+    rows = list(
+        transactions_between(search_start, search_end)
+        .filter(transaction_code__in=tx_codes)
+        .values_list('raw', 'timestamp')
+    )
+    transactions = [raw for raw, _ts in rows]
+
+    # Echte Periode aus Timestamps ableiten
+    if rows:
+        timestamps = sorted(ts.date() for _raw, ts in rows)
+        period_start = timestamps[0]
+        period_end = timestamps[-1]
+
+    # Payout-Codes ausserhalb des Fensters (z.B. einzeln nachgeladene Details)
+    # kommen ins Matching, verschieben aber die Periode nicht.
+    missing = tx_codes - {raw.get('transaction_code') for raw in transactions}
+    if missing:
+        transactions += list(
+            SumUpTransaction.objects.filter(transaction_code__in=missing, type='PAYMENT')
+            .values_list('raw', flat=True)
+        )
+    logger.info("SumUp-Spiegel: %d Transaktionen matched auf %d Payout-Codes",
+                len(transactions), len(tx_codes))
+
+    return transactions, period_start, period_end
@@ -0,0 +1,10 @@
+"""Hintergrund-Tasks der reconciliation-App (siehe jobs.queue)."""
+from jobs.models import Job
+from jobs.queue import task
+
+from .sync import sync_transactions
+
+
+@task('reconciliation.sync_sumup_transactions', priority=Job.Priority.LOW, max_attempts=3)
+def sync_sumup_transactions():
+    sync_transactions()
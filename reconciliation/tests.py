@@ -0,0 +1,588 @@
+"""Tests for the SumUp mirror, payout matching and the reconciliation review endpoints."""
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from commerce.models import Sale, SaleItem
+from core.models import Category, Product, StockMovement, Vat
+
+from .breaker import latency_stats, sumup_breaker
+from .matching import classify_channels, rematch_payout, run_matching
+from .models import ReconciliationItem, SumUpPayout, SumUpSyncState, SumUpTransaction
+from .standin import Dataset, serve
+from .sumup_async import AsyncSumUpClient
+from .sumup_client import SumUpAPIError, SumUpClient, SumUpUnavailable
+from .sync import ensure_synced, sync_recent, sync_transactions, upsert_transactions
+
+
+class FakeSumUpClient:
+    def __init__(self, txns):
+        self.txns = txns
+        self.calls = []
+
+    def get_transactions_between(self, oldest, newest):
+        self.calls.append((oldest, newest))
+        return [t for t in self.txns if oldest.isoformat() <= t['timestamp'] <= newest.isoformat()]
+
+
+class SumUpMirrorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now().replace(microsecond=0)
+        self.client.force_login(get_user_model().objects.create_user('kasse', password='x', is_staff=True))
+
+    def _txn(self, sumup_id, code, amount, minutes_ago, **extra):
+        ts = (self.now - timedelta(minutes=minutes_ago)).astimezone(dt_timezone.utc)
+        return {'id': sumup_id, 'transaction_code': code, 'amount': amount, 'status': 'SUCCESSFUL',
+                'type': 'PAYMENT', 'timestamp': ts.isoformat(), **extra}
+
+    def test_incremental_sync_upserts_and_advances_high_water_mark(self):
+        fake = FakeSumUpClient([self._txn('a', 'TX1', 20.0, 60)])
+        sync_transactions(client=fake)
+        state = SumUpSyncState.load()
+        self.assertIsNotNone(state.synced_until)
+
+        fake.txns = [self._txn('a', 'TX1', 20.0, 60, refunded_amount=20.0), self._txn('b', 'TX2', 5.5, 1)]
+        sync_transactions(client=fake)
+        self.assertEqual(SumUpTransaction.objects.count(), 2)
+        self.assertEqual(SumUpTransaction.objects.get(sumup_id='a').refunded_amount, Decimal('20.00'))
+        # zweiter Lauf startet bei der Mark minus Überlappung, nicht wieder beim Backfill
+        self.assertEqual(fake.calls[1][0], state.synced_until - timedelta(days=7))
+
+        # frischer Spiegel → kein API-Call
+        self.assertEqual(ensure_synced(self.now - timedelta(minutes=5), client=fake), 0)
+        self.assertEqual(len(fake.calls), 2)
+
+    def test_live_window_keeps_high_water_mark_for_overlap_sync(self):
+        fake = FakeSumUpClient([self._txn('a', 'TX1', 20.0, 60 * 24 * 3)])
+        sync_transactions(client=fake)
+        mark = SumUpSyncState.load().synced_until
+
+        later = self.now + timedelta(minutes=30)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            sync_recent(later - timedelta(minutes=1), client=fake)
+            self.assertEqual(SumUpSyncState.load().synced_until, mark)
+            # the refund on the three-day-old payment still arrives via the overlap reload
+            fake.txns = [self._txn('a', 'TX1', 20.0, 60 * 24 * 3, refunded_amount=20.0)]
+            ensure_synced(later - timedelta(minutes=5), client=fake)
+        self.assertEqual(fake.calls[-1][0], mark - timedelta(days=7))
+        self.assertEqual(SumUpTransaction.objects.get(sumup_id='a').refunded_amount, Decimal('20.00'))
+
+    def test_refund_sync_reloads_its_whole_window(self):
+        fake = FakeSumUpClient([self._txn('a', 'TX1', 20.0, 60 * 24 * 10, refunded_amount=20.0)])
+        sale = Sale.objects.create(payment_method=Sale.PaymentMethod.SUMUP, transaction_id='TX1',
+                                   total_amount_gross=Decimal('20.00'))
+        SumUpSyncState.objects.update_or_create(pk=1, defaults={'synced_until': self.now})
+        with mock.patch('reconciliation.sync.get_client', return_value=fake):
+            call_command('sync_sumup_refunds', days=14, dry_run=True, stdout=io.StringIO())
+        oldest, _newest = fake.calls[0]
+        self.assertEqual(oldest.date(), (timezone.now() - timedelta(days=14)).date())
+        self.assertIn(sale.transaction_id, SumUpTransaction.objects.values_list('transaction_code', flat=True))
+
+    def test_verify_reads_mirror_and_skips_booked_payments(self):
+        Sale.objects.create(payment_method=Sale.PaymentMethod.SUMUP, transaction_id='TX-BOOKED')
+        upsert_transactions([
+            self._txn('x', 'TX-BOOKED', 42.0, 2),
+            self._txn('y', 'TX-FREE', 42.0, 1, description='Kauf-123'),
+        ])
+        ts_ms = int((self.now - timedelta(minutes=2)).timestamp() * 1000)
+        with mock.patch('reconciliation.sync.get_client', side_effect=SumUpAPIError('offline')):
+            data = self.client.get(reverse('api_verify_sumup'), {'amount': '42.00', 'timestamp': ts_ms}).json()
+        self.assertTrue(data['verified'])
+        self.assertEqual(data['transaction_code'], 'TX-FREE')
+
+    def test_polling_tills_share_one_upstream_call_per_bucket(self):
+        fake = FakeSumUpClient([self._txn('n', 'TX-NEW', 18.5, 1)])
+        ts_ms = int((self.now - timedelta(minutes=1)).timestamp() * 1000)
+        url = reverse('api_verify_sumup')
+        with mock.patch('reconciliation.sync.get_client', return_value=fake), \
+                mock.patch('django.utils.timezone.now', return_value=self.now):
+            for amount in ('18.50', '18.50', '7.00', '18.50'):
+                self.client.get(url, {'amount': amount, 'timestamp': ts_ms})
+            self.assertEqual(len(fake.calls), 1)
+            self.assertTrue(self.client.get(url, {'amount': '18.50', 'timestamp': ts_ms}).json()['verified'])
+
+        later = self.now + timedelta(seconds=3)
+        with mock.patch('reconciliation.sync.get_client', return_value=fake), \
+                mock.patch('django.utils.timezone.now', return_value=later):
+            self.client.get(url, {'amount': '18.50', 'timestamp': ts_ms})
+        self.assertEqual(len(fake.calls), 2)
+
+    def _stream(self, params):
+        # the view closes idle connections between checks; keep the test transaction
+        with mock.patch('commerce.views.close_old_connections'):
+            response = self.client.get(reverse('api_verify_sumup_stream'), params)
+            if not response.streaming:
+                return response, ''
+
+            async def read():
+                return b''.join([chunk async for chunk in response.streaming_content])
+            return response, async_to_sync(read)().decode()
+
+    def test_stream_pushes_payment_from_mirror(self):
+        fake = FakeSumUpClient([self._txn('s', 'TX-STREAM', 12.9, 0, description='Kauf-77')])
+        ts_ms = int(self.now.timestamp() * 1000)
+        with mock.patch('reconciliation.sync.get_client', return_value=fake):
+            response, body = self._stream({'amount': '12.90', 'timestamp': ts_ms})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        event, data = body.split('\n\n')[1].split('\n')
+        self.assertEqual(event, 'event: payment')
+        self.assertEqual(json.loads(data.removeprefix('data: '))['transaction_code'], 'TX-STREAM')
+
+    def test_stream_times_out_and_rejects_bad_params(self):
+        ts_ms = int(self.now.timestamp() * 1000)
+        with override_settings(SUMUP_STREAM_SECONDS=0):
+            _response, body = self._stream({'amount': '12.90', 'timestamp': ts_ms})
+        self.assertIn('event: timeout', body)
+        response, _body = self._stream({'amount': 'zwölf', 'timestamp': ts_ms})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_upstream_call_is_shared_within_bucket(self):
+        fake = FakeSumUpClient([])
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            with mock.patch('reconciliation.sync.get_client', side_effect=SumUpAPIError('offline')):
+                with self.assertRaises(SumUpAPIError):
+                    sync_recent(self.now - timedelta(minutes=5))
+            with mock.patch('reconciliation.sync.get_client', return_value=fake):
+                with self.assertRaises(SumUpAPIError):
+                    sync_recent(self.now - timedelta(minutes=5))
+        self.assertEqual(fake.calls, [])
+
+
+class MatchingTests(TestCase):
+    def setUp(self):
+        self.start = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0)
+        self.payout = SumUpPayout.objects.create(
+            bank_credit_amount=Decimal('0'), bank_credit_date=self.start.date(),
+            period_start=self.start.date(), period_end=self.start.date(),
+        )
+
+    def _sale(self, minutes, amount='4.50'):
+        return Sale.objects.create(date=self.start + timedelta(minutes=minutes),
+                                   total_amount_gross=Decimal(amount), payment_method='SUMUP')
+
+    def _txn(self, code, minutes, amount=4.5):
+        ts = (self.start + timedelta(minutes=minutes)).astimezone(dt_timezone.utc)
+        return {'id': code, 'transaction_code': code, 'amount': amount, 'timestamp': ts.isoformat()}
+
+    def test_repeated_amount_is_assigned_globally(self):
+        late, early = self._sale(2), self._sale(-0.5)
+        # First-fit hands the late sale to T1 and leaves T2 only the early one (2.7 min off)
+        items = run_matching(self.payout, [self._txn('T1', 0.5), self._txn('T2', 2.2)])
+        by_code = {i.sumup_tx_code: i for i in items}
+        self.assertEqual(by_code['T1'].sale, early)
+        self.assertEqual(by_code['T2'].sale, late)
+        self.assertEqual({i.match_tier for i in items}, {ReconciliationItem.MatchTier.AMOUNT_TIME})
+
+    def test_same_day_and_amount_tolerance_fallbacks(self):
+        same_day = self._sale(180)
+        off_by_cent = self._sale(0, amount='12.91')
+        self._sale(0, amount='7.00')
+        items = run_matching(self.payout, [self._txn('T1', 0), self._txn('T2', 1, amount=12.9)])
+        by_code = {i.sumup_tx_code: i for i in items if i.sumup_tx_code}
+        self.assertEqual((by_code['T1'].sale, by_code['T1'].match_tier),
+                         (same_day, ReconciliationItem.MatchTier.AMOUNT_DATE))
+        self.assertEqual((by_code['T2'].sale, by_code['T2'].match_tier),
+                         (off_by_cent, ReconciliationItem.MatchTier.AMOUNT_TIME))
+        self.assertEqual([i.match_status for i in items if not i.sumup_tx_code],
+                         [ReconciliationItem.MatchStatus.ONLY_SK])
+
+    def test_rematch_picks_up_late_sale_and_keeps_resolutions(self):
+        matched_sale, stray_sale = self._sale(0), self._sale(60, amount='7.00')
+        items = run_matching(self.payout, [self._txn('T1', 0), self._txn('T2', 30, amount=12.9)])
+        ReconciliationItem.objects.bulk_create(items)
+        SumUpPayout.objects.filter(pk=self.payout.pk).update(last_matched_at=timezone.now())
+        self.payout.refresh_from_db()
+        matched_row = self.payout.items.get(sumup_tx_code='T1')
+        stray_row = self.payout.items.get(sale=stray_sale)
+        stray_row.resolution = ReconciliationItem.Resolution.IGNORED
+        stray_row.save()
+
+        late_sale = self._sale(30.5, amount='12.90')  # booked after the first run
+        stats = rematch_payout(self.payout)
+
+        self.assertEqual(stats, {'reopened': 1, 'matched_before': 0, 'matched_after': 1, 'sales_added': 1})
+        self.assertEqual(self.payout.items.get(sumup_tx_code='T2').sale, late_sale)
+        self.assertEqual(self.payout.items.get(pk=matched_row.pk).sale, matched_sale)
+        self.assertEqual(self.payout.items.get(pk=stray_row.pk).resolution, ReconciliationItem.Resolution.IGNORED)
+        self.assertEqual(self.payout.booking_summary['only_sumup_count'], 0)
+
+        # nothing changed since -> only the still-open discrepancies are looked at again
+        self.assertEqual(rematch_payout(self.payout)['reopened'], 0)
+
+    def test_channels_are_classified_in_one_query(self):
+        vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        coffee, lingerie = Category.objects.create(name='Café & Kuchen'), Category.objects.create(name='Still-BHs')
+        espresso, bra = (Product.objects.create(name=n, category=c, sales_price=Decimal('4.50'),
+                                                cost_price=Decimal('1.00'), stock_quantity=10, vat=vat)
+                         for n, c in (('Espresso', coffee), ('BH', lingerie)))
+        cafe_sale, shop_sale, bare_sale = self._sale(0), self._sale(10), self._sale(20)
+        SaleItem.objects.bulk_create([
+            SaleItem(sale=cafe_sale, product=espresso, quantity=1),
+            SaleItem(sale=cafe_sale, product=espresso, quantity=1),
+            SaleItem(sale=cafe_sale, product=bra, quantity=1),
+            SaleItem(sale=shop_sale, product=bra, quantity=1),
+            SaleItem(sale=shop_sale, product=espresso, quantity=1),
+        ])
+
+        with CaptureQueriesContext(connection) as ctx:
+            channels = classify_channels(Sale.objects.all())
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(channels, {cafe_sale.id: ReconciliationItem.Channel.CAFE,
+                                    shop_sale.id: ReconciliationItem.Channel.LADEN})
+
+        items = run_matching(self.payout, [])
+        self.assertEqual({i.sale_id: i.channel for i in items}, {
+            cafe_sale.id: ReconciliationItem.Channel.CAFE,
+            shop_sale.id: ReconciliationItem.Channel.LADEN,
+            bare_sale.id: ReconciliationItem.Channel.UNKNOWN,
+        })
+
+
+class BookingSummaryTests(TestCase):
+    def setUp(self):
+        self.payout = SumUpPayout.objects.create(bank_credit_amount=Decimal('60.00'),
+                                                 bank_credit_date=timezone.now().date())
+        ReconciliationItem.objects.bulk_create([
+            ReconciliationItem(payout=self.payout, match_status='MATCHED', channel='LADEN',
+                               sumup_amount=Decimal('50.00'), sumup_fee=Decimal('1.00')),
+            ReconciliationItem(payout=self.payout, match_status='MATCHED', channel='CAFE',
+                               sumup_amount=Decimal('12.00'), sumup_fee=Decimal('0.25'),
+                               sumup_refund_deduction=Decimal('0.75')),
+            ReconciliationItem(payout=self.payout, match_status='ONLY_SUMUP', channel='UNKNOWN',
+                               sumup_amount=Decimal('4.50'), sumup_fee=Decimal('0.10')),
+            ReconciliationItem(payout=self.payout, match_status='ONLY_SK', channel='LADEN',
+                               sk_amount=Decimal('9.90')),
+        ])
+
+    def _figures(self, summary):
+        return {k: v for k, v in summary.items() if k != 'deduction_lines'}
+
+    def test_summary_is_aggregated_once_and_read_without_items(self):
+        summary = self.payout.booking_summary
+        self.assertEqual(summary['laden_total'], Decimal('50.00'))
+        self.assertEqual(summary['cafe_total'], Decimal('12.00'))
+        self.assertEqual(summary['total_fees'], Decimal('1.35'))
+        self.assertEqual(summary['net_delta'], Decimal('-0.10'))
+        self.assertEqual((summary['matched_count'], summary['only_sumup_count'], summary['only_sk_count']), (2, 1, 1))
+        self.assertEqual(summary['total_matched'], Decimal('62.00'))
+        self.assertTrue(summary['has_open_items'])
+
+        payout = SumUpPayout.objects.get(pk=self.payout.pk)
+        self.assertTrue(payout.summary_built)
+        with CaptureQueriesContext(connection) as ctx:
+            payout.booking_summary
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('reconciliation_reconciliationitem', ctx.captured_queries[0]['sql'])
+
+    def test_item_changes_update_summary_incrementally(self):
+        self.payout.rebuild_summary()
+        item = self.payout.items.get(match_status='ONLY_SUMUP')
+        item.match_status, item.channel, item.sk_amount = 'MATCHED', 'CAFE', Decimal('4.50')
+        item.save()
+        self.payout.items.get(match_status='ONLY_SK').delete()
+
+        incremental = self._figures(SumUpPayout.objects.get(pk=self.payout.pk).booking_summary)
+        self.payout.rebuild_summary()
+        self.assertEqual(incremental, self._figures(self.payout.booking_summary))
+        self.assertEqual(incremental['cafe_total'], Decimal('16.50'))
+        self.assertFalse(incremental['has_open_items'])
+
+
+class ReconciliationItemsEndpointTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user('buha', password='x', is_staff=True))
+        self.payout = SumUpPayout.objects.create(bank_credit_amount=Decimal('0'),
+                                                 bank_credit_date=timezone.now().date())
+        start = timezone.now().replace(microsecond=0)
+        ReconciliationItem.objects.bulk_create([
+            ReconciliationItem(payout=self.payout, match_status='MATCHED' if n % 3 else 'ONLY_SUMUP',
+                               channel='CAFE' if n % 2 else 'LADEN', sumup_amount=Decimal(n),
+                               sumup_timestamp=start + timedelta(minutes=n % 5))
+            for n in range(1, 21)
+        ])
+        self.url = reverse('reconciliation:items', args=[self.payout.pk])
+
+    def test_keyset_pages_cover_all_rows_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 6, **({'after': cursor} if cursor else {})}
+            data = self.client.get(self.url, params).json()
+            seen += [row['pk'] for row in data['items']]
+            cursor = data['next']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(self.payout.items.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_filters(self):
+        data = self.client.get(self.url, {'match_status': 'ONLY_SUMUP', 'channel': 'LADEN',
+                                          'min_amount': '5', 'max_amount': '15'}).json()
+        self.assertEqual(sorted(Decimal(r['sumup_amount']) for r in data['items']), [Decimal('6'), Decimal('12')])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(self.url, {'min_amount': 'viel'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': '-5'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': '0'}).status_code, 400)
+
+    def test_review_page_does_not_render_rows(self):
+        response = self.client.get(reverse('reconciliation:review', args=[self.payout.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('item-row-%d' % self.payout.items.first().pk, response.content.decode())
+
+
+class ResolveItemsBulkTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user('buha', password='x', is_staff=True))
+        vat = Vat.objects.create(name='Normal', rate=Decimal('8.10'), is_default=True)
+        self.product = Product.objects.create(name='Espresso', category=Category.objects.create(name='Café'),
+                                              sales_price=Decimal('4.50'), cost_price=Decimal('1.00'),
+                                              stock_quantity=10, vat=vat)
+        self.payout = SumUpPayout.objects.create(bank_credit_amount=Decimal('0'),
+                                                 bank_credit_date=timezone.now().date())
+        self.url = reverse('reconciliation:resolve_items_bulk', args=[self.payout.pk])
+
+    def _post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def _only_sk(self, n):
+        items = []
+        for _ in range(n):
+            sale = Sale.objects.create(payment_method=Sale.PaymentMethod.SUMUP, total_amount_gross=Decimal('9.00'))
+            sale.add_items([SaleItem(product=self.product, quantity=2)])
+            items.append(ReconciliationItem.objects.create(payout=self.payout, sale=sale, match_status='ONLY_SK',
+                                                           sk_amount=Decimal('9.00')))
+        return items
+
+    def test_rule_accepts_small_gaps_only(self):
+        small, large = (ReconciliationItem.objects.create(payout=self.payout, match_status='GAP', gap_amount=g)
+                        for g in (Decimal('0.03'), Decimal('0.40')))
+        data = self._post({'resolution': 'ACCEPTED', 'rule': {'match_status': 'GAP', 'max_gap_amount': '0.05'}}).json()
+        self.assertEqual(data['item_ids'], [small.pk])
+        small.refresh_from_db(), large.refresh_from_db()
+        self.assertEqual((small.resolution, large.resolution), ('ACCEPTED', 'PENDING'))
+
+    def test_bulk_storno_refunds_sales_in_batched_queries(self):
+        items = self._only_sk(3)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 4)
+
+        with CaptureQueriesContext(connection) as ctx:
+            data = self._post({'resolution': 'SALE_DELETED', 'item_ids': [i.pk for i in items]}).json()
+        self.assertEqual(data['refunded_sales'], 3)
+        queries = len(ctx.captured_queries)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 10)
+        returns = StockMovement.objects.filter(movement_type=StockMovement.Type.RETURN)
+        self.assertEqual(sorted(returns.values_list('object_id', flat=True)), sorted(i.sale_id for i in items))
+        self.assertEqual(ReconciliationItem.objects.get(pk=items[0].pk).resolution_note,
+                         f"Storniert via Reconciliation (Sale #{items[0].sale_id})")
+
+        # query count does not grow with the number of rows
+        more = self._only_sk(6)
+        with CaptureQueriesContext(connection) as ctx:
+            self._post({'resolution': 'SALE_DELETED', 'item_ids': [i.pk for i in more]})
+        self.assertEqual(len(ctx.captured_queries), queries)
+        # already resolved rows are skipped
+        self.assertEqual(self._post({'resolution': 'SALE_DELETED', 'item_ids': [items[0].pk]}).json()['item_ids'], [])
+
+    def test_rejects_invalid_payload(self):
+        self.assertEqual(self._post({'resolution': 'SALE_ADDED', 'item_ids': []}).status_code, 400)
+        self.assertEqual(self._post({'resolution': 'ACCEPTED'}).status_code, 400)
+        self.assertEqual(self._post({'resolution': 'PAYMENT_TYPE_CHANGED', 'item_ids': [],
+                                     'new_payment_method': 'GOLD'}).status_code, 400)
+
+
+class SumUpBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.server = serve(Dataset(per_month=20, months=1, seed=5), background=True)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.settings_override = override_settings(
+            SUMUP_API_KEY='standin', SUMUP_HTTP_RETRIES=0, SUMUP_BREAKER_THRESHOLD=3,
+            SUMUP_BREAKER_RESET_SECONDS=30, SUMUP_RATE_PER_SECOND=10_000, SUMUP_RATE_BURST=10_000,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.up = f"http://127.0.0.1:{self.server.server_port}"
+
+    def test_opens_after_repeated_failures_and_recovers_via_probe(self):
+        client = SumUpClient()
+        with override_settings(SUMUP_API_BASE='http://127.0.0.1:9'):  # nothing listens here
+            for _ in range(3):
+                with self.assertRaises(SumUpAPIError):
+                    client.get_payouts_for_date(timezone.now().date())
+            self.assertEqual(sumup_breaker.state()['state'], 'open')
+            with mock.patch.object(client.session, 'get') as http:
+                with self.assertRaises(SumUpUnavailable):
+                    client.get_payouts_for_date(timezone.now().date())
+            http.assert_not_called()
+
+        later = time.time() + 31
+        with override_settings(SUMUP_API_BASE=self.up), mock.patch('reconciliation.breaker.time.time', return_value=later):
+            self.assertEqual(sumup_breaker.state()['state'], 'half_open')
+            client.get_payouts_for_date(timezone.now().date())  # the probe succeeds
+        state = sumup_breaker.state()
+        self.assertEqual((state['state'], state['failures']), ('closed', 0))
+        stats = {row['endpoint']: row for row in latency_stats()}
+        self.assertEqual((stats['payouts']['count'], stats['payouts']['errors']), (4, 3))
+
+    def test_client_errors_do_not_trip_the_breaker(self):
+        with override_settings(SUMUP_API_BASE=self.up):
+            for _ in range(4):
+                with self.assertRaises(SumUpAPIError):
+                    SumUpClient()._get('/v0.1/me/transactions', params={'transaction_code': 'UNKNOWN'})
+        self.assertEqual(sumup_breaker.state()['state'], 'closed')
+
+    def _unavailable(self, retry_after=None):
+        resp = requests.Response()
+        resp.status_code, resp.url = 503, f"{self.up}/v0.1/me/financials/payouts"
+        if retry_after:
+            resp.headers['Retry-After'] = retry_after
+        return resp
+
+    @override_settings(SUMUP_HTTP_RETRIES=4, SUMUP_CALL_DEADLINES={'payouts': 2})
+    def test_retries_stay_within_call_deadline(self):
+        client = SumUpClient()
+        with mock.patch.object(client.session, 'get', return_value=self._unavailable('30')) as http, \
+                mock.patch('reconciliation.sumup_client.time_mod.sleep') as sleep:
+            with self.assertRaises(SumUpAPIError):
+                client._get('/v0.1/me/financials/payouts')
+        # Retry-After does not fit into the deadline: give up instead of waiting
+        self.assertEqual(http.call_count, 1)
+        sleep.assert_not_called()
+
+        clock = [time.monotonic()]
+        with mock.patch.object(client.session, 'get', return_value=self._unavailable()) as http, \
+                mock.patch('reconciliation.sumup_client.time_mod.monotonic', side_effect=lambda: clock[0]), \
+                mock.patch('reconciliation.sumup_client.time_mod.sleep',
+                           side_effect=lambda s: clock.__setitem__(0, clock[0] + s)) as sleep:
+            with self.assertRaises(SumUpAPIError):
+                client._get('/v0.1/me/financials/payouts')
+        # backoff keeps retrying only while a further attempt still fits into the 2 s
+        self.assertLess(http.call_count, 5)
+        self.assertLessEqual(sum(c.args[0] for c in sleep.call_args_list), 2)
+        self.assertTrue(all(c.kwargs['timeout'][1] <= 2 for c in http.call_args_list))
+
+    @override_settings(SUMUP_HTTP_RETRIES=4, SUMUP_CALL_DEADLINES={'payouts': 2})
+    def test_async_client_honours_deadline_and_breaker(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503, headers={'Retry-After': '30'})
+
+        async def fetch():
+            async with AsyncSumUpClient() as api:
+                await api.http.aclose()
+                api.http = httpx.AsyncClient(base_url=self.up, transport=httpx.MockTransport(handler))
+                await api.payouts(timezone.now().date(), timezone.now().date())
+
+        started = time.perf_counter()
+        with override_settings(SUMUP_API_BASE=self.up):
+            with self.assertRaises(SumUpAPIError):
+                async_to_sync(fetch)()
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sumup_breaker.state()['failures'], 1)
+
+    def test_pos_verify_fails_fast_while_open(self):
+        for _ in range(3):
+            sumup_breaker.record('history', 15.0, 'ReadTimeout')
+        self.client.force_login(get_user_model().objects.create_user('kasse', password='x', is_staff=True))
+        ts_ms = int(timezone.now().timestamp() * 1000)
+        started = time.perf_counter()
+        data = self.client.get(reverse('api_verify_sumup'), {'amount': '10.00', 'timestamp': ts_ms}).json()
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertFalse(data['verified'])
+        self.assertTrue(data['sumup_unavailable'])
+
+        status = self.client.get(reverse('reconciliation:sumup_status'), {'format': 'json'}).json()
+        self.assertEqual(status['breaker']['state'], 'open')
+        self.assertEqual(self.client.get(reverse('reconciliation:sumup_status')).status_code, 200)
+        self.client.post(reverse('reconciliation:sumup_status'), {'reset': '1'})
+        self.assertEqual(sumup_breaker.state()['state'], 'closed')
+
+
+class StandinReconciliationTests(TestCase):
+    def setUp(self):
+        self.dataset = Dataset(per_month=40, months=3, seed=3,
+                               end=datetime(2025, 4, 10, 12, tzinfo=dt_timezone.utc))
+        self.server = serve(self.dataset, background=True)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.settings_override = override_settings(
+            SUMUP_API_BASE=f"http://127.0.0.1:{self.server.server_port}", SUMUP_API_KEY='standin',
+            SUMUP_RATE_PER_SECOND=10_000, SUMUP_RATE_BURST=10_000,
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_start_view_fetches_and_matches_payout(self):
+        self.client.force_login(get_user_model().objects.create_user('buha', password='x', is_staff=True))
+        credit_date, amount = self.dataset.payout_credits()[0]
+        response = self.client.post(reverse('reconciliation:start'),
+                                    {'bank_credit_amount': str(amount), 'bank_credit_date': credit_date})
+        payout = SumUpPayout.objects.get()
+        self.assertRedirects(response, reverse('reconciliation:review', args=[payout.pk]), fetch_redirect_response=False)
+        self.assertEqual(payout.status, SumUpPayout.Status.IN_REVIEW)
+        self.assertEqual(payout.sumup_net_amount, amount)
+        self.assertEqual(payout.items.count(), len(self.dataset.payouts_by_date[credit_date]))
+
+    def test_reconciles_every_payout_in_range_once(self):
+        payment = next(t for t in self.dataset.transactions
+                       if t['type'] == 'PAYMENT' and t['timestamp'] < '2025-03-01' and not t['refunded_amount'])
+        sale = Sale.objects.create(payment_method=Sale.PaymentMethod.SUMUP, status=Sale.Status.COMPLETED,
+                                   total_amount_gross=Decimal(str(payment['amount'])),
+                                   transaction_id=payment['transaction_code'])
+        Sale.objects.filter(pk=sale.pk).update(date=datetime.fromisoformat(payment['timestamp'].replace('Z', '+00:00')))
+
+        out = io.StringIO()
+        call_command('reconcile_payouts', date_from='2025-03-01', date_to='2025-04-30', workers=1, stdout=out)
+
+        payouts = SumUpPayout.objects.order_by('bank_credit_date')
+        self.assertEqual([p.sumup_payout_id for p in payouts], ['2025-03-03', '2025-04-03'])
+        for payout in payouts:
+            codes = {p['transaction_code'] for p in self.dataset.payouts_by_date[payout.sumup_payout_id]}
+            self.assertEqual(payout.status, SumUpPayout.Status.IN_REVIEW)
+            self.assertTrue(payout.summary_built)
+            self.assertLessEqual(codes, set(payout.items.values_list('sumup_tx_code', flat=True)))
+        self.assertEqual(ReconciliationItem.objects.get(sale=sale).match_status, 'MATCHED')
+        self.assertIn('2 Auszahlung(en)', out.getvalue())
+
+        # a second run skips what is already reconciled
+        items = ReconciliationItem.objects.count()
+        out = io.StringIO()
+        call_command('reconcile_payouts', date_from='2025-03-01', date_to='2025-04-30', workers=1, stdout=out)
+        self.assertEqual((SumUpPayout.objects.count(), ReconciliationItem.objects.count()), (2, items))
+        self.assertIn('Keine neuen Auszahlungen', out.getvalue())
+
+    def test_rerun_picks_up_draft_heads_left_by_an_aborted_run(self):
+        with mock.patch('reconciliation.management.commands.reconcile_payouts.Command._run_pool',
+                        side_effect=RuntimeError('abgebrochen')):
+            with self.assertRaises(RuntimeError):
+                call_command('reconcile_payouts', date_from='2025-03-01', date_to='2025-04-30', workers=1,
+                             stdout=io.StringIO())
+        drafts = set(SumUpPayout.objects.values_list('pk', flat=True))
+        self.assertEqual(SumUpPayout.objects.filter(status=SumUpPayout.Status.DRAFT).count(), 2)
+
+        call_command('reconcile_payouts', date_from='2025-03-01', date_to='2025-04-30', workers=1,
+                     stdout=io.StringIO())
+        payouts = SumUpPayout.objects.all()
+        self.assertEqual(set(payouts.values_list('pk', flat=True)), drafts)
+        self.assertEqual({p.status for p in payouts}, {SumUpPayout.Status.IN_REVIEW})
+        self.assertTrue(all(p.items.exists() for p in payouts))
@@ -6,9 +6,13 @@ app_name = 'reconciliation'
 urlpatterns = [
     path('', views.reconciliation_list, name='list'),
     path('new/', views.reconciliation_start, name='start'),
+    path('status/', views.sumup_status, name='sumup_status'),
     path('<int:pk>/review/', views.reconciliation_review, name='review'),
+    path('<int:pk>/items/', views.reconciliation_items, name='items'),
+    path('<int:pk>/rematch/', views.reconciliation_rematch, name='rematch'),
     path('<int:pk>/complete/', views.reconciliation_complete, name='complete'),
     path('<int:pk>/pdf/', views.reconciliation_pdf, name='pdf'),
+    path('<int:pk>/items/resolve/', views.resolve_items_bulk, name='resolve_items_bulk'),
     path('<int:pk>/item/<int:item_pk>/resolve/', views.resolve_item, name='resolve_item'),
     path('<int:pk>/item/<int:item_pk>/create-sale/', views.create_sale_for_item, name='create_sale_for_item'),
 ]
@@ -1,18 +1,27 @@
+import json
 import logging
-from decimal import Decimal
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
 from django.contrib import admin, messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db import transaction
+from django.db.models import CharField, Q, Value
+from django.db.models.functions import Cast, Coalesce, Concat
 from django.utils import timezone
 
 from commerce.models import Sale, SaleItem
 from core.models import Product
-from .models import SumUpPayout, ReconciliationItem
+from .breaker import latency_stats, sumup_breaker
+from .models import SumUpPayout, ReconciliationItem, SumUpSyncState
 from .forms import PayoutStartForm
-from .sumup_client import SumUpClient, SumUpAPIError
-from .matching import run_matching, detect_channel
+from .sumup_client import SumUpAPIError, payout_fee_maps
+from .sumup_async import afetch_payout_bundle
+from .matching import detect_channel, rematch_payout, run_matching
+from .sync import payout_transactions
 from .pdf import generate_voucher_pdf
 
 logger = logging.getLogger(__name__)
@@ -30,14 +39,21 @@ def reconciliation_list(request):
 
 
 @staff_member_required
-def reconciliation_start(request):
+async def reconciliation_start(request):
+    """
+    Async View: Der SumUp-Fetch läuft im Event-Loop (sumup_async), DB-Arbeit
+    über sync_to_async — eine langsame API hält keinen Worker-Thread fest.
+    """
     if request.method == 'POST':
         form = PayoutStartForm(request.POST)
         if form.is_valid():
-            return _process_payout(request, form)
+            return await _process_payout(request, form)
     else:
         form = PayoutStartForm()
+    return await sync_to_async(_render_start_form)(request, form)
+
 
+def _render_start_form(request, form):
     context = admin.site.each_context(request)
     context.update({
         'title': 'Neuer SumUp Abgleich',
@@ -46,34 +62,51 @@ def reconciliation_start(request):
     return render(request, 'reconciliation/start_form.html', context)
 
 
-@transaction.atomic
-def _process_payout(request, form):
-    """Erstellt Payout, ruft SumUp API auf, führt Matching durch."""
-    payout = SumUpPayout(
-        bank_credit_amount=form.cleaned_data['bank_credit_amount'],
-        bank_credit_date=form.cleaned_data['bank_credit_date'],
-        created_by=request.user,
-        status=SumUpPayout.Status.DRAFT,
-    )
-    payout.save()
+async def _process_payout(request, form):
+    """Lädt Payouts + Transaktionen (parallel), legt den Payout an, führt Matching durch."""
+    amount = form.cleaned_data['bank_credit_amount']
+    credit_date = form.cleaned_data['bank_credit_date']
 
+    # HTTP ausserhalb der DB-Transaktion: Payouts, Historie und fehlende
+    # Einzeldetails laufen gleichzeitig (sumup_async) und landen im Spiegel.
     try:
-        client = SumUpClient()
+        bundle = await afetch_payout_bundle(amount, credit_date)
+    except SumUpAPIError as e:
+        logger.error(f"SumUp API Fehler: {e}")
+        messages.error(request, f"SumUp API Fehler: {e}")
+        return redirect('reconciliation:start')
 
-        # Alle Payouts für dieses Gutschriftsdatum finden
-        sumup_payouts = client.find_payouts_for_credit(
-            payout.bank_credit_amount,
-            payout.bank_credit_date
+    # Alle Payouts für dieses Gutschriftsdatum
+    sumup_payouts = bundle.payouts
+    if not sumup_payouts:
+        messages.warning(
+            request,
+            f"Kein passendes SumUp-Auszahlungsdatum für CHF {amount} "
+            f"um {credit_date} gefunden. Bitte Betrag und Datum prüfen."
         )
+        return redirect('reconciliation:start')
+
+    user = await request.auser()
+    payout, items = await sync_to_async(_create_payout)(user, amount, credit_date, sumup_payouts)
+    if items is None:
+        messages.warning(request, "Periode konnte nicht ermittelt werden.")
+        return redirect('reconciliation:review', pk=payout.pk)
+
+    matched = sum(1 for i in items if i.match_status == 'MATCHED')
+    total = len(items)
+    messages.success(request, f"Abgleich erstellt: {matched}/{total} Transaktionen gematched.")
+    return redirect('reconciliation:review', pk=payout.pk)
 
-        if not sumup_payouts:
-            messages.warning(
-                request,
-                f"Kein passendes SumUp-Auszahlungsdatum für CHF {payout.bank_credit_amount} "
-                f"um {payout.bank_credit_date} gefunden. Bitte Betrag und Datum prüfen."
-            )
-            payout.delete()
-            return redirect('reconciliation:start')
+
+def _create_payout(user, amount, credit_date, sumup_payouts):
+    """DB-Teil von _process_payout in einer Transaktion. items=None: Periode nicht ermittelbar."""
+    with transaction.atomic():
+        payout = SumUpPayout(
+            bank_credit_amount=amount,
+            bank_credit_date=credit_date,
+            created_by=user,
+            status=SumUpPayout.Status.DRAFT,
+        )
 
         # Beträge aggregieren
         total_net = sum(Decimal(str(p.get('amount', 0))) for p in sumup_payouts)
@@ -83,58 +116,68 @@ def _process_payout(request, form):
         payout.sumup_gross_amount = total_net + total_fees
         payout.sumup_payout_id = sumup_payouts[0].get('date', '')
 
-        # Gebühren-Mapping: transaction_code → fee
-        payout_fees = {
-            p['transaction_code']: Decimal(str(p.get('fee', 0)))
-            for p in sumup_payouts
-        }
-        # Tatsächlich abgerechneter Bruttobetrag pro Transaktion (Netto + Gebühr).
-        # Weicht von txn.amount ab, wenn eine Teilrückerstattung abgezogen wurde.
-        payout_settled = {
-            p['transaction_code']: (
-                Decimal(str(p.get('amount', 0))) + Decimal(str(p.get('fee', 0)))
-            )
-            for p in sumup_payouts
-        }
+        # Gebühren und abgerechneter Bruttobetrag pro transaction_code
+        payout_fees, payout_settled = payout_fee_maps(sumup_payouts)
 
-        # Transaktionen laden und Periode ermitteln
-        transactions, period_start, period_end = client.get_payout_transactions(sumup_payouts)
+        # Transaktionen aus dem lokalen Spiegel, Periode ermitteln
+        transactions, period_start, period_end = payout_transactions(sumup_payouts, prefetched=True)
         payout.period_start = period_start
         payout.period_end = period_end
         payout.save()
 
         if not period_start or not period_end:
-            messages.warning(request, "Periode konnte nicht ermittelt werden.")
-            return redirect('reconciliation:review', pk=payout.pk)
+            return payout, None
 
         # Matching durchführen
+        payout.last_matched_at = timezone.now()
         items = run_matching(
             payout, transactions,
             payout_fees=payout_fees,
             payout_settled=payout_settled,
         )
         ReconciliationItem.objects.bulk_create(items)
+        payout.rebuild_summary()
 
         payout.status = SumUpPayout.Status.IN_REVIEW
         payout.save()
+    return payout, items
 
-        matched = sum(1 for i in items if i.match_status == 'MATCHED')
-        total = len(items)
-        messages.success(request, f"Abgleich erstellt: {matched}/{total} Transaktionen gematched.")
 
-    except SumUpAPIError as e:
-        logger.error(f"SumUp API Fehler: {e}")
-        messages.error(request, f"SumUp API Fehler: {e}")
-        payout.delete()
-        return redirect('reconciliation:start')
-
-    return redirect('reconciliation:review', pk=payout.pk)
+@staff_member_required
+def sumup_status(request):
+    """Interne Statusseite: Circuit Breaker, Upstream-Latenzen, Stand des Spiegels."""
+    if request.method == 'POST' and request.POST.get('reset'):
+        sumup_breaker.reset()
+        logger.info("sumup_breaker.reset user=%s", request.user.id)
+        messages.success(request, "Circuit Breaker zurückgesetzt.")
+        return redirect('reconciliation:sumup_status')
+
+    breaker = sumup_breaker.state()
+    latencies = latency_stats()
+    sync_state = SumUpSyncState.load()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'breaker': breaker,
+            'latency_ms': latencies,
+            'synced_until': sync_state.synced_until.isoformat() if sync_state.synced_until else None,
+        })
+
+    if breaker['open_until']:
+        breaker['open_until_at'] = datetime.fromtimestamp(breaker['open_until'], tz=dt_timezone.utc)
+    context = admin.site.each_context(request)
+    context.update({
+        'title': 'SumUp-Status',
+        'breaker': breaker,
+        'latencies': latencies,
+        'sync_state': sync_state,
+    })
+    return render(request, 'reconciliation/sumup_status.html', context)
 
 
 @staff_member_required
 def reconciliation_review(request, pk):
+    """Kopf mit Summen; die Zeilen lädt das Template seitenweise über reconciliation_items."""
     payout = get_object_or_404(SumUpPayout, pk=pk)
-    items = payout.items.select_related('sale__created_by').all()
 
     summary = payout.booking_summary
 
@@ -142,12 +185,80 @@ def reconciliation_review(request, pk):
     context.update({
         'title': f'Abgleich: {payout}',
         'payout': payout,
-        'items': items,
     })
     context.update(summary)
     return render(request, 'reconciliation/review.html', context)
 
 
+ITEMS_PAGE_SIZE = 100
+ITEMS_PAGE_MAX = 500
+# Sortschlüssel für Zeilen ohne Zeitstempel (hält die Keyset-Ordnung total)
+_NO_TIMESTAMP = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _item_row(item):
+    ts = item.sort_ts if item.sort_ts != _NO_TIMESTAMP else None
+    sale = item.sale
+    created_by = sale.created_by if sale else None
+    return {
+        'pk': item.pk,
+        'timestamp': timezone.localtime(ts).strftime('%d.%m.%Y %H:%M') if ts else None,
+        'sale_id': item.sale_id,
+        'created_by': (created_by.get_full_name() or created_by.username) if created_by else None,
+        'sk_amount': str(item.sk_amount) if item.sk_amount is not None else None,
+        'sumup_amount': str(item.sumup_amount) if item.sumup_amount is not None else None,
+        'sumup_fee': str(item.sumup_fee) if item.sumup_fee is not None else None,
+        'match_tier': item.match_tier,
+        'match_status': item.match_status,
+        'channel': item.channel,
+        'resolution': item.resolution,
+        'resolution_display': item.get_resolution_display(),
+    }
+
+
+@staff_member_required
+def reconciliation_items(request, pk):
+    """
+    JSON-Zeilen eines Abgleichs, Keyset-paginiert nach (Zeitstempel, ID).
+
+    Filter (kommagetrennt): match_status, resolution, channel; Betrag:
+    min_amount/max_amount auf SumUp- bzw. SK-Betrag. Paginierung: `after`
+    aus `next` der vorherigen Seite, `limit` (1–500).
+    """
+    payout = get_object_or_404(SumUpPayout, pk=pk)
+    items = payout.items.select_related('sale__created_by').annotate(
+        sort_ts=Coalesce('sumup_timestamp', 'sk_timestamp', Value(_NO_TIMESTAMP)),
+        amount=Coalesce('sumup_amount', 'sk_amount'),
+    )
+
+    for field in ('match_status', 'resolution', 'channel'):
+        values = [v for v in request.GET.get(field, '').split(',') if v]
+        if values:
+            items = items.filter(**{f'{field}__in': values})
+    try:
+        if request.GET.get('min_amount'):
+            items = items.filter(amount__gte=Decimal(request.GET['min_amount']))
+        if request.GET.get('max_amount'):
+            items = items.filter(amount__lte=Decimal(request.GET['max_amount']))
+        limit = min(int(request.GET.get('limit', ITEMS_PAGE_SIZE)), ITEMS_PAGE_MAX)
+        if limit < 1:
+            raise ValueError(limit)
+        after = request.GET.get('after')
+        if after:
+            after_ts, after_pk = after.rsplit('_', 1)
+            after_ts, after_pk = datetime.fromisoformat(after_ts), int(after_pk)
+            items = items.filter(Q(sort_ts__gt=after_ts) | Q(sort_ts=after_ts, pk__gt=after_pk))
+    except (InvalidOperation, ValueError):
+        return JsonResponse({'error': 'Ungültiger Filter oder Cursor'}, status=400)
+
+    page = list(items.order_by('sort_ts', 'pk')[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = f"{page[-1].sort_ts.isoformat()}_{page[-1].pk}"
+    return JsonResponse({'items': [_item_row(i) for i in page], 'next': next_cursor})
+
+
 @staff_member_required
 def resolve_item(request, pk, item_pk):
     """AJAX-Endpunkt: Diskrepanz auflösen."""
@@ -171,8 +282,8 @@ def resolve_item(request, pk, item_pk):
     if resolution == 'PAYMENT_TYPE_CHANGED' and item.sale:
         new_method = request.POST.get('new_payment_method', '')
         if new_method:
+            Sale.objects.filter(pk=item.sale.pk).set_payment_method(new_method)
             item.sale.payment_method = new_method
-            item.sale.save()
 
     # Bei Sale-Löschung: Sale stornieren (Refund = Ware zurückbuchen)
     if resolution == 'SALE_DELETED' and item.sale:
@@ -183,6 +294,88 @@ def resolve_item(request, pk, item_pk):
     return JsonResponse({'status': 'ok', 'resolution': item.get_resolution_display()})
 
 
+BULK_RESOLUTIONS = set(ReconciliationItem.Resolution.values) - {
+    ReconciliationItem.Resolution.PENDING, ReconciliationItem.Resolution.SALE_ADDED,
+}
+
+
+@staff_member_required
+def resolve_items_bulk(request, pk):
+    """
+    AJAX-Endpunkt: viele offene Zeilen in einer Transaktion auflösen.
+
+    JSON: {"resolution": "...", "item_ids": [...]} oder statt item_ids eine
+    Regel {"rule": {"match_status": "GAP", "channel": "CAFE", "max_gap_amount": "0.05"}}
+    (gap_amount < max_gap_amount). Optional new_payment_method (bei
+    PAYMENT_TYPE_CHANGED) und resolution_note. Betroffen sind nur Zeilen mit
+    Resolution PENDING; Zahlungsart-Korrektur und Stornos laufen gesammelt.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+
+    payout = get_object_or_404(SumUpPayout, pk=pk)
+    try:
+        data = json.loads(request.body)
+        resolution = data.get('resolution', '')
+        note = data.get('resolution_note', '') or ''
+        items = payout.items.filter(resolution=ReconciliationItem.Resolution.PENDING)
+        if data.get('item_ids') is not None:
+            items = items.filter(pk__in=[int(i) for i in data['item_ids']])
+        elif data.get('rule'):
+            rule = data['rule']
+            if rule.get('match_status'):
+                items = items.filter(match_status=rule['match_status'])
+            if rule.get('channel'):
+                items = items.filter(channel=rule['channel'])
+            if rule.get('max_gap_amount') not in (None, ''):
+                items = items.filter(gap_amount__lt=Decimal(str(rule['max_gap_amount'])))
+        else:
+            return JsonResponse({'error': 'item_ids oder rule erforderlich'}, status=400)
+    except (ValueError, TypeError, AttributeError, InvalidOperation):
+        return JsonResponse({'error': 'Ungültiger Payload'}, status=400)
+
+    if resolution not in BULK_RESOLUTIONS:
+        return JsonResponse({'error': 'Ungültige Resolution'}, status=400)
+    new_method = data.get('new_payment_method', '')
+    if resolution == 'PAYMENT_TYPE_CHANGED' and new_method and new_method not in Sale.PaymentMethod.values:
+        return JsonResponse({'error': 'Ungültige Zahlungsart'}, status=400)
+
+    with transaction.atomic():
+        rows = list(items.select_for_update().values_list('pk', 'sale_id'))
+        item_ids = [item_id for item_id, _ in rows]
+        sale_ids = [sale_id for _, sale_id in rows if sale_id]
+        refunded = 0
+
+        if resolution == 'PAYMENT_TYPE_CHANGED' and new_method and sale_ids:
+            Sale.objects.filter(pk__in=sale_ids).set_payment_method(new_method)
+        if resolution == 'SALE_DELETED' and sale_ids:
+            refunded = len(Sale.objects.filter(pk__in=sale_ids).bulk_refund(user=request.user))
+
+        # Resolution fliesst nicht in booking_summary ein — Summenzeilen bleiben gültig
+        updated = ReconciliationItem.objects.filter(pk__in=item_ids)
+        if resolution == 'SALE_DELETED':
+            updated.filter(sale__isnull=False).update(
+                resolution=resolution, resolved_at=timezone.now(),
+                resolution_note=Concat(
+                    Value('Storniert via Reconciliation (Sale #'), Cast('sale_id', CharField()), Value(')'),
+                ),
+            )
+            updated.filter(sale__isnull=True).update(
+                resolution=resolution, resolution_note=note, resolved_at=timezone.now(),
+            )
+        else:
+            updated.update(resolution=resolution, resolution_note=note, resolved_at=timezone.now())
+
+    logger.info("reconciliation.bulk_resolve payout=%s resolution=%s items=%d refunded=%d",
+                payout.pk, resolution, len(item_ids), refunded)
+    return JsonResponse({
+        'status': 'ok',
+        'resolution': ReconciliationItem.Resolution(resolution).label,
+        'item_ids': item_ids,
+        'refunded_sales': refunded,
+    })
+
+
 @staff_member_required
 @transaction.atomic
 def create_sale_for_item(request, pk, item_pk):
@@ -275,6 +468,29 @@ def create_sale_for_item(request, pk, item_pk):
     })
 
 
+@staff_member_required
+def reconciliation_rematch(request, pk):
+    """Nur Geändertes neu abgleichen (nachgebuchte/korrigierte Sales), Auflösungen bleiben."""
+    if request.method != 'POST':
+        return redirect('reconciliation:review', pk=pk)
+
+    payout = get_object_or_404(SumUpPayout, pk=pk)
+    if payout.status == SumUpPayout.Status.COMPLETED:
+        messages.error(request, "Abgeschlossener Abgleich kann nicht neu abgeglichen werden.")
+        return redirect('reconciliation:review', pk=pk)
+    if not payout.period_start or not payout.period_end:
+        messages.error(request, "Payout hat keine Periode.")
+        return redirect('reconciliation:review', pk=pk)
+
+    stats = rematch_payout(payout)
+    messages.success(
+        request,
+        f"Neu abgeglichen: {stats['reopened']} offene Zeilen, {stats['sales_added']} neue/geänderte Sales — "
+        f"gematched {stats['matched_before']} → {stats['matched_after']}.",
+    )
+    return redirect('reconciliation:review', pk=pk)
+
+
 @staff_member_required
 def reconciliation_complete(request, pk):
     if request.method != 'POST':
@@ -290,6 +506,8 @@ def reconciliation_complete(request, pk):
         resolution=ReconciliationItem.Resolution.ACCEPTED,
         resolved_at=timezone.now()
     )
+    # Abschluss friert die Summen ein: einmal frisch aggregieren statt Deltas zu vertrauen
+    payout.rebuild_summary()
 
     payout.status = SumUpPayout.Status.COMPLETED
     payout.completed_at = timezone.now()
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     # Eigene Apps
     'commerce',
     'reconciliation',
+    'jobs',
 
     # OIDC (Authentik SSO)
     'mozilla_django_oidc',
@@ -169,6 +170,82 @@ INVOICE_BOUNCE_NOTIFICATION_RECIPIENTS = ['hebammen@mileja.ch']
 STOCK_KEEPER_BASE_URL = os.environ.get('STOCK_KEEPER_BASE_URL', 'https://stock-keeper.mileja.ch')
 
 
+# --- Cache (prozessübergreifend) ---
+# default: Datenbank-Cache (Tabelle via `manage.py createcachetable`). Geteilt
+# von Web-, Event- und Job-Worker; add() ist über den Primärschlüssel atomar —
+# darauf bauen Single-Flight (reconciliation.sync) und der SumUp-Breaker.
+# catalog: nur das Katalog-Versions-Token des Suchindex (core.search). Wird bei
+# jeder Suche gelesen, braucht kein add/incr — dateibasiert auf dem gemeinsamen
+# Docker-Volume, ohne dass jeder Tastendruck MySQL trifft.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', str(BASE_DIR / 'cache')),
+    },
+}
+# Scanner-Fast-Path: Anzahl EANs im prozess-lokalen LRU (core.search.ScanCache)
+SCAN_CACHE_SIZE = 2048
+# Suchindex: Abgleich aller (id, updated_at) gegen spät committete Änderungen
+CATALOG_RECONCILE_SECONDS = 60
+# Offline-Kasse: gepufferte Bar-Verkäufe werden per api/checkout/batch/ nachgebucht.
+# Ältere Einträge als MAX_AGE werden abgelehnt (Kassenbuch ist dann schon abgeschlossen).
+POS_OFFLINE_MAX_AGE_HOURS = 72
+POS_OFFLINE_BATCH_MAX = 200
+
+
+# --- Hintergrund-Jobs (jobs-App, `manage.py run_worker`) ---
+# Backoff nach Fehlversuch n: BASE · 2^(n-1) Sekunden, höchstens MAX.
+JOBS_BACKOFF_BASE_SECONDS = 30
+JOBS_BACKOFF_MAX_SECONDS = 3600
+# RUNNING-Jobs ohne Lebenszeichen (abgestürzter Worker) werden danach neu geclaimt.
+# Laufende Jobs erneuern ihren Lease alle HEARTBEAT Sekunden (locked_at).
+JOBS_LOCK_TIMEOUT_SECONDS = 900
+JOBS_HEARTBEAT_SECONDS = 60
+# Outbox-Jobs (z.B. Rechnungsversand) direkt nach dem Commit im Web-Prozess
+# anstossen; der Worker bleibt das Sicherheitsnetz.
+JOBS_DISPATCH_ON_COMMIT = True
+
+
+
+# --- SumUp-API ---
+# Basis-URL; für Benchmarks/Offline auf den Stand-in zeigen lassen
+# (`manage.py sumup_standin`, z.B. SUMUP_API_BASE=http://127.0.0.1:8765).
+SUMUP_API_BASE = os.environ.get('SUMUP_API_BASE', 'https://api.sumup.com')
+
+# --- SumUp-Transaktionsspiegel (reconciliation.sync) ---
+# Jeder inkrementelle Lauf lädt so viele Tage vor der High-Water-Mark erneut
+# (späte Status-/Refund-Änderungen). Erster Lauf ohne Mark: INITIAL_DAYS zurück.
+SUMUP_SYNC_OVERLAP_DAYS = 7
+SUMUP_SYNC_INITIAL_DAYS = 120
+# Live-Polling (POS-Verifizierung): alle Kassen teilen sich pro TTL-Bucket einen
+# Upstream-Call über die letzten LOOKBACK Minuten (reconciliation.sync.sync_recent).
+SUMUP_RECENT_TTL_SECONDS = 3
+SUMUP_RECENT_LOOKBACK_MINUTES = 20
+# Event-Stream der POS-Verifizierung (ASGI): Prüftakt und maximale Dauer.
+SUMUP_STREAM_INTERVAL_SECONDS = 1
+SUMUP_STREAM_SECONDS = 180
+# HTTP-Client (reconciliation.sumup_client.get_client, einer pro Prozess):
+# Wiederholungen bei 429/5xx, Token-Bucket über alle Threads, parallele Tages-Slices.
+SUMUP_HTTP_RETRIES = 4
+SUMUP_RATE_PER_SECOND = 5
+SUMUP_RATE_BURST = 10
+SUMUP_POOL_SIZE = 8
+SUMUP_FETCH_WORKERS = 4
+# Async-Client (reconciliation.sumup_async): gleichzeitige Requests pro Abgleich
+SUMUP_ASYNC_CONCURRENCY = 8
+# Latenzbudget pro Endpunkt (Read-Timeout je Versuch, Sekunden), Deadline pro
+# Call inkl. Wiederholungen und Backoff (Sekunden) und Circuit Breaker
+# (reconciliation.breaker, Zustand im Cache für alle Prozesse):
+# nach THRESHOLD Fehlern in Folge RESET_SECONDS lang keine Calls an SumUp.
+SUMUP_LATENCY_BUDGETS = {'history': 8, 'transaction': 5, 'payouts': 10}
+SUMUP_CALL_DEADLINES = {'history': 12, 'transaction': 8, 'payouts': 20}
+SUMUP_BREAKER_THRESHOLD = 5
+SUMUP_BREAKER_RESET_SECONDS = 30
+
 # --- JAZZMIN KONFIGURATION ---
 JAZZMIN_SETTINGS = {
     "site_title": "Stock Keeper",
@@ -248,6 +325,8 @@ JAZZMIN_SETTINGS = {
         "auth": "fas fa-users-cog",
         "auth.user": "fas fa-user",
         "auth.Group": "fas fa-users",
+        "jobs.Job": "fas fa-tasks",
+        "jobs.JobRun": "fas fa-stopwatch",
     },
     
     "order_with_respect_to": [
@@ -11,6 +11,11 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'catalog': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'catalog'},
+}
+
 SHOPIFY_WEBHOOK_SECRET = ''
 WEBSHOP_API_TOKEN = 'test-webshop-token'
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'